@@ -0,0 +1,134 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+# Meshtastic modem presets: (spreading factor, bandwidth in Hz, coding rate denominator)
+LORA_PRESETS = {
+    'SHORT_TURBO': (7, 500000, 5),
+    'SHORT_FAST': (7, 250000, 5),
+    'SHORT_SLOW': (8, 250000, 5),
+    'MEDIUM_FAST': (9, 250000, 5),
+    'MEDIUM_SLOW': (10, 250000, 5),
+    'LONG_FAST': (11, 250000, 5),
+    'LONG_MODERATE': (11, 125000, 8),
+    'LONG_SLOW': (12, 125000, 8),
+    'VERY_LONG_SLOW': (12, 62500, 8),
+}
+
+# Values of the ModemPreset enum in the Meshtastic LoRa config
+MODEM_PRESET_NAMES = {
+    0: 'LONG_FAST',
+    1: 'LONG_SLOW',
+    2: 'VERY_LONG_SLOW',
+    3: 'MEDIUM_SLOW',
+    4: 'MEDIUM_FAST',
+    5: 'SHORT_SLOW',
+    6: 'SHORT_FAST',
+    7: 'LONG_MODERATE',
+    8: 'SHORT_TURBO',
+}
+
+DEFAULT_PRESET = 'LONG_FAST'
+PREAMBLE_SYMBOLS = 16
+# Meshtastic packet header plus the protobuf framing around a text payload
+PACKET_OVERHEAD_BYTES = 22
+
+
+def lora_airtime(payload_bytes, spreading_factor, bandwidth, coding_rate=5, preamble_symbols=PREAMBLE_SYMBOLS):
+    """
+    Returns the time on air, in seconds, of a LoRa packet with an explicit header and CRC.
+
+    Follows the formula from the Semtech SX127x datasheet. coding_rate is the denominator of
+    the 4/x coding rate.
+    """
+    symbol_time = (2 ** spreading_factor) / bandwidth
+    low_data_rate = 1 if symbol_time > 0.016 else 0
+    preamble_time = (preamble_symbols + 4.25) * symbol_time
+    payload_symbols = 8 + max(
+        math.ceil((8 * payload_bytes - 4 * spreading_factor + 28 + 16) / (4 * (spreading_factor - 2 * low_data_rate)))
+        * coding_rate, 0)
+    return preamble_time + payload_symbols * symbol_time
+
+
+def get_radio_parameters(interface, preset_name=None):
+    """
+    Returns (spreading factor, bandwidth, coding rate) for the node's LoRa settings.
+
+    preset_name overrides what the node reports. Falls back to LONG_FAST when neither is available.
+    """
+    if preset_name:
+        if preset_name.upper() in LORA_PRESETS:
+            return LORA_PRESETS[preset_name.upper()]
+        logging.warning(f"Unknown modem preset '{preset_name}', reading it from the node instead")
+
+    try:
+        lora = interface.localNode.localConfig.lora
+        if lora.use_preset:
+            return LORA_PRESETS[MODEM_PRESET_NAMES[lora.modem_preset]]
+        if lora.spread_factor and lora.bandwidth and lora.coding_rate:
+            bandwidth = {31: 31250, 62: 62500}.get(lora.bandwidth, lora.bandwidth * 1000)
+            return lora.spread_factor, bandwidth, lora.coding_rate
+    except (AttributeError, KeyError):
+        pass
+
+    logging.warning(f"Unable to read LoRa settings from the node, assuming {DEFAULT_PRESET}")
+    return LORA_PRESETS[DEFAULT_PRESET]
+
+
+class AirtimeBudget:
+    """
+    Rolling-window record of how much airtime the BBS has used.
+
+    Parameters:
+    -----------
+    window : float
+        Length of the rolling window in seconds.
+    max_duty_cycle : float
+        Share of the window, in percent, the BBS may spend transmitting before low value
+        traffic is held back.
+    """
+
+    def __init__(self, window=3600, max_duty_cycle=10.0):
+        self.window = window
+        self.max_duty_cycle = max_duty_cycle
+        self._entries = deque()
+        self._used = 0.0
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._entries and self._entries[0][0] <= now - self.window:
+            self._used -= self._entries.popleft()[1]
+
+    def record(self, airtime, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            self._entries.append((now, airtime))
+            self._used += airtime
+
+    def utilisation(self, now=None):
+        """Returns the percentage of the window spent transmitting."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            return max(self._used, 0.0) / self.window * 100
+
+    def has_room(self, now=None):
+        return self.utilisation(now) < self.max_duty_cycle
+
+    def seconds_until_room(self, now=None):
+        """Returns how long until enough airtime leaves the window to drop below the limit."""
+        now = time.monotonic() if now is None else now
+        limit = self.window * self.max_duty_cycle / 100
+        with self._lock:
+            self._expire(now)
+            excess = self._used - limit
+            if excess < 0:
+                return 0.0
+            for sent_at, airtime in self._entries:
+                excess -= airtime
+                if excess < 0:
+                    return sent_at + self.window - now
+        return self.window
@@ -3,13 +3,12 @@ import logging
 import random
 import time
 
-from meshtastic import BROADCAST_NUM
-
 from db_operations import (
     add_bulletin, add_mail, delete_mail,
-    get_bulletin_content, get_bulletins,
-    get_mail, get_mail_content,
-    add_channel, get_channels, get_sender_id_by_mail_id
+    get_bulletin_content, get_bulletins_page, count_bulletins, get_board_text,
+    get_mail_page, get_mail_content, get_mailbox_summary, mark_mail_read,
+    add_channel, get_channels, get_sender_id_by_mail_id,
+    search_bulletins, search_mail
 )
 from utils import (
     get_node_id_from_num, get_node_info,
@@ -25,6 +24,9 @@ main_menu_items = config['menu']['main_menu_items'].split(',')
 bbs_menu_items = config['menu']['bbs_menu_items'].split(',')
 utilities_menu_items = config['menu']['utilities_menu_items'].split(',')
 
+# Listings are sent a page at a time so a busy board costs a bounded number of packets
+LISTING_PAGE_SIZE = 8
+
 
 def build_menu(items, menu_name):
     menu_str = f"{menu_name}\n"
@@ -61,8 +63,8 @@ def handle_help_command(sender_id, interface, menu_name=None):
             response = build_menu(utilities_menu_items, "🛠️Utilities Menu🛠️")
     else:
         update_user_state(sender_id, {'command': 'MAIN_MENU', 'step': 1})  # Reset to main menu state
-        mail = get_mail(get_node_id_from_num(sender_id, interface))
-        response = build_menu(main_menu_items, f"💾TC² BBS💾 (✉️:{len(mail)})")
+        total, _ = get_mailbox_summary(get_node_id_from_num(sender_id, interface))
+        response = build_menu(main_menu_items, f"💾TC² BBS💾 (✉️:{total})")
     send_message(response, sender_id, interface)
 
 def get_node_name(node_id, interface):
@@ -166,21 +168,14 @@ def handle_bb_steps(sender_id, message, step, state, interface, bbs_nodes):
             handle_help_command(sender_id, interface, 'bbs')
             return
         board_name = boards[int(message)]
-        bulletins = get_bulletins(board_name)
-        response = f"{board_name} has {len(bulletins)} messages.\n[R]ead  [P]ost"
+        response = f"{board_name} has {count_bulletins(board_name)} messages.\n[R]ead  [P]ost"
         send_message(response, sender_id, interface)
         update_user_state(sender_id, {'command': 'BULLETIN_ACTION', 'step': 2, 'board': board_name})
 
     elif step == 2:
         board_name = state['board']
         if message.lower() == 'r':
-            bulletins = get_bulletins(board_name)
-            if bulletins:
-                send_message(f"Select a bulletin number to view from {board_name}:", sender_id, interface)
-                for bulletin in bulletins:
-                    send_message(f"[{bulletin[0]}] {bulletin[1]}", sender_id, interface)
-                update_user_state(sender_id, {'command': 'BULLETIN_READ', 'step': 3, 'board': board_name})
-            else:
+            if not _send_board_page(sender_id, board_name, None, interface):
                 send_message(f"No bulletins in {board_name}.", sender_id, interface)
                 handle_bb_steps(sender_id, 'e', 1, state, interface, bbs_nodes)
         elif message.lower() == 'p':
@@ -196,6 +191,9 @@ def handle_bb_steps(sender_id, message, step, state, interface, bbs_nodes):
             update_user_state(sender_id, {'command': 'BULLETIN_POST', 'step': 4, 'board': board_name})
 
     elif step == 3:
+        if message.lower() == 'm' and state.get('cursor'):
+            _send_board_page(sender_id, state['board'], state['cursor'], interface)
+            return
         bulletin_id = int(message)
         sender_short_name, date, subject, content, unique_id = get_bulletin_content(bulletin_id)
         send_message(f"From: {sender_short_name}\nDate: {date}\nSubject: {subject}\n- - - - - - -\n{content}", sender_id, interface)
@@ -219,7 +217,7 @@ def handle_bb_steps(sender_id, message, step, state, interface, bbs_nodes):
                 update_user_state(sender_id, None)
                 return
             sender_short_name = node_info['user'].get('shortName', f"Node {sender_id}")
-            unique_id = add_bulletin(board, sender_short_name, subject, content, bbs_nodes, interface)
+            unique_id = add_bulletin(board, sender_short_name, subject, content, bbs_nodes, interface).result()
             send_message(f"Your bulletin '{subject}' has been posted to {board}.\n(╯°□°)╯📄📌[{board}]", sender_id, interface)
             handle_bb_steps(sender_id, 'e', 1, state, interface, bbs_nodes)
         else:
@@ -228,6 +226,37 @@ def handle_bb_steps(sender_id, message, step, state, interface, bbs_nodes):
 
 
 
+def _send_board_page(sender_id, board_name, cursor, interface):
+    """Sends one page of board_name's bulletins to pick from by id. Returns False if there were none."""
+    bulletins, next_cursor = get_bulletins_page(board_name, cursor, LISTING_PAGE_SIZE)
+    if not bulletins:
+        return False
+
+    def render():
+        response = f"Select a bulletin number to view from {board_name}:\n"
+        response += "\n".join(f"[{bulletin[0]}] {bulletin[1]}" for bulletin in bulletins)
+        if next_cursor:
+            response += "\n[M]ore"
+        return response
+
+    send_message(get_board_text(board_name, ('read', cursor), render), sender_id, interface)
+    update_user_state(sender_id, {'command': 'BULLETIN_READ', 'step': 3, 'board': board_name, 'cursor': next_cursor})
+    return True
+
+
+def _send_mail_page(sender_id, sender_node_id, cursor, interface):
+    """Sends one page of the sender's mail to pick from by id. Returns False if there was none."""
+    mail, next_cursor = get_mail_page(sender_node_id, cursor, LISTING_PAGE_SIZE)
+    if not mail:
+        return False
+    response = "\n".join(f"-{msg[0]}-\nDate: {msg[3]}\nFrom: {msg[1]}\nSubject: {msg[2]}" for msg in mail)
+    if next_cursor:
+        response += "\n[M]ore"
+    send_message(response, sender_id, interface)
+    update_user_state(sender_id, {'command': 'MAIL', 'step': 2, 'cursor': next_cursor})
+    return True
+
+
 def handle_mail_steps(sender_id, message, step, state, interface, bbs_nodes):
     message = message.strip()
     if len(message) == 2 and message[1] == 'x':
@@ -237,12 +266,10 @@ def handle_mail_steps(sender_id, message, step, state, interface, bbs_nodes):
         choice = message.lower()
         if choice == 'r':
             sender_node_id = get_node_id_from_num(sender_id, interface)
-            mail = get_mail(sender_node_id)
-            if mail:
-                send_message(f"You have {len(mail)} mail messages. Select a message number to read:", sender_id, interface)
-                for msg in mail:
-                    send_message(f"-{msg[0]}-\nDate: {msg[3]}\nFrom: {msg[1]}\nSubject: {msg[2]}", sender_id, interface)
-                update_user_state(sender_id, {'command': 'MAIL', 'step': 2})
+            total, _ = get_mailbox_summary(sender_node_id)
+            if total:
+                send_message(f"You have {total} mail messages. Select a message number to read:", sender_id, interface)
+                _send_mail_page(sender_id, sender_node_id, None, interface)
             else:
                 send_message("There are no messages in your mailbox.📭", sender_id, interface)
                 update_user_state(sender_id, None)
@@ -253,10 +280,14 @@ def handle_mail_steps(sender_id, message, step, state, interface, bbs_nodes):
             handle_help_command(sender_id, interface)
 
     elif step == 2:
+        if message.lower() == 'm' and state.get('cursor'):
+            _send_mail_page(sender_id, get_node_id_from_num(sender_id, interface), state['cursor'], interface)
+            return
         mail_id = int(message)
         try:
             sender_node_id = get_node_id_from_num(sender_id, interface)
             sender, date, subject, content, unique_id = get_mail_content(mail_id, sender_node_id)
+            mark_mail_read(mail_id, sender_node_id)
             send_message(f"Date: {date}\nFrom: {sender}\nSubject: {subject}\n{content}", sender_id, interface)
             send_message("What would you like to do with this message?\n[K]eep  [D]elete  [R]eply", sender_id, interface)
             update_user_state(sender_id, {'command': 'MAIL', 'step': 4, 'mail_id': mail_id, 'unique_id': unique_id, 'sender': sender, 'subject': subject, 'content': content})
@@ -286,7 +317,7 @@ def handle_mail_steps(sender_id, message, step, state, interface, bbs_nodes):
         if message.lower() == "d":
             unique_id = state['unique_id']
             sender_node_id = get_node_id_from_num(sender_id, interface)
-            delete_mail(unique_id, sender_node_id, bbs_nodes, interface)
+            delete_mail(unique_id, sender_node_id, bbs_nodes, interface).result()
             send_message("The message has been deleted 🗑️", sender_id, interface)
             update_user_state(sender_id, None)
         elif message.lower() == "r":
@@ -321,7 +352,7 @@ def handle_mail_steps(sender_id, message, step, state, interface, bbs_nodes):
             recipient_name = get_node_name(recipient_id, interface)
 
             sender_short_name = get_node_short_name(get_node_id_from_num(sender_id, interface), interface)
-            unique_id = add_mail(get_node_id_from_num(sender_id, interface), sender_short_name, recipient_id, subject, content, bbs_nodes, interface)
+            unique_id = add_mail(get_node_id_from_num(sender_id, interface), sender_short_name, recipient_id, subject, content, bbs_nodes, interface).result()
             send_message(f"Mail has been posted to the mailbox of {recipient_name}.\n(╯°□°)╯📨📬", sender_id, interface)
 
             notification_message = f"You have a new mail message from {sender_short_name}. Check your mailbox by responding to this message with CM."
@@ -400,7 +431,7 @@ def handle_channel_directory_steps(sender_id, message, step, state, interface):
     elif step == 4:
         channel_url = message
         channel_name = state['channel_name']
-        add_channel(channel_name, channel_url)
+        add_channel(channel_name, channel_url).result()
         send_message(f"Your channel '{channel_name}' has been added to the directory.", sender_id, interface)
         handle_channel_directory_command(sender_id, interface)
 
@@ -427,7 +458,7 @@ def handle_send_mail_command(sender_id, message, interface, bbs_nodes):
         sender_short_name = get_node_short_name(get_node_id_from_num(sender_id, interface), interface)
 
         unique_id = add_mail(get_node_id_from_num(sender_id, interface), sender_short_name, recipient_id, subject,
-                             content, bbs_nodes, interface)
+                             content, bbs_nodes, interface).result()
         send_message(f"Mail has been sent to {recipient_name}.", sender_id, interface)
 
         notification_message = f"You have a new mail message from {sender_short_name}. Check your mailbox by responding to this message with CM."
@@ -438,21 +469,30 @@ def handle_send_mail_command(sender_id, message, interface, bbs_nodes):
         send_message("Error processing send mail command.", sender_id, interface)
 
 
+def _send_check_mail_page(sender_id, sender_node_id, state, interface):
+    """Sends the next numbered page of the sender's mail, continuing the numbering in state."""
+    mail, cursor = get_mail_page(sender_node_id, state.get('cursor'), LISTING_PAGE_SIZE)
+    if not mail:
+        return False
+    listed = state.get('mail', [])
+
+    response = "📬 You have the following messages:\n" if not listed else ""
+    for i, msg in enumerate(mail, len(listed)):
+        response += f"{i + 1:02d}. From: {msg[1]}, Subject: {msg[2]}\n"
+    response += "\nPlease reply with the number of the message you want to read."
+    if cursor:
+        response += " Send M for more."
+    send_message(response, sender_id, interface)
+
+    update_user_state(sender_id, {'command': 'CHECK_MAIL', 'step': 1, 'mail': listed + mail, 'cursor': cursor})
+    return True
+
+
 def handle_check_mail_command(sender_id, interface):
     try:
         sender_node_id = get_node_id_from_num(sender_id, interface)
-        mail = get_mail(sender_node_id)
-        if not mail:
+        if not _send_check_mail_page(sender_id, sender_node_id, {}, interface):
             send_message("You have no new messages.", sender_id, interface)
-            return
-
-        response = "📬 You have the following messages:\n"
-        for i, msg in enumerate(mail):
-            response += f"{i + 1:02d}. From: {msg[1]}, Subject: {msg[2]}\n"
-        response += "\nPlease reply with the number of the message you want to read."
-        send_message(response, sender_id, interface)
-
-        update_user_state(sender_id, {'command': 'CHECK_MAIL', 'step': 1, 'mail': mail})
 
     except Exception as e:
         logging.error(f"Error processing check mail command: {e}")
@@ -461,6 +501,9 @@ def handle_check_mail_command(sender_id, interface):
 
 def handle_read_mail_command(sender_id, message, state, interface):
     try:
+        if message.strip().lower() == 'm' and state.get('cursor'):
+            _send_check_mail_page(sender_id, get_node_id_from_num(sender_id, interface), state, interface)
+            return
         mail = state.get('mail', [])
         message_number = int(message) - 1
 
@@ -471,6 +514,7 @@ def handle_read_mail_command(sender_id, message, state, interface):
         mail_id = mail[message_number][0]
         sender_node_id = get_node_id_from_num(sender_id, interface)
         sender, date, subject, content, unique_id = get_mail_content(mail_id, sender_node_id)
+        mark_mail_read(mail_id, sender_node_id)
         response = f"Date: {date}\nFrom: {sender}\nSubject: {subject}\n\n{content}"
         send_message(response, sender_id, interface)
         send_message("What would you like to do with this message?\n[K]eep  [D]elete  [R]eply", sender_id, interface)
@@ -492,7 +536,7 @@ def handle_delete_mail_confirmation(sender_id, message, state, interface, bbs_no
         if choice == 'd':
             unique_id = state['unique_id']
             sender_node_id = get_node_id_from_num(sender_id, interface)
-            delete_mail(unique_id, sender_node_id, bbs_nodes, interface)
+            delete_mail(unique_id, sender_node_id, bbs_nodes, interface).result()
             send_message("The message has been deleted 🗑️", sender_id, interface)
             update_user_state(sender_id, None)
         elif choice == 'r':
@@ -519,18 +563,37 @@ def handle_post_bulletin_command(sender_id, message, interface, bbs_nodes):
         _, board_name, subject, content = parts
         sender_short_name = get_node_short_name(get_node_id_from_num(sender_id, interface), interface)
 
-        unique_id = add_bulletin(board_name, sender_short_name, subject, content, bbs_nodes, interface)
+        unique_id = add_bulletin(board_name, sender_short_name, subject, content, bbs_nodes, interface).result()
         send_message(f"Your bulletin '{subject}' has been posted to {board_name}.", sender_id, interface)
 
-        if board_name.lower() == "urgent":
-            notification_message = f"💥NEW URGENT BULLETIN💥\nFrom: {sender_short_name}\nTitle: {subject}"
-            send_message(notification_message, BROADCAST_NUM, interface)
-
     except Exception as e:
         logging.error(f"Error processing post bulletin command: {e}")
         send_message("Error processing post bulletin command.", sender_id, interface)
 
 
+def _send_check_bulletin_page(sender_id, board_name, state, interface):
+    """Sends the next numbered page of board_name, continuing the numbering in state."""
+    cursor = state.get('cursor')
+    bulletins, next_cursor = get_bulletins_page(board_name, cursor, LISTING_PAGE_SIZE)
+    if not bulletins:
+        return False
+    listed = state.get('bulletins', [])
+
+    def render():
+        response = f"📰 Bulletins on {board_name} board:\n" if not listed else ""
+        for i, bulletin in enumerate(bulletins, len(listed)):
+            response += f"[{i+1:02d}] Subject: {bulletin[1]}, From: {bulletin[2]}, Date: {bulletin[3]}\n"
+        response += "\nPlease reply with the number of the bulletin you want to read."
+        if next_cursor:
+            response += " Send M for more."
+        return response
+
+    send_message(get_board_text(board_name, ('check', cursor, len(listed)), render), sender_id, interface)
+    update_user_state(sender_id, {'command': 'CHECK_BULLETIN', 'step': 1, 'board_name': board_name,
+                                  'bulletins': listed + bulletins, 'cursor': next_cursor})
+    return True
+
+
 def handle_check_bulletin_command(sender_id, message, interface):
     try:
         # Split the message only once
@@ -543,18 +606,8 @@ def handle_check_bulletin_command(sender_id, message, interface):
         board_name = parts[1].strip().capitalize() #get board name from quick command and capitalize it
         board_name = boards[next(key for key, value in boards.items() if value == board_name)] #search for board name in list
 
-        bulletins = get_bulletins(board_name)
-        if not bulletins:
+        if not _send_check_bulletin_page(sender_id, board_name, {}, interface):
             send_message(f"No bulletins available on {board_name} board.", sender_id, interface)
-            return
-
-        response = f"📰 Bulletins on {board_name} board:\n"
-        for i, bulletin in enumerate(bulletins):
-            response += f"[{i+1:02d}] Subject: {bulletin[1]}, From: {bulletin[2]}, Date: {bulletin[3]}\n"
-        response += "\nPlease reply with the number of the bulletin you want to read."
-        send_message(response, sender_id, interface)
-
-        update_user_state(sender_id, {'command': 'CHECK_BULLETIN', 'step': 1, 'board_name': board_name, 'bulletins': bulletins})
 
     except Exception as e:
         logging.error(f"Error processing check bulletin command: {e}")
@@ -562,6 +615,9 @@ def handle_check_bulletin_command(sender_id, message, interface):
 
 def handle_read_bulletin_command(sender_id, message, state, interface):
     try:
+        if message.strip().lower() == 'm' and state.get('cursor'):
+            _send_check_bulletin_page(sender_id, state['board_name'], state, interface)
+            return
         bulletins = state.get('bulletins', [])
         message_number = int(message) - 1
 
@@ -583,6 +639,60 @@ def handle_read_bulletin_command(sender_id, message, state, interface):
         send_message("Error processing read bulletin command.", sender_id, interface)
 
 
+def handle_search_command(sender_id, message, interface):
+    try:
+        parts = message.split(",,", 1)
+        if len(parts) != 2 or not parts[1].strip():
+            send_message("Search Quick Command format:\nSB,,keywords", sender_id, interface)
+            return
+
+        query = parts[1].strip()
+        sender_node_id = get_node_id_from_num(sender_id, interface)
+        bulletins = search_bulletins(query)
+        mail = search_mail(sender_node_id, query)
+        if not bulletins and not mail:
+            send_message(f"Nothing found for '{query}'.", sender_id, interface)
+            return
+
+        results = [('bulletin', bulletin) for bulletin in bulletins] + [('mail', msg) for msg in mail]
+        response = f"🔎 Results for '{query}':\n"
+        for i, (kind, row) in enumerate(results):
+            if kind == 'bulletin':
+                response += f"[{i+1:02d}] 📰 {row[5]}: {row[1]}, From: {row[2]}, Date: {row[3]}\n"
+            else:
+                response += f"[{i+1:02d}] 📬 {row[2]}, From: {row[1]}, Date: {row[3]}\n"
+        response += "\nPlease reply with the number of the result you want to read."
+        send_message(response, sender_id, interface)
+
+        update_user_state(sender_id, {'command': 'SEARCH', 'step': 1, 'results': results})
+
+    except Exception as e:
+        logging.error(f"Error processing search command: {e}")
+        send_message("Error processing search command.", sender_id, interface)
+
+
+def handle_read_search_result(sender_id, message, state, interface):
+    try:
+        results = state.get('results', [])
+        result_number = int(message) - 1
+
+        if result_number < 0 or result_number >= len(results):
+            send_message("Invalid result number. Please try again.", sender_id, interface)
+            return
+
+        kind, row = results[result_number]
+        if kind == 'bulletin':
+            handle_read_bulletin_command(sender_id, '1', {'bulletins': [row]}, interface)
+        else:
+            handle_read_mail_command(sender_id, '1', {'mail': [row]}, interface)
+
+    except ValueError:
+        send_message("Invalid input. Please enter a valid result number.", sender_id, interface)
+    except Exception as e:
+        logging.error(f"Error processing read search result: {e}")
+        send_message("Error processing read search result.", sender_id, interface)
+
+
 def handle_post_channel_command(sender_id, message, interface):
     try:
         parts = message.split("|", 3)
@@ -592,7 +702,7 @@ def handle_post_channel_command(sender_id, message, interface):
 
         _, channel_name, channel_url = parts
         bbs_nodes = interface.bbs_nodes
-        add_channel(channel_name, channel_url, bbs_nodes, interface)
+        add_channel(channel_name, channel_url, bbs_nodes, interface).result()
         send_message(f"Channel '{channel_name}' has been added to the directory.", sender_id, interface)
 
     except Exception as e:
@@ -664,5 +774,5 @@ def handle_list_channels_command(sender_id, interface):
 
 def handle_quick_help_command(sender_id, interface):
     response = ("✈️QUICK COMMANDS✈️\nSend command below for usage info:\nSM,, - Send "
-                "Mail\nCM - Check Mail\nPB,, - Post Bulletin\nCB,, - Check Bulletins\n")
+                "Mail\nCM - Check Mail\nPB,, - Post Bulletin\nCB,, - Check Bulletins\nSB,, - Search\n")
     send_message(response, sender_id, interface)
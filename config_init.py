@@ -91,6 +91,10 @@ def initialize_config(config_file: str = None) -> dict[str, Any]:
     hostname - host name for TCP interface
     port - serial port name for serial interface
     bbs_nodes - list of peer nodes to sync with
+    transmit - settings for the outbound transmit scheduler
+    sync - settings for syncing with other BBS nodes
+    database - settings for the database connection pool and writer
+    retention - age and count limits after which bulletins and mail expire
 
     Args:
         config_file (str, optional): Path to config file. Function reads from './config.ini' if this arg is set to None. Defaults to None.
@@ -114,12 +118,80 @@ def initialize_config(config_file: str = None) -> dict[str, Any]:
 
     print(f"Configured to sync with the following BBS nodes: {bbs_nodes}")
 
+    sync = {
+        'wire_format': config.get('sync', 'wire_format', fallback='compact').lower(),
+        'reconcile_interval': config.getint('sync', 'reconcile_interval', fallback=1800),
+        'batch_window': config.getfloat('sync', 'batch_window', fallback=5.0),
+        'batch_max_records': config.getint('sync', 'batch_max_records', fallback=10),
+        'outbox': config.getboolean('sync', 'outbox', fallback=True),
+        'outbox_retry_interval': config.getint('sync', 'outbox_retry_interval', fallback=600),
+        'outbox_max_attempts': config.getint('sync', 'outbox_max_attempts', fallback=10),
+        'peer_failure_threshold': config.getint('sync', 'peer_failure_threshold', fallback=3),
+        'peer_stale_after': config.getint('sync', 'peer_stale_after', fallback=86400),
+        'multicast_channel': config.getint('sync', 'multicast_channel', fallback=None),
+        'tombstone_min_age': config.getint('sync', 'tombstone_min_age', fallback=86400),
+    }
+
     allowed_nodes = config.get('allow_list', 'allowed_nodes', fallback='').split(',')
     if allowed_nodes == ['']:
         allowed_nodes = []
 
     print(f"Nodes with Urgent board permissions: {allowed_nodes}")
 
+    transmit = {
+        'queue_size': config.getint('transmit', 'queue_size', fallback=500),
+        'sync_queue_size': config.getint('transmit', 'sync_queue_size', fallback=200),
+        'radio_interval': config.getfloat('transmit', 'radio_interval', fallback=1.0),
+        'destination_interval': config.getfloat('transmit', 'destination_interval', fallback=2.0),
+        'max_payload_bytes': config.getint('transmit', 'max_payload_bytes', fallback=200),
+        'modem_preset': config.get('transmit', 'modem_preset', fallback=None),
+        'airtime_window': config.getint('transmit', 'airtime_window', fallback=3600),
+        'max_duty_cycle': config.getfloat('transmit', 'max_duty_cycle', fallback=10.0),
+        'max_defer': config.getint('transmit', 'max_defer', fallback=0),
+        'aging_interval': config.getint('transmit', 'aging_interval', fallback=60),
+        'ack_timeout': config.getint('transmit', 'ack_timeout', fallback=60),
+        'max_retries': config.getint('transmit', 'max_retries', fallback=2),
+        'retry_backoff': config.getint('transmit', 'retry_backoff', fallback=10),
+        'stats_interval': config.getint('transmit', 'stats_interval', fallback=300),
+    }
+
+    synchronous = config.get('database', 'synchronous', fallback='NORMAL').upper()
+    if synchronous not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        raise ValueError(f"Invalid database synchronous setting: {synchronous}")
+
+    database = {
+        'path': config.get('database', 'path', fallback='bulletins.db'),
+        'max_connections': config.getint('database', 'max_connections', fallback=8),
+        'busy_timeout': config.getfloat('database', 'busy_timeout', fallback=5.0),
+        'synchronous': synchronous,
+        'cache_size': config.getint('database', 'cache_size', fallback=8192),
+        'write_batch_size': config.getint('database', 'write_batch_size', fallback=100),
+        'write_delay': config.getfloat('database', 'write_delay', fallback=0.05),
+        'compress_threshold': config.getint('database', 'compress_threshold', fallback=0),
+        'compress_level': config.getint('database', 'compress_level', fallback=9),
+        'ram_mode': config.getboolean('database', 'ram_mode', fallback=False),
+        'checkpoint_interval': config.getfloat('database', 'checkpoint_interval', fallback=300),
+        'journal_sync_interval': config.getfloat('database', 'journal_sync_interval', fallback=5),
+    }
+
+    board_limits = {}
+    for entry in config.get('retention', 'board_limits', fallback='').split(','):
+        if not entry.strip():
+            continue
+        board, max_age, max_count = (part.strip() for part in entry.split(':'))
+        board_limits[board.lower()] = (float(max_age or 0), int(max_count or 0))
+
+    retention = {
+        'interval': config.getint('retention', 'interval', fallback=3600),
+        'batch_size': config.getint('retention', 'batch_size', fallback=100),
+        'vacuum_pages': config.getint('retention', 'vacuum_pages', fallback=256),
+        'bulletin_max_age': config.getfloat('retention', 'bulletin_max_age', fallback=0),
+        'bulletin_max_count': config.getint('retention', 'bulletin_max_count', fallback=0),
+        'mail_max_age': config.getfloat('retention', 'mail_max_age', fallback=0),
+        'mail_max_count': config.getint('retention', 'mail_max_count', fallback=0),
+        'boards': board_limits,
+    }
+
     return {
         'config': config,
         'interface_type': interface_type,
@@ -127,6 +199,10 @@ def initialize_config(config_file: str = None) -> dict[str, Any]:
         'port': port,
         'bbs_nodes': bbs_nodes,
         'allowed_nodes': allowed_nodes,
+        'transmit': transmit,
+        'sync': sync,
+        'database': database,
+        'retention': retention,
         'mqtt_topic': 'meshtastic.receive'
     }
 
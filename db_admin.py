@@ -1,47 +1,43 @@
+import configparser
 import os
-import sqlite3
-import threading
-
-thread_local = threading.local()
-
-def get_db_connection():
-    if not hasattr(thread_local, 'connection'):
-        thread_local.connection = sqlite3.connect('bulletins.db')
-    return thread_local.connection
+import time
+
+from db_compression import body_codec, configure_compression, recompress, train_dictionary
+from db_connection import DEFAULT_DATABASE_PATH, close_database, configure_database, get_db_connection
+from db_memory import ram_mode_owner
+from db_schema import DISPLAY_DATE, migrate
+
+# Process id of a BBS serving the database from memory, which would overwrite any change made here
+ram_mode_pid = None
+
+def initialize_database(config_file='config.ini'):
+    global ram_mode_pid
+    # Use the same database file as the BBS
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    path = config.get('database', 'path', fallback=DEFAULT_DATABASE_PATH)
+    configure_database(path)
+    configure_compression(config.getint('database', 'compress_threshold', fallback=0),
+                          config.getint('database', 'compress_level', fallback=9))
+    ram_mode_pid = ram_mode_owner(path)
+    if ram_mode_pid:
+        print_bold(f"The BBS (process {ram_mode_pid}) is running with ram_mode on and will overwrite this database file.")
+        print_bold("Listings may be out of date, and changes are disabled until it is stopped.")
+        print_separator()
+        return
+    migrate(get_db_connection())
 
-def initialize_database():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS bulletins (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    board TEXT NOT NULL,
-                    sender_short_name TEXT NOT NULL,
-                    date TEXT NOT NULL,
-                    subject TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    unique_id TEXT NOT NULL
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS mail (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sender TEXT NOT NULL,
-                    sender_short_name TEXT NOT NULL,
-                    recipient TEXT NOT NULL,
-                    date TEXT NOT NULL,
-                    subject TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    unique_id TEXT NOT NULL
-                );''')
-    c.execute('''CREATE TABLE IF NOT EXISTS channels (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    url TEXT NOT NULL
-                );''')
-    conn.commit()
+def refuse_changes():
+    if ram_mode_pid:
+        print_bold("Stop the BBS first: it is running with ram_mode on and would overwrite the change.")
+        print_separator()
+        return True
+    return False
 
 def list_bulletins():
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT id, board, sender_short_name, date, subject, unique_id FROM bulletins")
+    c.execute(f"SELECT id, board, sender_short_name, {DISPLAY_DATE}, subject, unique_id FROM bulletins")
     bulletins = c.fetchall()
     if bulletins:
         print_bold("Bulletins:")
@@ -55,7 +51,7 @@ def list_bulletins():
 def list_mail():
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT id, sender, sender_short_name, recipient, date, subject, unique_id FROM mail")
+    c.execute(f"SELECT id, sender, sender_short_name, recipient, {DISPLAY_DATE}, subject, unique_id FROM mail")
     mail = c.fetchall()
     if mail:
         print_bold("Mail:")
@@ -81,6 +77,8 @@ def list_channels():
     return channels
 
 def delete_bulletin():
+    if refuse_changes():
+        return
     bulletins = list_bulletins()
     if bulletins:
         bulletin_ids = input_bold("Enter the bulletin ID(s) to delete (comma-separated) or 'X' to cancel: ").split(',')
@@ -91,12 +89,17 @@ def delete_bulletin():
         conn = get_db_connection()
         c = conn.cursor()
         for bulletin_id in bulletin_ids:
+            # The tombstone tells the other BBS nodes about the delete when they next reconcile
+            c.execute("INSERT OR IGNORE INTO tombstones (unique_id, record_type, deleted_at) "
+                      "SELECT unique_id, 'BULLETIN', ? FROM bulletins WHERE id = ?", (time.time(), bulletin_id.strip()))
             c.execute("DELETE FROM bulletins WHERE id = ?", (bulletin_id.strip(),))
         conn.commit()
         print_bold(f"Bulletin(s) with ID(s) {', '.join(bulletin_ids)} deleted.")
         print_separator()
 
 def delete_mail():
+    if refuse_changes():
+        return
     mail = list_mail()
     if mail:
         mail_ids = input_bold("Enter the mail ID(s) to delete (comma-separated) or 'X' to cancel: ").split(',')
@@ -107,12 +110,16 @@ def delete_mail():
         conn = get_db_connection()
         c = conn.cursor()
         for mail_id in mail_ids:
+            c.execute("INSERT OR IGNORE INTO tombstones (unique_id, record_type, deleted_at) "
+                      "SELECT unique_id, 'MAIL', ? FROM mail WHERE id = ?", (time.time(), mail_id.strip()))
             c.execute("DELETE FROM mail WHERE id = ?", (mail_id.strip(),))
         conn.commit()
         print_bold(f"Mail with ID(s) {', '.join(mail_ids)} deleted.")
         print_separator()
 
 def delete_channel():
+    if refuse_changes():
+        return
     channels = list_channels()
     if channels:
         channel_ids = input_bold("Enter the channel ID(s) to delete (comma-separated) or 'X' to cancel: ").split(',')
@@ -128,6 +135,48 @@ def delete_channel():
         print_bold(f"Channel(s) with ID(s) {', '.join(channel_ids)} deleted.")
         print_separator()
 
+def database_size(c):
+    c.execute("PRAGMA page_count")
+    page_count = c.fetchone()[0]
+    c.execute("PRAGMA freelist_count")
+    free = c.fetchone()[0]
+    c.execute("PRAGMA page_size")
+    return (page_count - free) * c.fetchone()[0]
+
+def compress_bodies():
+    if refuse_changes():
+        return
+    if not body_codec.threshold:
+        print_bold("Compression is off. Set compress_threshold in the [database] section of config.ini first.")
+        print_separator()
+        return
+    conn = get_db_connection()
+    c = conn.cursor()
+    size = database_size(c)
+
+    # Train on recent posts, which are the most like the ones still to come
+    samples = []
+    for table in ('bulletins', 'mail'):
+        c.execute(f"SELECT bbs_body(content) FROM {table} ORDER BY created_at DESC LIMIT 2000")
+        samples += [row[0] for row in c.fetchall()]
+    dictionary = train_dictionary(samples)
+    if dictionary:
+        dictionary_id = body_codec.install(c, dictionary)
+        conn.commit()
+        print_bold(f"Trained compression dictionary {dictionary_id} ({len(dictionary)} bytes) on {len(samples)} posts.")
+    else:
+        print_bold("Not enough posts to train a compression dictionary.")
+
+    for table in ('bulletins', 'mail'):
+        last_id = 0
+        while last_id is not None:
+            last_id = recompress(c, table, last_id, 500)
+            conn.commit()
+    # Bodies shrink in place, leaving pages part empty, so only a full VACUUM gives the space back
+    conn.execute("VACUUM")
+    print_bold(f"Bulletin and mail bodies compressed, {size // 1024} KiB of data is now {database_size(c) // 1024} KiB.")
+    print_separator()
+
 def display_menu():
     print("Menu:")
     print("1. List Bulletins")
@@ -136,7 +185,8 @@ def display_menu():
     print("4. Delete Bulletins")
     print("5. Delete Mail")
     print("6. Delete Channels")
-    print("7. Exit")
+    print("7. Compress Bodies")
+    print("8. Exit")
 
 def display_banner():
     banner = """
@@ -186,6 +236,9 @@ def main():
         elif choice == '6':
             delete_channel()
         elif choice == '7':
+            compress_bodies()
+        elif choice == '8':
+            close_database()
             break
         else:
             print_bold("Invalid choice. Please try again.")
@@ -0,0 +1,178 @@
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+
+# A compressed body is stored as a BLOB: one byte naming the dictionary it was compressed with,
+# 0 for none, followed by raw deflate data. Bodies stored as TEXT are not compressed.
+NO_DICTIONARY = 0
+MAX_DICTIONARY_ID = 255
+
+# Deflate can only refer back 32 KiB, so a larger dictionary would never be used
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+
+class BodyCodec:
+    """
+    Transparent compression of bulletin and mail bodies.
+
+    Bodies of at least threshold bytes are deflated, with the newest trained dictionary if there
+    is one, and kept compressed only if that makes them smaller. Short bodies, which deflate
+    cannot shrink, are stored as plain text. Dictionaries are never changed once stored, so a body
+    can always be read back with the one it names.
+
+    Parameters:
+    -----------
+    threshold : int
+        Size in bytes from which bodies are compressed. 0, the default, turns compression off, as
+        BBS versions before schema version 9 and other SQLite clients cannot read compressed bodies.
+    level : int
+        zlib compression level, 1 to 9.
+    """
+
+    def __init__(self, threshold=0, level=9):
+        self.threshold = threshold
+        self.level = level
+
+        self._dictionaries = {}
+        self._current = NO_DICTIONARY
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def compress(self, c, text):
+        """Returns text as it should be stored, compressed if that is worthwhile. c is the writing cursor."""
+        if not self.threshold or not isinstance(text, str):
+            return text
+        raw = text.encode('utf-8')
+        if len(raw) < self.threshold:
+            return text
+        if not self._loaded:
+            self._load(c)
+        dictionary_id = self._current
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15,
+                                      **_zdict(self._dictionaries.get(dictionary_id)))
+        data = bytes([dictionary_id]) + compressor.compress(raw) + compressor.flush()
+        return data if len(data) < len(raw) else text
+
+    def decompress(self, content, path=None):
+        """
+        Returns the text of a stored body, whether it was compressed or not. path is the database
+        it came from, where a dictionary not loaded yet is read from.
+        """
+        if not isinstance(content, bytes):
+            return content
+        dictionary_id = content[0]
+        dictionary = None
+        if dictionary_id != NO_DICTIONARY:
+            dictionary = self._dictionaries.get(dictionary_id)
+            if dictionary is None:
+                dictionary = self._fetch(dictionary_id, path)
+        decompressor = zlib.decompressobj(-15, **_zdict(dictionary))
+        return (decompressor.decompress(content[1:]) + decompressor.flush()).decode('utf-8')
+
+    def install(self, c, dictionary):
+        """Stores a new dictionary and compresses with it from now on. Returns its id."""
+        if not self._loaded:
+            self._load(c)
+        c.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM compression_dictionaries")
+        dictionary_id = c.fetchone()[0]
+        if dictionary_id > MAX_DICTIONARY_ID:
+            raise ValueError(f"No more than {MAX_DICTIONARY_ID} compression dictionaries can be stored")
+        c.execute("INSERT INTO compression_dictionaries (id, dictionary, created_at) VALUES (?, ?, ?)",
+                  (dictionary_id, dictionary, int(time.time() * 1000)))
+        # Bodies compressed with it are decompressed by triggers before the transaction commits
+        with self._lock:
+            self._dictionaries[dictionary_id] = dictionary
+            self._current = dictionary_id
+        return dictionary_id
+
+    def _load(self, c):
+        try:
+            c.execute("SELECT id, dictionary FROM compression_dictionaries")
+            rows = c.fetchall()
+        except sqlite3.OperationalError:
+            # Not migrated yet
+            rows = []
+        with self._lock:
+            self._dictionaries.update((dictionary_id, bytes(dictionary)) for dictionary_id, dictionary in rows)
+            self._current = max(self._dictionaries, default=NO_DICTIONARY)
+            self._loaded = True
+
+    def _fetch(self, dictionary_id, path):
+        # Called from inside SQL statements, so it reads with a connection of its own. A dictionary
+        # this process has not seen was trained by db_admin since it was loaded.
+        if path is None:
+            raise ValueError(f"Compression dictionary {dictionary_id} is not loaded")
+        conn = sqlite3.connect(path, uri=path.startswith('file:'))
+        try:
+            self._load(conn.cursor())
+        finally:
+            conn.close()
+        dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            raise ValueError(f"Unknown compression dictionary {dictionary_id}")
+        return dictionary
+
+
+def _zdict(dictionary):
+    return {'zdict': dictionary} if dictionary else {}
+
+
+body_codec = BodyCodec()
+
+
+def configure_compression(threshold=0, level=9):
+    body_codec.threshold = threshold
+    body_codec.level = level
+
+
+def register_functions(conn, path):
+    """Makes bbs_body(content), the text of a stored body, available to SQL on conn, a connection to path."""
+    conn.create_function('bbs_body', 1, lambda content: body_codec.decompress(content, path), deterministic=True)
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE):
+    """
+    Builds a deflate dictionary from sample bodies: the word runs that turn up in the most
+    samples, weighted by length, with the most valuable last, where deflate reaches them cheapest.
+    It is kept to an eighth of the samples' size, as it is stored in the database too.
+    """
+    size = min(size, sum(len(sample) for sample in samples) // 8)
+    counts = Counter()
+    for sample in samples:
+        words = sample.split(' ')
+        runs = set()
+        for length in (1, 2, 3, 4):
+            for start in range(len(words) - length + 1):
+                run = ' '.join(words[start:start + length])
+                if len(run) > 3:
+                    runs.add(run)
+        counts.update(runs)
+
+    chosen = []
+    total = 0
+    for run, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2:
+            continue
+        encoded = run.encode('utf-8') + b' '
+        if total + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        total += len(encoded)
+    return b''.join(reversed(chosen))
+
+
+def recompress(c, table, after_id, batch_size):
+    """
+    Rewrites up to batch_size bodies of table with ids above after_id with the current settings.
+    Returns the last id rewritten, or None when there are none left.
+    """
+    c.execute(f"SELECT id, content, bbs_body(content) FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+              (after_id, batch_size))
+    rows = c.fetchall()
+    for row_id, content, text in rows:
+        stored = body_codec.compress(c, text)
+        if stored != content:
+            c.execute(f"UPDATE {table} SET content = ? WHERE id = ?", (stored, row_id))
+    return rows[-1][0] if rows else None
@@ -0,0 +1,180 @@
+import logging
+import sqlite3
+import threading
+import time
+import weakref
+
+from db_compression import register_functions
+
+DEFAULT_DATABASE_PATH = 'bulletins.db'
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections to one database file, handed out one per thread.
+
+    A thread keeps the connection it was given until it exits, when any transaction it left open
+    is rolled back and the connection goes back to the pool for the next thread. At most
+    max_connections are open at once; a thread asking for one beyond that waits up to
+    busy_timeout seconds for another thread to finish. Every connection is put into WAL mode, so
+    readers never block the writer, and waits busy_timeout seconds for a lock instead of failing
+    straight away with "database is locked".
+
+    Parameters:
+    -----------
+    path : str
+        Path of the database file.
+    max_connections : int
+        Maximum number of connections open at the same time.
+    busy_timeout : float
+        Seconds to wait for a lock held by another connection, or for a free connection.
+    synchronous : str
+        SQLite synchronous setting. NORMAL is safe in WAL mode and only risks the last
+        transactions on power loss, not corruption.
+    cache_size : int
+        Page cache size of each connection, in KiB.
+    """
+
+    def __init__(self, path=DEFAULT_DATABASE_PATH, max_connections=8, busy_timeout=5.0, synchronous='NORMAL',
+                 cache_size=8192):
+        self.path = path
+        self.max_connections = max_connections
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+
+        self._local = threading.local()
+        self._condition = threading.Condition()
+        self._idle = []
+        self._open = 0
+        self._closed = False
+
+    def connection(self):
+        """Returns the calling thread's connection, taking one from the pool if it has none."""
+        conn = getattr(self._local, 'connection', None)
+        if conn is not None:
+            return conn
+
+        with self._condition:
+            deadline = time.monotonic() + self.busy_timeout
+            while not self._idle and self._open >= self.max_connections and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(f"No database connection free after {self.busy_timeout}s "
+                                                   f"({self.max_connections} in use)")
+                self._condition.wait(timeout=remaining)
+            if self._closed:
+                raise sqlite3.ProgrammingError("Database connection pool is closed")
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                self._open += 1
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._condition:
+                    self._open -= 1
+                    self._condition.notify()
+                raise
+
+        # Hand the connection back when the thread that holds it ends
+        owner = _Owner()
+        weakref.finalize(owner, self._return, conn)
+        self._local.owner = owner
+        self._local.connection = conn
+        return conn
+
+    def release(self):
+        """Gives the calling thread's connection back to the pool before the thread ends."""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            return
+        del self._local.connection
+        # Dropping the owner runs its finalizer, which returns the connection
+        del self._local.owner
+
+    def close(self):
+        """Closes every idle connection and each busy one as soon as its thread gives it back."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for conn in idle:
+            conn.close()
+        conn = getattr(self._local, 'connection', None)
+        if conn is not None:
+            self.release()
+
+    def get_stats(self):
+        with self._condition:
+            return {'open': self._open, 'idle': len(self._idle), 'max': self.max_connections}
+
+    def _connect(self):
+        uri = self.path.startswith('file:')
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False, uri=uri)
+        if uri and 'vfs=memdb' in self.path:
+            # The in-memory database of db_memory has no WAL. Its pages are in RAM already, and
+            # spilling them mid-transaction would lock out a checkpoint until the commit.
+            conn.execute("PRAGMA cache_spill=OFF")
+        else:
+            journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            if journal_mode.lower() != 'wal':
+                logging.warning(f"Database {self.path} is using journal mode {journal_mode}, not WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={-int(self.cache_size)}")
+        register_functions(conn, self.path)
+        return conn
+
+    def _return(self, conn):
+        if conn.in_transaction:
+            logging.warning("Rolling back a database transaction left open by a finished thread")
+            conn.rollback()
+        with self._condition:
+            if not self._closed:
+                self._idle.append(conn)
+                self._condition.notify()
+                return
+            self._open -= 1
+        conn.close()
+
+
+class _Owner:
+    """Placeholder kept in a thread's local storage; it is freed, and its finalizer run, when the thread ends."""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_database(path=DEFAULT_DATABASE_PATH, **settings):
+    """Sets up the connection pool used by get_db_connection, closing any previous one."""
+    global _pool
+    with _pool_lock:
+        previous, _pool = _pool, ConnectionPool(path, **settings)
+    if previous is not None:
+        previous.close()
+    return _pool
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+
+def get_db_connection():
+    return get_pool().connection()
+
+
+def close_database():
+    """Closes the connection pool, at shutdown."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,269 @@
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from db_compression import register_functions
+
+
+def ram_mode_owner(path):
+    """Returns the process id of a BBS serving the database at path from memory, or None."""
+    try:
+        with open(f"{path}-ram", 'r') as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        # Left behind by a BBS that did not shut down cleanly
+        return None
+    except PermissionError:
+        pass
+    return pid
+
+
+class MemoryDatabase:
+    """
+    Keeps the whole BBS database in RAM, so no read or write waits on the SD card.
+
+    load() copies the database file into an in-memory database with the SQLite backup API, and
+    the connection pool is then pointed at uri. Every transaction the database writer commits is
+    also appended to a redo journal next to the file, as the statements that made it. A thread
+    flushes the journal to disk every journal_sync_interval seconds, which bounds what a power cut
+    can lose, and every checkpoint_interval seconds backs the in-memory database up to the file
+    and empties the journal. On the next start the journal is replayed over the file, so a crash
+    loses at most the last journal_sync_interval seconds of writes.
+
+    While it runs, a lock file next to the database holds the server's process id, so db_admin
+    knows that changes written to the file would be overwritten by the next checkpoint.
+
+    Parameters:
+    -----------
+    path : str
+        Path of the database file.
+    checkpoint_interval : float
+        Seconds between backups of the in-memory database to the file.
+    journal_sync_interval : float
+        Seconds between flushes of the journal to disk. 0 flushes it on every commit.
+    """
+
+    def __init__(self, path, checkpoint_interval=300, journal_sync_interval=5):
+        self.path = path
+        self.journal_path = f"{path}-redo"
+        self.lock_path = f"{path}-ram"
+        self.checkpoint_interval = checkpoint_interval
+        self.journal_sync_interval = journal_sync_interval
+        # memdb databases whose name starts with / are shared by every connection in the process
+        self.uri = f"file:/bbs-{id(self)}?vfs=memdb"
+
+        self._conn = None
+        self._journal = None
+        self._sequence = 0
+        self._unsynced = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._stats = {
+            'load_ms': 0.0,
+            'replayed': 0,
+            'journaled': 0,
+            'checkpoints': 0,
+            'last_checkpoint_ms': 0.0,
+            'max_checkpoint_ms': 0.0,
+        }
+
+    def load(self):
+        """Copies the database file into memory and replays the journal left by an unclean shutdown."""
+        started = time.monotonic()
+        with open(self.lock_path, 'w') as f:
+            f.write(str(os.getpid()))
+        # This connection keeps the in-memory database alive; it is freed with the last one closed
+        self._conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False, isolation_level=None)
+        register_functions(self._conn, self.uri)
+        if os.path.exists(self.path):
+            disk = sqlite3.connect(self.path)
+            try:
+                # Checkpoints replace the file, which would leave a WAL file behind belonging to the old one
+                disk.execute("PRAGMA journal_mode=DELETE")
+                disk.backup(self._conn)
+            finally:
+                disk.close()
+
+        self._sequence = self._checkpointed_sequence()
+        replayed = 0
+        for sequence, statements in self._read_journal():
+            if sequence <= self._sequence:
+                continue
+            self._conn.execute("BEGIN")
+            for sql, params in statements:
+                self._conn.execute(sql, _decode(params))
+            self._conn.execute("COMMIT")
+            self._sequence = sequence
+            replayed += 1
+
+        self._journal = open(self.journal_path, 'ab')
+        with self._lock:
+            self._stats['load_ms'] = (time.monotonic() - started) * 1000
+            self._stats['replayed'] = replayed
+        logging.info(f"Loaded database {self.path} into memory in {self._stats['load_ms']:.0f} ms, "
+                     f"replayed {replayed} journaled commit(s)")
+
+    def start(self):
+        """Checkpoints straight away, so the file has the current schema, then starts the checkpoint thread."""
+        self.checkpoint()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='db-checkpoint', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the checkpoint thread and writes a final checkpoint. Stop the database writer first."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.checkpoint()
+        self._journal.close()
+        self._conn.close()
+        os.remove(self.lock_path)
+
+    def cursor(self, c):
+        """Wraps a writer cursor so the statements that change the database are recorded."""
+        return JournalCursor(c)
+
+    def commit(self, conn, c):
+        """Commits the writer's transaction and journals it, with no checkpoint in between."""
+        with self._lock:
+            conn.commit()
+            if not c.statements:
+                return
+            self._sequence += 1
+            record = json.dumps({'sequence': self._sequence, 'statements': c.statements}, separators=(',', ':'))
+            # Written through to the OS straight away so only a power cut, not a crash, can lose it
+            self._journal.write(record.encode('utf-8') + b'\n')
+            self._journal.flush()
+            if self.journal_sync_interval:
+                self._unsynced = True
+            else:
+                os.fsync(self._journal.fileno())
+            self._stats['journaled'] += 1
+
+    def checkpoint(self):
+        """Backs the in-memory database up to the file and empties the journal. Returns the time taken in ms."""
+        with self._lock:
+            started = time.monotonic()
+            # The backup is written to a new file that replaces the old one in one step, so a crash
+            # always leaves a complete file whose recorded sequence says which journal records it has
+            temporary = f"{self.path}-checkpoint"
+            disk = sqlite3.connect(temporary)
+            try:
+                self._conn.backup(disk)
+                disk.execute("INSERT OR REPLACE INTO memory_checkpoint (id, sequence) VALUES (1, ?)", (self._sequence,))
+                disk.commit()
+            finally:
+                disk.close()
+            with open(temporary, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(temporary, self.path)
+            self._journal.truncate(0)
+            self._unsynced = False
+
+            elapsed = (time.monotonic() - started) * 1000
+            self._stats['checkpoints'] += 1
+            self._stats['last_checkpoint_ms'] = elapsed
+            self._stats['max_checkpoint_ms'] = max(self._stats['max_checkpoint_ms'], elapsed)
+        return elapsed
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logging.info(f"MEMORY DB: loaded in {stats['load_ms']:.0f} ms ({stats['replayed']} replayed), "
+                     f"{stats['journaled']} commit(s) journaled, {stats['checkpoints']} checkpoint(s), "
+                     f"last {stats['last_checkpoint_ms']:.0f} ms, max {stats['max_checkpoint_ms']:.0f} ms")
+
+    def _run(self):
+        last_checkpoint = time.monotonic()
+        interval = min(self.journal_sync_interval or self.checkpoint_interval, self.checkpoint_interval)
+        while not self._stop.wait(interval):
+            try:
+                if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    last_checkpoint = time.monotonic()
+                    elapsed = self.checkpoint()
+                    logging.debug(f"Checkpointed in-memory database to {self.path} in {elapsed:.0f} ms")
+                else:
+                    self._sync_journal()
+            except Exception as e:
+                logging.error(f"Error checkpointing in-memory database: {e}")
+
+    def _sync_journal(self):
+        with self._lock:
+            if self._unsynced:
+                os.fsync(self._journal.fileno())
+                self._unsynced = False
+
+    def _checkpointed_sequence(self):
+        try:
+            row = self._conn.execute("SELECT sequence FROM memory_checkpoint WHERE id = 1").fetchone()
+        except sqlite3.OperationalError:
+            # Not migrated yet, so never checkpointed
+            return 0
+        return row[0] if row else 0
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last record was cut short by the crash and never committed
+                    logging.warning(f"Ignoring incomplete record at the end of {self.journal_path}")
+                    return
+                yield record['sequence'], record['statements']
+
+
+class JournalCursor:
+    """
+    Cursor that records each statement that changes the database, with its parameters, for
+    MemoryDatabase to journal. Savepoint statements are kept too, so a write that was rolled back
+    is rolled back again on replay. Triggers are not recorded; replaying fires them again.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        changes = self._cursor.connection.total_changes
+        self._cursor.execute(sql, params)
+        if self._cursor.connection.total_changes != changes or sql.startswith(('SAVEPOINT', 'RELEASE', 'ROLLBACK TO')):
+            self.statements.append((sql, _encode(params)))
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        for params in seq_of_params:
+            self.execute(sql, params)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+def _encode(params):
+    # JSON has no bytes, which compressed bodies are
+    return [{'blob': base64.b64encode(value).decode('ascii')} if isinstance(value, bytes) else value
+            for value in params]
+
+
+def _decode(params):
+    return [base64.b64decode(value['blob']) if isinstance(value, dict) else value for value in params]
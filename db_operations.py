@@ -1,11 +1,19 @@
 import logging
+import re
 import sqlite3
 import threading
+import time
 import uuid
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import Future
 
 from meshtastic import BROADCAST_NUM
 
+from db_compression import body_codec
+from db_connection import get_db_connection
+from db_schema import DISPLAY_DATE, migrate
+from db_writer import submit_write
+from transmit import PRIORITY_URGENT
 from utils import (
     send_bulletin_to_bbs_nodes,
     send_delete_bulletin_to_bbs_nodes,
@@ -14,51 +22,114 @@ from utils import (
 )
 
 
-thread_local = threading.local()
+class SeenSet:
+    """Bounded, thread-safe set of the most recently seen unique_ids."""
 
-def get_db_connection():
-    if not hasattr(thread_local, 'connection'):
-        thread_local.connection = sqlite3.connect('bulletins.db')
-    return thread_local.connection
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, unique_id):
+        with self._lock:
+            if unique_id in self._ids:
+                self._ids.move_to_end(unique_id)
+                return True
+            return False
+
+    def add(self, unique_id):
+        with self._lock:
+            self._ids[unique_id] = None
+            self._ids.move_to_end(unique_id)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+
+seen_unique_ids = SeenSet()
+
+
+class BoardCache:
+    """
+    Read-through cache of each board's bulletin listing, count, pages and rendered listing text.
+
+    Triggers move a board's generation on in the board_generations table whenever its listing
+    changes, whichever process makes the change, so db_admin deletes and expiry are seen as well
+    as this BBS's own writes. Every lookup reads the board's generation, one indexed row, and only
+    uses a value cached at that generation. Values are tagged with the generation read before they
+    were loaded, so the cache never serves a listing older than the last change. At most
+    max_entries values are kept, the least recently used dropped first.
+
+    Parameters:
+    -----------
+    max_entries : int
+        Number of values kept across all boards.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    def get(self, board, key, load):
+        """Returns the cached value for key on board, calling load() to fill it on a miss."""
+        entry = (board.lower(), key)
+        generation = _board_generation(board)
+        with self._lock:
+            cached = self._entries.get(entry)
+            if cached is not None and cached[0] == generation:
+                self._entries.move_to_end(entry)
+                self._stats['hits'] += 1
+                return cached[1]
+            if cached is not None:
+                del self._entries[entry]
+                self._stats['invalidations'] += 1
+            self._stats['misses'] += 1
+        value = load()
+        with self._lock:
+            self._entries[entry] = (generation, value)
+            self._entries.move_to_end(entry)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return value
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        hit_rate = f"{stats['hit_rate']:.0%}" if stats['hit_rate'] is not None else "n/a"
+        logging.info(f"BOARD CACHE: {stats['hits']} hits, {stats['misses']} misses ({hit_rate} hit rate), "
+                     f"{stats['invalidations']} invalidations, {stats['evictions']} evictions, "
+                     f"{stats['entries']} entries cached")
+
+
+def _board_generation(board):
+    c = get_db_connection().cursor()
+    c.execute("SELECT generation FROM board_generations WHERE board = lower(?)", (board,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+
+board_cache = BoardCache()
 
 def initialize_database():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS bulletins (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    board TEXT NOT NULL,
-                    sender_short_name TEXT NOT NULL,
-                    date TEXT NOT NULL,
-                    subject TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    unique_id TEXT NOT NULL
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS mail (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sender TEXT NOT NULL,
-                    sender_short_name TEXT NOT NULL,
-                    recipient TEXT NOT NULL,
-                    date TEXT NOT NULL,
-                    subject TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    unique_id TEXT NOT NULL
-                );''')
-    c.execute('''CREATE TABLE IF NOT EXISTS channels (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    url TEXT NOT NULL
-                );''')
-    conn.commit()
+    migrate(get_db_connection())
     print("Database schema initialized.")
 
 def add_channel(name, url, bbs_nodes=None, interface=None):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO channels (name, url) VALUES (?, ?)", (name, url))
-    conn.commit()
-
-    if bbs_nodes and interface:
-        send_channel_to_bbs_nodes(name, url, bbs_nodes, interface)
+    def write(c):
+        c.execute("INSERT INTO channels (name, url) VALUES (?, ?)", (name, url))
+        # Sync records are journaled to the outbox in the same transaction
+        if bbs_nodes and interface:
+            send_channel_to_bbs_nodes(c, name, url, bbs_nodes, interface)
+    return submit_write(write)
 
 
 def get_channels():
@@ -69,91 +140,399 @@ def get_channels():
 
 
 
+def _notify_urgent_bulletin(sender_short_name, subject, interface):
+    notification_message = f"💥NEW URGENT BULLETIN💥\nFrom: {sender_short_name}\nTitle: {subject}"
+    send_message(notification_message, BROADCAST_NUM, interface, priority=PRIORITY_URGENT)
+
+
 def add_bulletin(board, sender_short_name, subject, content, bbs_nodes, interface, unique_id=None):
-    conn = get_db_connection()
-    c = conn.cursor()
-    date = datetime.now().strftime('%Y-%m-%d %H:%M')
+    """Stores a bulletin posted on this BBS. Returns a Future that resolves to its unique_id once it is stored."""
+    created_at = int(time.time() * 1000)
     if not unique_id:
         unique_id = str(uuid.uuid4())
-    c.execute(
-        "INSERT INTO bulletins (board, sender_short_name, date, subject, content, unique_id) VALUES (?, ?, ?, ?, ?, ?)",
-        (board, sender_short_name, date, subject, content, unique_id))
-    conn.commit()
-    if bbs_nodes and interface:
-        send_bulletin_to_bbs_nodes(board, sender_short_name, subject, content, unique_id, bbs_nodes, interface)
 
-    # New logic to send group chat notification for urgent bulletins
-    if board.lower() == "urgent":
-        notification_message = f"💥NEW URGENT BULLETIN💥\nFrom: {sender_short_name}\nTitle: {subject}"
-        send_message(notification_message, BROADCAST_NUM, interface)
+    def write(c):
+        c.execute(
+            "INSERT INTO bulletins (board, sender_short_name, created_at, subject, content, unique_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (board, sender_short_name, created_at, subject, body_codec.compress(c, content), unique_id))
+        # Sync records are journaled to the outbox in the same transaction
+        if bbs_nodes and interface:
+            send_bulletin_to_bbs_nodes(c, board, sender_short_name, subject, content, unique_id, created_at, bbs_nodes,
+                                       interface)
+        return unique_id
 
-    return unique_id
+    def stored(future):
+        if future.exception() is not None:
+            return
+        seen_unique_ids.add(unique_id)
+        # Send group chat notification for urgent bulletins
+        if board.lower() == "urgent":
+            _notify_urgent_bulletin(sender_short_name, subject, interface)
 
+    future = submit_write(write)
+    future.add_done_callback(stored)
+    return future
 
-def get_bulletins(board):
+
+def _received_created_at(created_at):
+    """Returns the created_at a peer sent for a post if it is plausible, or else the current time."""
+    now = int(time.time() * 1000)
+    if created_at is None or not 0 < created_at <= now:
+        return now
+    return created_at
+
+
+def ingest_bulletin(board, sender_short_name, subject, content, unique_id, interface, created_at=None):
+    """
+    Stores a bulletin received from another BBS. created_at is when it was posted on its origin BBS,
+    in epoch milliseconds, if the peer sent it.
+
+    Returns a Future that resolves to True if the bulletin was new, False if it was a duplicate
+    delivery and nothing was stored.
+    """
+    if unique_id in seen_unique_ids:
+        logging.info(f"Ignoring duplicate bulletin {unique_id}")
+        return _resolved(False)
+    created_at = _received_created_at(created_at)
+
+    def write(c):
+        c.execute(
+            "INSERT OR IGNORE INTO bulletins (board, sender_short_name, created_at, subject, content, unique_id) "
+            "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM tombstones WHERE unique_id = ?) "
+            "AND NOT EXISTS (SELECT 1 FROM expired WHERE unique_id = ?)",
+            (board, sender_short_name, created_at, subject, body_codec.compress(c, content), unique_id, unique_id, unique_id))
+        return c.rowcount > 0
+
+    def stored(future):
+        if future.exception() is not None:
+            return
+        seen_unique_ids.add(unique_id)
+        if not future.result():
+            logging.info(f"Ignoring duplicate or deleted bulletin {unique_id}")
+            return
+        if board.lower() == "urgent":
+            _notify_urgent_bulletin(sender_short_name, subject, interface)
+
+    future = submit_write(write)
+    future.add_done_callback(stored)
+    return future
+
+
+def _load_bulletins(board):
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT id, subject, sender_short_name, date, unique_id FROM bulletins WHERE board = ? COLLATE NOCASE", (board,))
+    c.execute(f"SELECT id, subject, sender_short_name, {DISPLAY_DATE}, unique_id FROM bulletins WHERE board = ? COLLATE NOCASE",
+              (board,))
     return c.fetchall()
 
-def get_bulletin_content(bulletin_id):
+
+def get_bulletins(board):
+    return board_cache.get(board, 'bulletins', lambda: _load_bulletins(board))
+
+
+def count_bulletins(board):
+    def load():
+        c = get_db_connection().cursor()
+        c.execute("SELECT COUNT(*) FROM bulletins WHERE board = ? COLLATE NOCASE", (board,))
+        return c.fetchone()[0]
+    return board_cache.get(board, 'count', load)
+
+
+def _page(rows, limit):
+    """Splits limit + 1 rows ending in (created_at, id) into the page and the cursor for the next one."""
+    cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        cursor = (rows[-1][-2], rows[-1][-1])
+    return [row[:-2] for row in rows], cursor
+
+
+def get_bulletins_page(board, before=None, limit=10):
+    """
+    Returns (bulletins, cursor) for one page of board, newest first. Pass the cursor back as before
+    to get the next page; it is None on the last page.
+    """
+    def load():
+        conn = get_db_connection()
+        c = conn.cursor()
+        after = " AND (created_at, id) < (?, ?)" if before else ""
+        c.execute(f"SELECT id, subject, sender_short_name, {DISPLAY_DATE}, unique_id, created_at, id FROM bulletins "
+                  f"WHERE board = ? COLLATE NOCASE{after} ORDER BY created_at DESC, id DESC LIMIT ?",
+                  (board, *(before or ()), limit + 1))
+        return _page(c.fetchall(), limit)
+    return board_cache.get(board, ('page', before, limit), load)
+
+
+def get_board_text(board, key, render):
+    """Returns render() for a listing of board, cached under key until the board changes."""
+    return board_cache.get(board, ('text', key), render)
+
+def _match_expression(query):
+    """Turns free text into an FTS5 query matching every word, each as a prefix. Returns None if it has no words."""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_bulletins(query, limit=5):
+    """Returns (id, subject, sender_short_name, date, unique_id, board) for the bulletins best matching query."""
+    match = _match_expression(query)
+    if match is None:
+        return []
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT sender_short_name, date, subject, content, unique_id FROM bulletins WHERE id = ?", (bulletin_id,))
-    return c.fetchone()
+    try:
+        # Words in the subject count twice as much as words in the content
+        c.execute(f"SELECT b.id, b.subject, b.sender_short_name, {DISPLAY_DATE}, b.unique_id, b.board "
+                  "FROM bulletins_fts JOIN bulletins b ON b.id = bulletins_fts.rowid "
+                  "WHERE bulletins_fts MATCH ? ORDER BY bm25(bulletins_fts, 2.0, 1.0) LIMIT ?", (match, limit))
+    except sqlite3.OperationalError as e:
+        if 'bulletins_fts' not in str(e):
+            raise
+        pattern = f"%{query.strip()}%"
+        c.execute(f"SELECT id, subject, sender_short_name, {DISPLAY_DATE}, unique_id, board FROM bulletins "
+                  "WHERE subject LIKE ? OR bbs_body(content) LIKE ? ORDER BY created_at DESC LIMIT ?", (pattern, pattern, limit))
+    return c.fetchall()
 
 
-def delete_bulletin(bulletin_id, bbs_nodes, interface):
+def search_mail(recipient_id, query, limit=5):
+    """Returns (id, sender_short_name, subject, date, unique_id) for recipient_id's mail best matching query."""
+    match = _match_expression(query)
+    if match is None:
+        return []
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("DELETE FROM bulletins WHERE id = ?", (bulletin_id,))
-    conn.commit()
-    send_delete_bulletin_to_bbs_nodes(bulletin_id, bbs_nodes, interface)
+    try:
+        c.execute(f"SELECT m.id, m.sender_short_name, m.subject, {DISPLAY_DATE}, m.unique_id "
+                  "FROM mail_fts JOIN mail m ON m.id = mail_fts.rowid "
+                  "WHERE mail_fts MATCH ? AND m.recipient = ? ORDER BY bm25(mail_fts, 2.0, 1.0) LIMIT ?",
+                  (match, recipient_id, limit))
+    except sqlite3.OperationalError as e:
+        if 'mail_fts' not in str(e):
+            raise
+        pattern = f"%{query.strip()}%"
+        c.execute(f"SELECT id, sender_short_name, subject, {DISPLAY_DATE}, unique_id FROM mail "
+                  "WHERE recipient = ? AND (subject LIKE ? OR bbs_body(content) LIKE ?) ORDER BY created_at DESC LIMIT ?",
+                  (recipient_id, pattern, pattern, limit))
+    return c.fetchall()
 
-def add_mail(sender_id, sender_short_name, recipient_id, subject, content, bbs_nodes, interface, unique_id=None):
+
+def get_bulletin_content(bulletin_id):
     conn = get_db_connection()
     c = conn.cursor()
-    date = datetime.now().strftime('%Y-%m-%d %H:%M')
+    c.execute(f"SELECT sender_short_name, {DISPLAY_DATE}, subject, bbs_body(content), unique_id FROM bulletins WHERE id = ?", (bulletin_id,))
+    return c.fetchone()
+
+
+def _add_tombstone(c, unique_id, record_type):
+    c.execute("INSERT OR IGNORE INTO tombstones (unique_id, record_type, deleted_at) VALUES (?, ?, ?)",
+              (unique_id, record_type, time.time()))
+    seen_unique_ids.add(unique_id)
+
+
+def _resolved(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def delete_bulletin(unique_id, bbs_nodes, interface):
+    """Deletes a bulletin by unique_id, leaving a tombstone so copies still in transit are not stored again."""
+    def write(c):
+        c.execute("DELETE FROM bulletins WHERE unique_id = ?", (unique_id,))
+        _add_tombstone(c, unique_id, 'BULLETIN')
+        send_delete_bulletin_to_bbs_nodes(c, unique_id, bbs_nodes, interface)
+    return submit_write(write)
+
+def add_mail(sender_id, sender_short_name, recipient_id, subject, content, bbs_nodes, interface, unique_id=None):
+    """Stores mail sent on this BBS. Returns a Future that resolves to its unique_id once it is stored."""
+    created_at = int(time.time() * 1000)
     if not unique_id:
         unique_id = str(uuid.uuid4())
-    c.execute("INSERT INTO mail (sender, sender_short_name, recipient, date, subject, content, unique_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-              (sender_id, sender_short_name, recipient_id, date, subject, content, unique_id))
-    conn.commit()
-    if bbs_nodes and interface:
-        send_mail_to_bbs_nodes(sender_id, sender_short_name, recipient_id, subject, content, unique_id, bbs_nodes, interface)
-    return unique_id
-
-def get_mail(recipient_id):
+
+    def write(c):
+        c.execute("INSERT INTO mail (sender, sender_short_name, recipient, created_at, subject, content, unique_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (sender_id, sender_short_name, recipient_id, created_at, subject, body_codec.compress(c, content), unique_id))
+        # Sync records are journaled to the outbox in the same transaction
+        if bbs_nodes and interface:
+            send_mail_to_bbs_nodes(c, sender_id, sender_short_name, recipient_id, subject, content, unique_id, created_at,
+                                   bbs_nodes, interface)
+        return unique_id
+
+    def stored(future):
+        if future.exception() is None:
+            seen_unique_ids.add(unique_id)
+
+    future = submit_write(write)
+    future.add_done_callback(stored)
+    return future
+
+def ingest_mail(sender_id, sender_short_name, recipient_id, subject, content, unique_id, created_at=None):
+    """
+    Stores a mail message received from another BBS. created_at is when it was sent on its origin BBS,
+    in epoch milliseconds, if the peer sent it.
+
+    Returns a Future that resolves to True if the message was new, False if it was a duplicate
+    delivery and nothing was stored.
+    """
+    if unique_id in seen_unique_ids:
+        logging.info(f"Ignoring duplicate mail {unique_id}")
+        return _resolved(False)
+    created_at = _received_created_at(created_at)
+
+    def write(c):
+        c.execute("INSERT OR IGNORE INTO mail (sender, sender_short_name, recipient, created_at, subject, content, unique_id) "
+                  "SELECT ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM tombstones WHERE unique_id = ?) "
+                  "AND NOT EXISTS (SELECT 1 FROM expired WHERE unique_id = ?)",
+                  (sender_id, sender_short_name, recipient_id, created_at, subject, body_codec.compress(c, content), unique_id,
+                   unique_id, unique_id))
+        return c.rowcount > 0
+
+    def stored(future):
+        if future.exception() is not None:
+            return
+        seen_unique_ids.add(unique_id)
+        if not future.result():
+            logging.info(f"Ignoring duplicate or deleted mail {unique_id}")
+
+    future = submit_write(write)
+    future.add_done_callback(stored)
+    return future
+
+def get_mail(recipient_id, unread_only=False):
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT id, sender_short_name, subject, date, unique_id FROM mail WHERE recipient = ?", (recipient_id,))
+    unread = " AND read = 0" if unread_only else ""
+    c.execute(f"SELECT id, sender_short_name, subject, {DISPLAY_DATE}, unique_id FROM mail WHERE recipient = ?{unread}",
+              (recipient_id,))
     return c.fetchall()
 
+
+def get_mail_page(recipient_id, before=None, limit=10):
+    """
+    Returns (mail, cursor) for one page of recipient_id's mailbox, newest first. Pass the cursor
+    back as before to get the next page; it is None on the last page.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    after = " AND (created_at, id) < (?, ?)" if before else ""
+    c.execute(f"SELECT id, sender_short_name, subject, {DISPLAY_DATE}, unique_id, created_at, id FROM mail "
+              f"WHERE recipient = ?{after} ORDER BY created_at DESC, id DESC LIMIT ?",
+              (recipient_id, *(before or ()), limit + 1))
+    return _page(c.fetchall(), limit)
+
+
+def get_mailbox_summary(recipient_id):
+    """Returns (total, unread) mail counts for recipient_id."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT total, unread FROM mailbox_summary WHERE recipient = ?", (recipient_id,))
+    return c.fetchone() or (0, 0)
+
+
+def mark_mail_read(mail_id, recipient_id):
+    def write(c):
+        c.execute("UPDATE mail SET read = 1 WHERE id = ? AND recipient = ? AND read = 0", (mail_id, recipient_id))
+    return submit_write(write)
+
 def get_mail_content(mail_id, recipient_id):
     # TODO: ensure only recipient can read mail
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT sender_short_name, date, subject, content, unique_id FROM mail WHERE id = ? and recipient = ?", (mail_id, recipient_id,))
+    c.execute(f"SELECT sender_short_name, {DISPLAY_DATE}, subject, bbs_body(content), unique_id FROM mail WHERE id = ? and recipient = ?",
+              (mail_id, recipient_id,))
     return c.fetchone()
 
 def delete_mail(unique_id, recipient_id, bbs_nodes, interface):
-    conn = get_db_connection()
-    c = conn.cursor()
-    try:
+    def write(c):
         c.execute("SELECT recipient FROM mail WHERE unique_id = ?", (unique_id,))
         result = c.fetchone()
         if result is None:
             logging.error(f"No mail found with unique_id: {unique_id}")
-            return  # Early exit if no matching mail found
+            # Keep the tombstone so the mail is not stored if it arrives later
+            _add_tombstone(c, unique_id, 'MAIL')
+            return False
         recipient_id = result[0]
         logging.info(f"Attempting to delete mail with unique_id: {unique_id} by {recipient_id}")
         c.execute("DELETE FROM mail WHERE unique_id = ? and recipient = ?", (unique_id, recipient_id,))
-        conn.commit()
-        send_delete_mail_to_bbs_nodes(unique_id, bbs_nodes, interface)
-        logging.info(f"Mail with unique_id: {unique_id} deleted and sync message sent.")
-    except Exception as e:
-        logging.error(f"Error deleting mail with unique_id {unique_id}: {e}")
-        raise
+        _add_tombstone(c, unique_id, 'MAIL')
+        send_delete_mail_to_bbs_nodes(c, unique_id, bbs_nodes, interface)
+        return True
+
+    def deleted(future):
+        if future.exception() is not None:
+            logging.error(f"Error deleting mail with unique_id {unique_id}: {future.exception()}")
+        elif future.result():
+            logging.info(f"Mail with unique_id: {unique_id} deleted and sync message sent.")
+
+    future = submit_write(write)
+    future.add_done_callback(deleted)
+    return future
+
+
+def get_sync_unique_ids(bbs_nodes):
+    """
+    Returns (record_type, unique_id, deleted, settled) for every bulletin and mail message held by
+    this BBS, and for every tombstone of one that was deleted. A tombstone is settled once every
+    node in bbs_nodes has confirmed it. Expired posts are listed as if they were still held, so
+    they are not fetched again from peers that keep them longer.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    peers = list(bbs_nodes)
+    placeholders = ','.join('?' * len(peers)) or "''"
+    c.execute("SELECT 'BULLETIN', unique_id, 0, 0 FROM bulletins UNION ALL SELECT 'MAIL', unique_id, 0, 0 FROM mail "
+              "UNION ALL SELECT record_type, unique_id, 0, 0 FROM expired "
+              "UNION ALL SELECT record_type, unique_id, 1, (SELECT COUNT(*) FROM tombstone_confirmations t "
+              f"WHERE t.unique_id = tombstones.unique_id AND t.peer IN ({placeholders})) >= ? FROM tombstones",
+              peers + [len(peers)])
+    return c.fetchall()
+
+
+def confirm_tombstones(unique_ids, peer):
+    """Records that a peer is known to have deleted the given bulletins or mail."""
+    def write(c):
+        c.executemany("INSERT OR IGNORE INTO tombstone_confirmations (unique_id, peer) "
+                      "SELECT unique_id, ? FROM tombstones WHERE unique_id = ?",
+                      [(peer, unique_id) for unique_id in unique_ids])
+    return submit_write(write)
+
+
+def compact_tombstones(bbs_nodes, min_age):
+    """
+    Removes tombstones older than min_age seconds that every node in bbs_nodes has confirmed.
+
+    Returns a Future that resolves to the number of tombstones removed.
+    """
+    peers = list(bbs_nodes)
+    placeholders = ','.join('?' * len(peers)) or "''"
+
+    def write(c):
+        c.execute("DELETE FROM tombstones WHERE deleted_at < ? AND "
+                  "(SELECT COUNT(*) FROM tombstone_confirmations t "
+                  f"WHERE t.unique_id = tombstones.unique_id AND t.peer IN ({placeholders})) >= ?",
+                  [time.time() - min_age] + peers + [len(peers)])
+        removed = c.rowcount
+        c.execute("DELETE FROM tombstone_confirmations WHERE unique_id NOT IN (SELECT unique_id FROM tombstones)")
+        return removed
+    return submit_write(write)
+
+
+def get_bulletin_by_unique_id(unique_id):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT board, sender_short_name, subject, bbs_body(content), unique_id, created_at FROM bulletins "
+              "WHERE unique_id = ?", (unique_id,))
+    return c.fetchone()
+
+
+def get_mail_by_unique_id(unique_id):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT sender, sender_short_name, recipient, subject, bbs_body(content), unique_id, created_at FROM mail "
+              "WHERE unique_id = ?", (unique_id,))
+    return c.fetchone()
 
 
 def get_sender_id_by_mail_id(mail_id):
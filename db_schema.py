@@ -0,0 +1,311 @@
+import logging
+
+# Rows written before version 6 carry a local '%Y-%m-%d %H:%M' date; unparseable ones become 0
+_DATE_TO_EPOCH_MS = "COALESCE(CAST(strftime('%s', date, 'utc') AS INTEGER) * 1000, 0)"
+
+# Minute-precision local time shown to users, from a created_at column in epoch milliseconds
+DISPLAY_DATE = "strftime('%Y-%m-%d %H:%M', created_at / 1000, 'unixepoch', 'localtime')"
+
+
+def _create_base_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS bulletins (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    board TEXT NOT NULL,
+                    sender_short_name TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    unique_id TEXT NOT NULL
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS mail (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sender TEXT NOT NULL,
+                    sender_short_name TEXT NOT NULL,
+                    recipient TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    unique_id TEXT NOT NULL
+                );''')
+    c.execute('''CREATE TABLE IF NOT EXISTS channels (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    url TEXT NOT NULL
+                );''')
+
+
+def _create_sync_outbox(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    peer TEXT NOT NULL,
+                    record_type TEXT NOT NULL,
+                    fields TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                );''')
+
+
+def _unique_ids(c):
+    # Remove copies left by duplicate sync deliveries before unique_id can be made unique
+    for table in ('bulletins', 'mail'):
+        c.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY unique_id)")
+        if c.rowcount > 0:
+            logging.info(f"Removed {c.rowcount} duplicate row(s) from {table}")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bulletins_unique_id ON bulletins (unique_id)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_mail_unique_id ON mail (unique_id)")
+
+
+def _create_tombstones(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS tombstones (
+                    unique_id TEXT PRIMARY KEY,
+                    record_type TEXT NOT NULL,
+                    deleted_at REAL NOT NULL
+                );''')
+    c.execute('''CREATE TABLE IF NOT EXISTS tombstone_confirmations (
+                    unique_id TEXT NOT NULL,
+                    peer TEXT NOT NULL,
+                    PRIMARY KEY (unique_id, peer)
+                );''')
+
+
+def _query_indexes(c):
+    # Boards are looked up case-insensitively, so the index has to use the same collation
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bulletins_board ON bulletins (board COLLATE NOCASE)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_mail_recipient ON mail (recipient)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sync_outbox_peer ON sync_outbox (peer)")
+
+
+def _epoch_timestamps(c):
+    # Tables are rebuilt so created_at can replace the old date text column, whose value is the
+    # local time the row was stored, to the minute
+    c.execute('''CREATE TABLE bulletins_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    board TEXT NOT NULL,
+                    sender_short_name TEXT NOT NULL,
+                    created_at INTEGER NOT NULL,
+                    subject TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    unique_id TEXT NOT NULL
+                )''')
+    c.execute("INSERT INTO bulletins_new (id, board, sender_short_name, created_at, subject, content, unique_id) "
+              f"SELECT id, board, sender_short_name, {_DATE_TO_EPOCH_MS}, subject, content, unique_id FROM bulletins")
+    c.execute("DROP TABLE bulletins")
+    c.execute("ALTER TABLE bulletins_new RENAME TO bulletins")
+
+    c.execute('''CREATE TABLE mail_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sender TEXT NOT NULL,
+                    sender_short_name TEXT NOT NULL,
+                    recipient TEXT NOT NULL,
+                    created_at INTEGER NOT NULL,
+                    subject TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    unique_id TEXT NOT NULL
+                );''')
+    c.execute("INSERT INTO mail_new (id, sender, sender_short_name, recipient, created_at, subject, content, unique_id) "
+              f"SELECT id, sender, sender_short_name, recipient, {_DATE_TO_EPOCH_MS}, subject, content, unique_id FROM mail")
+    c.execute("DROP TABLE mail")
+    c.execute("ALTER TABLE mail_new RENAME TO mail")
+
+    c.execute("CREATE UNIQUE INDEX idx_bulletins_unique_id ON bulletins (unique_id)")
+    c.execute("CREATE UNIQUE INDEX idx_mail_unique_id ON mail (unique_id)")
+    c.execute("CREATE INDEX idx_bulletins_board ON bulletins (board COLLATE NOCASE, created_at)")
+    c.execute("CREATE INDEX idx_bulletins_created_at ON bulletins (created_at)")
+    c.execute("CREATE INDEX idx_mail_recipient ON mail (recipient, created_at)")
+    c.execute("CREATE INDEX idx_mail_created_at ON mail (created_at)")
+
+    # Expired posts are remembered so that reconciliation does not fetch them back from peers
+    c.execute('''CREATE TABLE IF NOT EXISTS expired (
+                    unique_id TEXT PRIMARY KEY,
+                    record_type TEXT NOT NULL,
+                    expired_at REAL NOT NULL
+                );''')
+
+
+def _full_text_search(c):
+    c.execute("PRAGMA compile_options")
+    if ('ENABLE_FTS5',) not in c.fetchall():
+        logging.warning("This SQLite library has no FTS5, search will fall back to slower substring matching")
+        return
+    for table in ('bulletins', 'mail'):
+        # External content tables index subject and content without storing a second copy of them
+        c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(subject, content, content='{table}', "
+                  f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                        INSERT INTO {table}_fts (rowid, subject, content) VALUES (new.id, new.subject, new.content);
+                      END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, subject, content)
+                        VALUES ('delete', old.id, old.subject, old.content);
+                      END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF subject, content ON {table} BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, subject, content)
+                        VALUES ('delete', old.id, old.subject, old.content);
+                        INSERT INTO {table}_fts (rowid, subject, content) VALUES (new.id, new.subject, new.content);
+                      END""")
+        c.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+
+def _mailbox_summary(c):
+    c.execute("ALTER TABLE mail ADD COLUMN read INTEGER NOT NULL DEFAULT 0")
+    c.execute('''CREATE TABLE IF NOT EXISTS mailbox_summary (
+                    recipient TEXT PRIMARY KEY,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    unread INTEGER NOT NULL DEFAULT 0
+                );''')
+    # Triggers keep the counts right for every write, including expiry and db_admin deletes
+    c.execute("""CREATE TRIGGER IF NOT EXISTS mailbox_summary_insert AFTER INSERT ON mail BEGIN
+                    INSERT INTO mailbox_summary (recipient, total, unread) VALUES (new.recipient, 1, new.read = 0)
+                    ON CONFLICT (recipient) DO UPDATE SET total = total + 1, unread = unread + (new.read = 0);
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS mailbox_summary_delete AFTER DELETE ON mail BEGIN
+                    UPDATE mailbox_summary SET total = total - 1, unread = unread - (old.read = 0)
+                    WHERE recipient = old.recipient;
+                    DELETE FROM mailbox_summary WHERE recipient = old.recipient AND total <= 0;
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS mailbox_summary_update AFTER UPDATE OF recipient, read ON mail BEGIN
+                    UPDATE mailbox_summary SET total = total - 1, unread = unread - (old.read = 0)
+                    WHERE recipient = old.recipient;
+                    DELETE FROM mailbox_summary WHERE recipient = old.recipient AND total <= 0;
+                    INSERT INTO mailbox_summary (recipient, total, unread) VALUES (new.recipient, 1, new.read = 0)
+                    ON CONFLICT (recipient) DO UPDATE SET total = total + 1, unread = unread + (new.read = 0);
+                 END""")
+    c.execute("DELETE FROM mailbox_summary")
+    c.execute("INSERT INTO mailbox_summary (recipient, total, unread) "
+              "SELECT recipient, COUNT(*), SUM(read = 0) FROM mail GROUP BY recipient")
+
+
+def _compressed_bodies(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS compression_dictionaries (
+                    id INTEGER PRIMARY KEY,
+                    dictionary BLOB NOT NULL,
+                    created_at INTEGER NOT NULL
+                );''')
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('bulletins_fts', 'mail_fts')")
+    if not c.fetchall():
+        return
+    for table in ('bulletins', 'mail'):
+        # content may now be compressed, so the search index reads bodies through bbs_body, both
+        # in the triggers and, for rebuilds, from a view in place of the table itself
+        c.execute(f"DROP TRIGGER IF EXISTS {table}_fts_insert")
+        c.execute(f"DROP TRIGGER IF EXISTS {table}_fts_delete")
+        c.execute(f"DROP TRIGGER IF EXISTS {table}_fts_update")
+        c.execute(f"DROP TABLE IF EXISTS {table}_fts")
+        c.execute(f"CREATE VIEW IF NOT EXISTS {table}_text AS SELECT id, subject, bbs_body(content) AS content FROM {table}")
+        c.execute(f"CREATE VIRTUAL TABLE {table}_fts USING fts5(subject, content, content='{table}_text', "
+                  f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+        c.execute(f"""CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                        INSERT INTO {table}_fts (rowid, subject, content) VALUES (new.id, new.subject, bbs_body(new.content));
+                      END""")
+        c.execute(f"""CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, subject, content)
+                        VALUES ('delete', old.id, old.subject, bbs_body(old.content));
+                      END""")
+        # Recompressing a body leaves its text alone, so there is nothing to reindex
+        c.execute(f"""CREATE TRIGGER {table}_fts_update AFTER UPDATE OF subject, content ON {table}
+                      WHEN old.subject IS NOT new.subject OR bbs_body(old.content) IS NOT bbs_body(new.content) BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, subject, content)
+                        VALUES ('delete', old.id, old.subject, bbs_body(old.content));
+                        INSERT INTO {table}_fts (rowid, subject, content) VALUES (new.id, new.subject, bbs_body(new.content));
+                      END""")
+        c.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+
+def _memory_checkpoint(c):
+    # Written only to the file by RAM mode checkpoints: the last journaled commit the file includes
+    c.execute('''CREATE TABLE IF NOT EXISTS memory_checkpoint (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    sequence INTEGER NOT NULL
+                );''')
+
+
+def _board_generations(c):
+    # Moved on by every change to a board's listing, whichever process makes it, so the BBS can
+    # tell when the listings it has cached are stale
+    c.execute('''CREATE TABLE IF NOT EXISTS board_generations (
+                    board TEXT PRIMARY KEY,
+                    generation INTEGER NOT NULL
+                );''')
+    bump = ("INSERT INTO board_generations (board, generation) VALUES (lower({}.board), 1) "
+            "ON CONFLICT (board) DO UPDATE SET generation = generation + 1;")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS board_generations_insert AFTER INSERT ON bulletins BEGIN
+                    {bump.format('new')}
+                 END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS board_generations_delete AFTER DELETE ON bulletins BEGIN
+                    {bump.format('old')}
+                 END""")
+    # Recompressing a body changes no listing
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS board_generations_update
+                 AFTER UPDATE OF board, sender_short_name, created_at, subject, unique_id ON bulletins BEGIN
+                    {bump.format('old')}
+                    {bump.format('new')}
+                 END""")
+
+
+def _expired_created_at(c):
+    # Expired posts are forgotten by their age. The time they expired is the closest known to older rows.
+    c.execute("ALTER TABLE expired ADD COLUMN created_at INTEGER NOT NULL DEFAULT 0")
+    c.execute("UPDATE expired SET created_at = CAST(expired_at * 1000 AS INTEGER)")
+
+
+# Each migration brings the schema from the previous version to its own and must be safe to run
+# against tables that older releases created without recording a version. Append new migrations
+# to the end; never change or reorder ones that have shipped.
+MIGRATIONS = [
+    (1, "create bulletins, mail and channels", _create_base_tables),
+    (2, "create sync outbox", _create_sync_outbox),
+    (3, "make unique_id unique", _unique_ids),
+    (4, "create tombstones", _create_tombstones),
+    (5, "index board, recipient and outbox peer lookups", _query_indexes),
+    (6, "store timestamps as epoch milliseconds and track expired posts", _epoch_timestamps),
+    (7, "index bulletin and mail text for search", _full_text_search),
+    (8, "count mail and unread mail per recipient", _mailbox_summary),
+    (9, "allow compressed bulletin and mail bodies", _compressed_bodies),
+    (10, "record the journal position of RAM mode checkpoints", _memory_checkpoint),
+    (11, "track changes to each board", _board_generations),
+    (12, "record when expired posts were created", _expired_created_at),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Applies every migration newer than the database's user_version, each in its own transaction.
+
+    Returns the number of migrations applied.
+    """
+    conn.commit()
+    version = get_schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this BBS supports ({SCHEMA_VERSION})")
+
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        # Changing auto_vacuum only takes effect after a VACUUM, which is instant on a new database
+        if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]:
+            logging.info("Converting the database to incremental vacuum, this happens once and may take a while")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    applied = 0
+    for target, description, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        logging.info(f"Migrating database schema to version {target}: {description}")
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN")
+            migration(c)
+            c.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied += 1
+    return applied
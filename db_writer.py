@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from db_connection import get_db_connection
+
+
+class DatabaseWriter:
+    """
+    Single thread that performs every database write, grouping them into shared transactions.
+
+    A write is a function taking a cursor; it runs inside a savepoint, so one that raises is
+    undone on its own without affecting the others in its group. The first write queued opens a
+    group that is committed once max_batch writes are waiting or max_delay seconds have passed,
+    so a burst of sync records costs one commit, and one fsync, instead of one each. Each caller
+    gets a Future that resolves to the write function's return value once its transaction has
+    been committed, or to its exception.
+
+    Parameters:
+    -----------
+    max_batch : int
+        Number of waiting writes that commits the group straight away.
+    max_delay : float
+        Seconds to wait for further writes after the first one of a group arrives.
+    journal : MemoryDatabase or None
+        In RAM mode, records each committed group so it can be replayed after a crash.
+    """
+
+    def __init__(self, max_batch=100, max_delay=0.05, journal=None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.journal = journal
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._group_cursor = None
+
+        self._stats = {
+            'writes': 0,
+            'failed': 0,
+            'commits': 0,
+            'max_group': 0,
+        }
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the writer thread once every queued write has been committed."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self._commit(self._take_pending())
+
+    def submit(self, write, *args):
+        """Queues write(cursor, *args) and returns a Future for its result."""
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # A write queuing another write joins the transaction it is already in
+            _apply(self._group_cursor or get_db_connection().cursor(), write, args, future)
+            return future
+        with self._condition:
+            self._pending.append((write, args, future))
+            self._condition.notify_all()
+        return future
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['avg_group'] = stats['writes'] / stats['commits'] if stats['commits'] else 0.0
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logging.info(f"DB WRITER: {stats['writes']} write(s) in {stats['commits']} commit(s), "
+                     f"avg {stats['avg_group']:.1f} max {stats['max_group']} per commit, "
+                     f"{stats['failed']} failed, {stats['pending']} waiting")
+
+    def _take_pending(self):
+        with self._condition:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                deadline = time.monotonic() + self.max_delay
+                while self._running and len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(timeout=remaining)
+                pending, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            self._commit(pending)
+
+    def _commit(self, pending):
+        if not pending:
+            return
+        conn = get_db_connection()
+        c = conn.cursor()
+        if self.journal is not None:
+            c = self.journal.cursor(c)
+        self._group_cursor = c
+        outcomes = []
+        callbacks = []
+        try:
+            c.execute("BEGIN")
+            for write, args, _ in pending:
+                outcome = Future()
+                callbacks += _apply(c, write, args, outcome, savepoint=True)
+                outcomes.append(outcome)
+            if self.journal is not None:
+                self.journal.commit(conn, c)
+            else:
+                conn.commit()
+        except Exception as e:
+            logging.error(f"Database write transaction failed: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            for _, _, future in pending:
+                future.set_exception(e)
+            with self._condition:
+                self._stats['failed'] += len(pending)
+            return
+        finally:
+            self._group_cursor = None
+
+        _run_callbacks(callbacks)
+        failed = 0
+        for (_, _, future), outcome in zip(pending, outcomes):
+            if outcome.exception() is not None:
+                failed += 1
+                future.set_exception(outcome.exception())
+            else:
+                future.set_result(outcome.result())
+        with self._condition:
+            self._stats['writes'] += len(pending)
+            self._stats['failed'] += failed
+            self._stats['commits'] += 1
+            self._stats['max_group'] = max(self._stats['max_group'], len(pending))
+
+
+_commit_callbacks = threading.local()
+
+
+def after_commit(callback):
+    """
+    Calls callback() once the transaction of the write function calling this has been committed,
+    so nothing is sent for a write that is rolled back. Only write functions may call it.
+    """
+    callbacks = getattr(_commit_callbacks, 'pending', None)
+    if callbacks is None:
+        raise RuntimeError("after_commit can only be called from a write function")
+    callbacks.append(callback)
+
+
+def _run_callbacks(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"Error in database commit callback: {e}")
+
+
+def _apply(c, write, args, future, savepoint=False):
+    """
+    Runs one write, recording its result or exception in future. Only a savepoint is undone on failure.
+
+    Returns the write's after_commit callbacks, none if it failed. A write run from inside another
+    one hands them to the outer write instead, as they share its transaction.
+    """
+    outer = getattr(_commit_callbacks, 'pending', None)
+    _commit_callbacks.pending = callbacks = []
+    if savepoint:
+        c.execute("SAVEPOINT write")
+    try:
+        result = write(c, *args)
+    except Exception as e:
+        if savepoint:
+            c.execute("ROLLBACK TO write")
+            c.execute("RELEASE write")
+        future.set_exception(e)
+        return []
+    finally:
+        _commit_callbacks.pending = outer
+    if savepoint:
+        c.execute("RELEASE write")
+    future.set_result(result)
+    if outer is not None:
+        outer.extend(callbacks)
+        return []
+    return callbacks
+
+
+_writer = None
+
+
+def start_writer(**settings):
+    global _writer
+    _writer = DatabaseWriter(**settings)
+    _writer.start()
+    return _writer
+
+
+def stop_writer():
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
+
+
+def get_writer():
+    return _writer
+
+
+def submit_write(write, *args):
+    """
+    Performs write(cursor, *args) on the writer thread, or straight away on the calling thread's
+    connection when no writer is running, as in db_admin. Returns a Future for its result.
+    """
+    writer = _writer
+    if writer is not None:
+        return writer.submit(write, *args)
+    future = Future()
+    conn = get_db_connection()
+    callbacks = _apply(conn.cursor(), write, args, future)
+    if future.exception() is None:
+        conn.commit()
+        _run_callbacks(callbacks)
+    elif conn.in_transaction:
+        conn.rollback()
+    return future
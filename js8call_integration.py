@@ -1,13 +1,17 @@
 from socket import socket, AF_INET, SOCK_STREAM
 import json
 import time
-import sqlite3
 import configparser
 import logging
 
 from meshtastic import BROADCAST_NUM
 
 from command_handlers import handle_help_command
+from js8call_storage import (
+    DEFAULT_LIST_LIMIT, configure_storage, get_group_messages, get_groups, get_station_messages,
+    get_urgent_messages, insert_message
+)
+from transmit import PRIORITY_URGENT
 from utils import send_message, update_user_state
 
 config_file = 'config.ini'
@@ -43,53 +47,19 @@ class JS8CallClient:
         self.js8urgent = self.config.get('js8call', 'js8urgent', fallback='').split(',')
         self.js8groups = [group.strip() for group in self.js8groups]
         self.js8urgent = [group.strip() for group in self.js8urgent]
+        self.list_limit = self.config.getint('js8call', 'list_limit', fallback=DEFAULT_LIST_LIMIT)
 
         self.connected = False
         self.sock = None
-        self.db_conn = None
         self.interface = interface
 
         if self.db_file:
-            self.db_conn = sqlite3.connect(self.db_file)
-            self.create_tables()
+            # The menus read the same log through js8call_storage
+            configure_storage(self.db_file, self.list_limit)
         else:
             self.logger.info("JS8Call configuration not found. Skipping JS8Call integration.")
 
-    def create_tables(self):
-        if not self.db_conn:
-            return
-
-        with self.db_conn:
-            self.db_conn.execute('''
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sender TEXT,
-                    receiver TEXT,
-                    message TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            self.db_conn.execute('''
-                CREATE TABLE IF NOT EXISTS groups (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sender TEXT,
-                    groupname TEXT,
-                    message TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            self.db_conn.execute('''
-                CREATE TABLE IF NOT EXISTS urgent (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sender TEXT,
-                    groupname TEXT,
-                    message TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        self.logger.info("Database tables created or verified.")
-
-    def insert_message(self, table, sender, recipient, message):
+    def insert_message(self, table, sender, receiver_or_group, message):
         """
         Inserts a message into the specified table in the database.
 
@@ -104,7 +74,7 @@ class JS8CallClient:
         sender : str
             The meshtastic node identifier of the sender who issued the command
         
-        recipient : str
+        receiver_or_group : str
             The identifier of the receiver of the message or the group name.
         
         message : str
@@ -117,18 +87,11 @@ class JS8CallClient:
         client.insert_message('urgent', sender='CALLSIGN1', receiver_or_group='UrgentGroupName', message='This is an urgent message.')
         """
 
-        if not self.db_conn:
+        if not self.db_file:
             self.logger.error("Database connection is not available.")
             return
 
-        try:
-            with self.db_conn:
-                self.db_conn.execute(f'''
-                    INSERT INTO {table} (sender, { 'receiver' if table == 'messages' else 'groupname' }, message)
-                    VALUES (?, ?, ?)
-                ''', (sender, receiver_or_group, message))
-        except sqlite3.Error as e:
-            self.logger.error(f"Failed to insert message into {table} table: {e}")
+        insert_message(table, sender, receiver_or_group, message)
 
     def process(self, message):
         typ = message.get('type', '')
@@ -160,9 +123,9 @@ class JS8CallClient:
             self.logger.info(f"Received JS8Call message: {sender} to {receiver} - {msg}")
 
             if receiver in self.js8urgent:
-                self.insert_urgent('urgent', sender, receiver, msg)
+                self.insert_message('urgent', sender, receiver, msg)
                 notification_message = f"💥 URGENT JS8Call Message Received 💥\nFrom: {sender}\nCheck BBS for message"
-                send_message(notification_message, BROADCAST_NUM, self.interface)
+                send_message(notification_message, BROADCAST_NUM, self.interface, priority=PRIORITY_URGENT)
             elif receiver in self.js8groups:
                 self.insert_message('groups', sender, receiver, msg)
             elif self.store_messages:
@@ -242,10 +205,7 @@ def handle_js8call_steps(sender_id, message, step, interface, state):
 
 
 def handle_group_messages_command(sender_id, interface):
-    conn = sqlite3.connect('js8call.db')
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT groupname FROM groups")
-    groups = c.fetchall()
+    groups = get_groups()
     if groups:
         response = "Group Messages Menu:\n" + "\n".join([f"[{i}] {group[0]}" for i, group in enumerate(groups)])
         send_message(response, sender_id, interface)
@@ -255,10 +215,7 @@ def handle_group_messages_command(sender_id, interface):
         handle_js8call_command(sender_id, interface)
 
 def handle_station_messages_command(sender_id, interface):
-    conn = sqlite3.connect('js8call.db')
-    c = conn.cursor()
-    c.execute("SELECT sender, receiver, message, timestamp FROM messages")
-    messages = c.fetchall()
+    messages = get_station_messages()
     if messages:
         response = "Station Messages:\n" + "\n".join([f"[{i+1}] {msg[0]} -> {msg[1]}: {msg[2]} ({msg[3]})" for i, msg in enumerate(messages)])
         send_message(response, sender_id, interface)
@@ -267,10 +224,7 @@ def handle_station_messages_command(sender_id, interface):
     handle_js8call_command(sender_id, interface)
 
 def handle_urgent_messages_command(sender_id, interface):
-    conn = sqlite3.connect('js8call.db')
-    c = conn.cursor()
-    c.execute("SELECT sender, groupname, message, timestamp FROM urgent")
-    messages = c.fetchall()
+    messages = get_urgent_messages()
     if messages:
         response = "Urgent Messages:\n" + "\n".join([f"[{i+1}] {msg[0]} -> {msg[1]}: {msg[2]} ({msg[3]})" for i, msg in enumerate(messages)])
         send_message(response, sender_id, interface)
@@ -283,11 +237,7 @@ def handle_group_message_selection(sender_id, message, step, state, interface):
     try:
         group_index = int(message)
         groupname = groups[group_index][0]
-
-        conn = sqlite3.connect('js8call.db')
-        c = conn.cursor()
-        c.execute("SELECT sender, message, timestamp FROM groups WHERE groupname=?", (groupname,))
-        messages = c.fetchall()
+        messages = get_group_messages(groupname)
 
         if messages:
             response = f"Messages for group {groupname}:\n" + "\n".join([f"[{i+1}] {msg[0]}: {msg[1]} ({msg[2]})" for i, msg in enumerate(messages)])
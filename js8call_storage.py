@@ -0,0 +1,111 @@
+import logging
+import sqlite3
+
+from db_connection import ConnectionPool
+
+# Lists show the newest messages only, so they stay short however long the log gets
+DEFAULT_LIST_LIMIT = 10
+
+_pool = None
+_list_limit = DEFAULT_LIST_LIMIT
+
+
+def configure_storage(path, list_limit=DEFAULT_LIST_LIMIT, max_connections=4):
+    """Opens the JS8Call message log at path, creating its tables and indexes if needed."""
+    global _pool, _list_limit
+    close_storage()
+    _pool = ConnectionPool(path, max_connections=max_connections)
+    _list_limit = list_limit
+    create_tables()
+
+
+def close_storage():
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+def create_tables():
+    conn = _pool.connection()
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender TEXT,
+                receiver TEXT,
+                message TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS groups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender TEXT,
+                groupname TEXT,
+                message TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS urgent (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender TEXT,
+                groupname TEXT,
+                message TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_groups_groupname ON groups (groupname, timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_urgent_timestamp ON urgent (timestamp)")
+    logging.getLogger('js8call').info("Database tables created or verified.")
+
+
+def insert_message(table, sender, receiver_or_group, message):
+    """Stores a message in 'messages', 'groups' or 'urgent'. Returns False if it could not be stored."""
+    if _pool is None:
+        return False
+    conn = _pool.connection()
+    try:
+        with conn:
+            conn.execute(f'''
+                INSERT INTO {table} (sender, { 'receiver' if table == 'messages' else 'groupname' }, message)
+                VALUES (?, ?, ?)
+            ''', (sender, receiver_or_group, message))
+    except sqlite3.Error as e:
+        logging.getLogger('js8call').error(f"Failed to insert message into {table} table: {e}")
+        return False
+    return True
+
+
+def _latest(sql, params=()):
+    # Newest first to use the timestamp index and stop after the limit, then shown oldest first
+    if _pool is None:
+        return []
+    c = _pool.connection().cursor()
+    c.execute(f"{sql} ORDER BY timestamp DESC, id DESC LIMIT ?", (*params, _list_limit))
+    return c.fetchall()[::-1]
+
+
+def get_groups():
+    if _pool is None:
+        return []
+    c = _pool.connection().cursor()
+    c.execute("SELECT DISTINCT groupname FROM groups ORDER BY groupname")
+    return c.fetchall()
+
+
+def get_group_messages(groupname):
+    """Returns (sender, message, timestamp) for the latest messages to groupname."""
+    return _latest("SELECT sender, message, timestamp FROM groups WHERE groupname = ?", (groupname,))
+
+
+def get_station_messages():
+    """Returns (sender, receiver, message, timestamp) for the latest directed messages."""
+    return _latest("SELECT sender, receiver, message, timestamp FROM messages")
+
+
+def get_urgent_messages():
+    """Returns (sender, groupname, message, timestamp) for the latest urgent messages."""
+    return _latest("SELECT sender, groupname, message, timestamp FROM urgent")
@@ -1,18 +1,26 @@
 import logging
 
-from meshtastic import BROADCAST_NUM
-
 from command_handlers import (
     handle_mail_command, handle_bulletin_command, handle_help_command, handle_stats_command, handle_fortune_command,
     handle_bb_steps, handle_mail_steps, handle_stats_steps, handle_wall_of_shame_command,
     handle_channel_directory_command, handle_channel_directory_steps, handle_send_mail_command,
     handle_read_mail_command, handle_check_mail_command, handle_delete_mail_confirmation, handle_post_bulletin_command,
     handle_check_bulletin_command, handle_read_bulletin_command, handle_read_channel_command,
-    handle_post_channel_command, handle_list_channels_command, handle_quick_help_command
+    handle_post_channel_command, handle_list_channels_command, handle_quick_help_command, handle_search_command,
+    handle_read_search_result
+)
+from db_operations import (
+    ingest_bulletin, ingest_mail, delete_bulletin, delete_mail, get_db_connection, add_channel, confirm_tombstones
 )
-from db_operations import add_bulletin, add_mail, delete_bulletin, delete_mail, get_db_connection, add_channel
 from js8call_integration import handle_js8call_command, handle_js8call_steps, handle_group_message_selection
-from utils import get_user_state, get_node_short_name, get_node_id_from_num, send_message
+from peers import node_key
+from sync_protocol import (
+    ReassemblyBuffer, SyncDecodeError, decode_batch, decode_sync_message, decode_sync_record, is_sync_frame, is_sync_message
+)
+from sync_reconcile import handle_digest, handle_have, handle_want
+from utils import get_user_state, get_node_short_name, get_node_id_from_num, get_transmit_scheduler
+
+sync_reassembly = ReassemblyBuffer()
 
 main_menu_handlers = {
     "q": handle_quick_help_command,
@@ -53,6 +61,42 @@ board_action_handlers = {
     "x": handle_help_command
 }
 
+def process_sync_record(sender_id, record_type, fields, interface):
+    if record_type == 'BULLETIN':
+        board, sender_short_name, subject, content, unique_id, created_at = fields
+        ingest_bulletin(board, sender_short_name, subject, content, unique_id, interface, created_at)
+    elif record_type == 'MAIL':
+        sender_id, sender_short_name, recipient_id, subject, content, unique_id, created_at = fields
+        ingest_mail(sender_id, sender_short_name, recipient_id, subject, content, unique_id, created_at)
+    elif record_type == 'DELETE_BULLETIN':
+        unique_id = fields[0]
+        if unique_id.isdigit():
+            # Older BBS versions send their local row id, which means nothing here
+            logging.info(f"Ignoring delete bulletin sync message with local id {unique_id}")
+            return
+        delete_bulletin(unique_id, [], interface)
+        confirm_tombstones([unique_id], node_key(sender_id))
+    elif record_type == 'DELETE_MAIL':
+        unique_id = fields[0]
+        logging.info(f"Processing delete mail with unique_id: {unique_id}")
+        recipient_id = get_recipient_id_by_mail(unique_id)
+        delete_mail(unique_id, recipient_id, [], interface)
+        confirm_tombstones([unique_id], node_key(sender_id))
+    elif record_type == 'CHANNEL':
+        channel_name, channel_url = fields
+        add_channel(channel_name, channel_url)
+    elif record_type == 'DIGEST':
+        handle_digest(sender_id, fields[0], interface)
+    elif record_type == 'SUBDIGEST':
+        node, digest = fields
+        handle_digest(sender_id, digest, interface, node)
+    elif record_type == 'HAVE':
+        node, keys = fields
+        handle_have(sender_id, node, keys, interface)
+    elif record_type == 'WANT':
+        handle_want(sender_id, fields[0], interface)
+
+
 def process_message(sender_id, message, interface, is_sync_message=False):
     state = get_user_state(sender_id)
     message_lower = message.lower().strip()
@@ -65,30 +109,28 @@ def process_message(sender_id, message, interface, is_sync_message=False):
         message_lower = message_lower[0]
 
     if is_sync_message:
-        if message.startswith("BULLETIN|"):
-            parts = message.split("|")
-            board, sender_short_name, subject, content, unique_id = parts[1], parts[2], parts[3], parts[4], parts[5]
-            add_bulletin(board, sender_short_name, subject, content, [], interface, unique_id=unique_id)
-
-            if board.lower() == "urgent":
-                notification_message = f"💥NEW URGENT BULLETIN💥\nFrom: {sender_short_name}\nTitle: {subject}"
-                send_message(notification_message, BROADCAST_NUM, interface)
-        elif message.startswith("MAIL|"):
-            parts = message.split("|")
-            sender_id, sender_short_name, recipient_id, subject, content, unique_id = parts[1], parts[2], parts[3], parts[4], parts[5], parts[6]
-            add_mail(sender_id, sender_short_name, recipient_id, subject, content, [], interface, unique_id=unique_id)
-        elif message.startswith("DELETE_BULLETIN|"):
-            unique_id = message.split("|")[1]
-            delete_bulletin(unique_id, [], interface)
-        elif message.startswith("DELETE_MAIL|"):
-            unique_id = message.split("|")[1]
-            logging.info(f"Processing delete mail with unique_id: {unique_id}")
-            recipient_id = get_recipient_id_by_mail(unique_id)
-            delete_mail(unique_id, recipient_id, [], interface)
-        elif message.startswith("CHANNEL|"):
-            parts = message.split("|")
-            channel_name, channel_url = parts[1], parts[2]
-            add_channel(channel_name, channel_url)
+        try:
+            if is_sync_frame(message):
+                record = sync_reassembly.add_frame(sender_id, message)
+                if record is None:
+                    return
+                record_type, fields = decode_sync_record(record)
+            else:
+                record_type, fields = decode_sync_message(message)
+        except SyncDecodeError as e:
+            logging.error(f"Ignoring malformed sync message: {e}")
+            return
+
+        if record_type == 'BATCH':
+            try:
+                records = decode_batch(fields[0])
+            except SyncDecodeError as e:
+                logging.error(f"Ignoring malformed sync batch: {e}")
+                return
+        else:
+            records = [(record_type, fields)]
+        for record_type, fields in records:
+            process_sync_record(sender_id, record_type, fields, interface)
     else:
         if message_lower.startswith("sm,,"):
             handle_send_mail_command(sender_id, message_strip, interface, bbs_nodes)
@@ -98,6 +140,8 @@ def process_message(sender_id, message, interface, is_sync_message=False):
             handle_post_bulletin_command(sender_id, message_strip, interface, bbs_nodes)
         elif message_lower.startswith("cb,,"):
             handle_check_bulletin_command(sender_id, message_strip, interface)
+        elif message_lower.startswith("sb,,"):
+            handle_search_command(sender_id, message_strip, interface)
         elif message_lower.startswith("chp,,"):
             handle_post_channel_command(sender_id, message_strip, interface)
         elif message_lower.startswith("chl"):
@@ -154,6 +198,9 @@ def process_message(sender_id, message, interface, is_sync_message=False):
                 elif command == 'CHECK_BULLETIN':
                     if step == 1:
                         handle_read_bulletin_command(sender_id, message, state, interface)
+                elif command == 'SEARCH':
+                    if step == 1:
+                        handle_read_search_result(sender_id, message, state, interface)
                 elif command == 'CHECK_CHANNEL':
                     if step == 1:
                         handle_read_channel_command(sender_id, message, state, interface)
@@ -178,6 +225,10 @@ def process_message(sender_id, message, interface, is_sync_message=False):
 
 def on_receive(packet, interface):
     try:
+        peers = getattr(interface, 'peers', None)
+        if peers is not None and packet.get('fromId') in peers:
+            peers.heard(packet['fromId'], packet)
+
         if 'decoded' in packet and packet['decoded']['portnum'] == 'TEXT_MESSAGE_APP':
             message_bytes = packet['decoded']['payload']
             message_string = message_bytes.decode('utf-8')
@@ -191,18 +242,20 @@ def on_receive(packet, interface):
             logging.info(f"Received message from user '{sender_short_name}' ({sender_node_id}) to {receiver_short_name}: {message_string}")
 
             bbs_nodes = interface.bbs_nodes
-            is_sync_message = any(message_string.startswith(prefix) for prefix in
-                                  ["BULLETIN|", "MAIL|", "DELETE_BULLETIN|", "DELETE_MAIL|"])
+            sync_channel = getattr(interface, 'sync_channel', None)
+            on_sync_channel = sync_channel is not None and packet.get('channel', 0) == sync_channel
 
-            if sender_node_id in bbs_nodes:
-                if is_sync_message:
+            if sender_node_id in bbs_nodes or on_sync_channel:
+                if is_sync_message(message_string):
                     process_message(sender_id, message_string, interface, is_sync_message=True)
                 else:
-                    logging.info("Ignoring non-sync message from known BBS node")
+                    logging.info("Ignoring non-sync message from known BBS node or on the sync channel")
             elif to_id is not None and to_id != 0 and to_id != 255 and to_id == interface.myInfo.my_node_num:
                 process_message(sender_id, message_string, interface, is_sync_message=False)
             else:
                 logging.info("Ignoring message sent to group chat or from unknown node")
+        elif 'decoded' in packet and packet['decoded']['portnum'] == 'ROUTING_APP':
+            get_transmit_scheduler(interface).handle_routing_packet(packet)
     except KeyError as e:
         logging.error(f"Error processing packet: {e}")
 
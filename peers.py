@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+
+
+def node_key(node):
+    """Returns the '!xxxxxxxx' form of a node id given as a number or a string."""
+    if isinstance(node, int):
+        return f"!{node:08x}"
+    return node
+
+
+class PeerTable:
+    """
+    Health of the peer BBS nodes listed in bbs_nodes.
+
+    Records when each peer was last heard and over how many hops, and how many transmissions to
+    it were acknowledged or lost. A peer is unreachable once failure_threshold transmissions in a
+    row have been lost and it has not been heard since, or when it has not been heard for
+    stale_after seconds. The transmit scheduler holds traffic for unreachable peers and resumes
+    it as soon as they are heard again, and serves healthier peers first.
+
+    Parameters:
+    -----------
+    interface : meshtastic.stream_interface.StreamInterface
+        Interface whose node database seeds the last heard times and hop counts.
+    bbs_nodes : list
+        Node ids of the peers.
+    failure_threshold : int
+        Consecutive lost transmissions after which a peer that has gone quiet is held.
+    stale_after : float
+        Seconds without hearing a peer after which it is held. 0 disables this check.
+    """
+
+    def __init__(self, interface, bbs_nodes, failure_threshold=3, stale_after=86400):
+        self.interface = interface
+        self.failure_threshold = failure_threshold
+        self.stale_after = stale_after
+        self.scheduler = None
+        self._lock = threading.Lock()
+        self._peers = {}
+        for node_id in bbs_nodes:
+            node = getattr(interface, 'nodes', {}).get(node_id) or {}
+            self._peers[node_id] = {
+                'last_heard': node.get('lastHeard'),
+                'hops': node.get('hopsAway'),
+                'snr': node.get('snr'),
+                'acked': 0,
+                'failed': 0,
+                'consecutive_failures': 0,
+                'last_failure': None,
+                'held': False,
+            }
+
+    def __contains__(self, node):
+        return node_key(node) in self._peers
+
+    def heard(self, node, packet):
+        """Records a packet received from a peer, releasing its traffic if it was held."""
+        peer = self._peers.get(node_key(node))
+        if peer is None:
+            return
+        with self._lock:
+            peer['last_heard'] = packet.get('rxTime') or time.time()
+            if 'hopStart' in packet and 'hopLimit' in packet:
+                peer['hops'] = packet['hopStart'] - packet['hopLimit']
+            if 'rxSnr' in packet:
+                peer['snr'] = packet['rxSnr']
+            released = self._update_held(node_key(node), peer)
+        if released and self.scheduler is not None:
+            self.scheduler.wake()
+
+    def record_delivery(self, node, delivered):
+        """Records the outcome of one transmission to a node. Ignores nodes that aren't peers."""
+        peer = self._peers.get(node_key(node))
+        if peer is None:
+            return
+        with self._lock:
+            if delivered:
+                peer['acked'] += 1
+                peer['consecutive_failures'] = 0
+            else:
+                peer['failed'] += 1
+                peer['consecutive_failures'] += 1
+                peer['last_failure'] = time.time()
+            self._update_held(node_key(node), peer)
+
+    def is_held(self, node):
+        peer = self._peers.get(node_key(node))
+        if peer is None:
+            return False
+        with self._lock:
+            self._update_held(node_key(node), peer)
+            return peer['held']
+
+    def rank(self, node):
+        """Returns 0 for healthy or unknown destinations, 1 for peers losing some traffic and 2 for poor ones."""
+        peer = self._peers.get(node_key(node))
+        if peer is None:
+            return 0
+        sent = peer['acked'] + peer['failed']
+        if not sent:
+            return 0
+        ack_rate = peer['acked'] / sent
+        if ack_rate >= 0.8:
+            return 0
+        return 1 if ack_rate >= 0.5 else 2
+
+    def reachable_peers(self):
+        return [node_id for node_id in self._peers if not self.is_held(node_id)]
+
+    def _update_held(self, node_id, peer):
+        """
+        Re-evaluates whether a peer is held. Caller holds the lock.
+
+        Returns True if the peer was just released, False if it was just held, None if unchanged.
+        """
+        last_heard = peer['last_heard']
+        failing = (peer['consecutive_failures'] >= self.failure_threshold
+                   and (last_heard is None or last_heard < peer['last_failure']))
+        stale = bool(self.stale_after) and last_heard is not None and time.time() - last_heard > self.stale_after
+        held = failing or stale
+        if held == peer['held']:
+            return None
+        peer['held'] = held
+        if held:
+            reason = f"{peer['consecutive_failures']} lost transmissions" if failing else "not heard recently"
+            logging.warning(f"Peer {node_id} is unreachable ({reason}), holding its traffic")
+            return False
+        logging.info(f"Peer {node_id} heard again, resuming its traffic")
+        return True
+
+    def get_stats(self):
+        now = time.time()
+        backlog = {}
+        scheduler = self.scheduler
+        if scheduler is not None:
+            backlog = {node_key(destination): depth for destination, depth in scheduler.get_destination_depths().items()}
+        outbox = getattr(self.interface, 'sync_outbox', None)
+        outbox_backlog = outbox.get_peer_backlog() if outbox is not None else {}
+
+        stats = {}
+        with self._lock:
+            for node_id, peer in self._peers.items():
+                sent = peer['acked'] + peer['failed']
+                stats[node_id] = {
+                    'state': 'held' if peer['held'] else 'up',
+                    'last_heard_age': now - peer['last_heard'] if peer['last_heard'] else None,
+                    'hops': peer['hops'],
+                    'snr': peer['snr'],
+                    'acked': peer['acked'],
+                    'failed': peer['failed'],
+                    'ack_rate': peer['acked'] / sent if sent else None,
+                    'queued': backlog.get(node_id, 0),
+                    'outbox': outbox_backlog.get(node_id, 0),
+                }
+        return stats
+
+    def log_stats(self):
+        for node_id, peer in self.get_stats().items():
+            heard = f"{peer['last_heard_age'] / 60:.0f}m ago" if peer['last_heard_age'] is not None else "never"
+            ack_rate = f"{peer['ack_rate']:.0%}" if peer['ack_rate'] is not None else "n/a"
+            hops = peer['hops'] if peer['hops'] is not None else "?"
+            logging.info(f"PEER {node_id}: {peer['state']}, heard {heard} over {hops} hop(s), "
+                         f"ack rate {ack_rate} ({peer['acked']} acked, {peer['failed']} lost), "
+                         f"backlog {peer['queued']} queued, {peer['outbox']} in outbox")
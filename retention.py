@@ -0,0 +1,119 @@
+import logging
+import time
+
+from db_connection import get_db_connection
+from db_writer import submit_write
+
+DAY_MS = 86400 * 1000
+
+
+def _expire_batch(c, table, record_type, column, value, max_age, max_count, batch_size):
+    """Moves up to batch_size posts past their limits from table to expired. Returns how many."""
+    collate = " COLLATE NOCASE" if column == 'board' else ""
+    cutoff = int(time.time() * 1000 - max_age * DAY_MS) if max_age else 0
+    c.execute(f"SELECT id FROM {table} WHERE {column} = ?{collate} AND (created_at < ? OR id NOT IN "
+              f"(SELECT id FROM {table} WHERE {column} = ?{collate} ORDER BY created_at DESC, id DESC LIMIT ?)) "
+              f"LIMIT ?", (value, cutoff, value, max_count or -1, batch_size))
+    ids = [row[0] for row in c.fetchall()]
+    if not ids:
+        return 0
+    placeholders = ','.join('?' * len(ids))
+    c.execute(f"INSERT OR IGNORE INTO expired (unique_id, record_type, expired_at, created_at) "
+              f"SELECT unique_id, ?, ?, created_at FROM {table} WHERE id IN ({placeholders})",
+              [record_type, time.time()] + ids)
+    c.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+    return len(ids)
+
+
+def _expire(table, record_type, column, value, max_age, max_count, batch_size):
+    expired = 0
+    while True:
+        count = submit_write(_expire_batch, table, record_type, column, value, max_age, max_count, batch_size).result()
+        expired += count
+        if count < batch_size:
+            return expired
+
+
+def expire_bulletins(retention):
+    """Expires bulletins past their board's age or count limit. Returns the number expired."""
+    c = get_db_connection().cursor()
+    c.execute("SELECT board FROM bulletins GROUP BY board COLLATE NOCASE")
+    expired = 0
+    for (board,) in c.fetchall():
+        max_age, max_count = retention['boards'].get(board.lower(),
+                                                     (retention['bulletin_max_age'], retention['bulletin_max_count']))
+        if max_age or max_count:
+            expired += _expire('bulletins', 'BULLETIN', 'board', board, max_age, max_count, retention['batch_size'])
+    return expired
+
+
+def expire_mail(retention):
+    """Expires mail past the mailbox age or count limit. Returns the number expired."""
+    max_age, max_count = retention['mail_max_age'], retention['mail_max_count']
+    if not max_age and not max_count:
+        return 0
+    cutoff = int(time.time() * 1000 - max_age * DAY_MS) if max_age else 0
+    c = get_db_connection().cursor()
+    if max_count:
+        c.execute("SELECT recipient FROM mail GROUP BY recipient HAVING MIN(created_at) < ? OR COUNT(*) > ?",
+                  (cutoff, max_count))
+    else:
+        c.execute("SELECT recipient FROM mail GROUP BY recipient HAVING MIN(created_at) < ?", (cutoff,))
+    expired = 0
+    for (recipient,) in c.fetchall():
+        expired += _expire('mail', 'MAIL', 'recipient', recipient, max_age, max_count, retention['batch_size'])
+    return expired
+
+
+def _incremental_vacuum(c, pages):
+    # sqlite3 steps a statement without result columns only once, and each step frees one page
+    for _ in range(pages):
+        c.execute("PRAGMA incremental_vacuum(1)")
+
+
+def reclaim_space(max_pages):
+    """
+    Returns free pages to the file system with incremental vacuum, max_pages at a time, so the
+    database is never locked for a full VACUUM. Returns the number of pages reclaimed.
+    """
+    c = get_db_connection().cursor()
+    c.execute("PRAGMA freelist_count")
+    free = c.fetchone()[0]
+    reclaimed = 0
+    while reclaimed < free:
+        pages = min(max_pages, free - reclaimed)
+        submit_write(_incremental_vacuum, pages).result()
+        reclaimed += pages
+    return reclaimed
+
+
+def compact_expired(retention, min_age):
+    """
+    Forgets expired posts created longer ago than the longest age limit plus min_age seconds, by
+    which time peers with the same limits have expired them too and no longer offer them. Returns
+    a Future that resolves to the number forgotten.
+
+    While any board or mailbox is limited by count alone, peers may still hold its posts at any
+    age, so expired posts are remembered for good rather than fetched back and expired again.
+    """
+    limits = [(retention['bulletin_max_age'], retention['bulletin_max_count']),
+              (retention['mail_max_age'], retention['mail_max_count'])] + list(retention['boards'].values())
+    max_ages = [max_age for max_age, max_count in limits if max_age or max_count]
+
+    def write(c):
+        if not all(max_ages):
+            return 0
+        cutoff = int(time.time() * 1000 - max(max_ages, default=0) * DAY_MS - min_age * 1000)
+        c.execute("DELETE FROM expired WHERE created_at < ?", (cutoff,))
+        return c.rowcount
+    return submit_write(write)
+
+
+def run_retention(retention):
+    """Expires bulletins and mail past their limits and reclaims the space they used."""
+    bulletins = expire_bulletins(retention)
+    mail = expire_mail(retention)
+    reclaimed = reclaim_space(retention['vacuum_pages'])
+    if bulletins or mail or reclaimed:
+        logging.info(f"Expired {bulletins} bulletin(s) and {mail} mail message(s), reclaimed {reclaimed} page(s)")
+    return bulletins, mail
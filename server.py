@@ -15,11 +15,25 @@ other BBS servers listed in the config.ini file.
 import logging
 import time
 
+from airtime import AirtimeBudget, get_radio_parameters
 from config_init import initialize_config, get_interface, init_cli_parser, merge_config
-from db_operations import initialize_database
+from db_compression import configure_compression
+from db_connection import configure_database, close_database
+from db_memory import MemoryDatabase
+from db_operations import initialize_database, compact_tombstones, board_cache
+from db_writer import start_writer, stop_writer
 from js8call_integration import JS8CallClient
+from js8call_storage import close_storage
 from message_processing import on_receive
+from peers import PeerTable
 from pubsub import pub
+from retention import compact_expired, run_retention
+from sync_batcher import SyncBatcher
+from sync_outbox import SyncOutbox
+from sync_reconcile import send_digests
+from transmit import TransmitScheduler
+
+TOMBSTONE_COMPACTION_INTERVAL = 3600
 
 # General logging
 logging.basicConfig(
@@ -59,13 +73,65 @@ def main():
 
     merge_config(system_config, args)
 
+    database_config = system_config['database']
+    database_path = database_config['path']
+    memory_database = None
+    if database_config['ram_mode']:
+        memory_database = MemoryDatabase(database_path, database_config['checkpoint_interval'],
+                                         database_config['journal_sync_interval'])
+        memory_database.load()
+        database_path = memory_database.uri
+    configure_database(database_path, max_connections=database_config['max_connections'],
+                       busy_timeout=database_config['busy_timeout'], synchronous=database_config['synchronous'],
+                       cache_size=database_config['cache_size'])
+    configure_compression(database_config['compress_threshold'], database_config['compress_level'])
+
     interface = get_interface(system_config)
     interface.bbs_nodes = system_config['bbs_nodes']
     interface.allowed_nodes = system_config['allowed_nodes']
+    sync_config = system_config['sync']
+    interface.sync_wire_format = sync_config['wire_format']
+    interface.sync_channel = sync_config['multicast_channel']
+    if interface.sync_channel is not None:
+        logging.info(f"Sync is multicast on channel {interface.sync_channel}")
+    interface.peers = PeerTable(interface, interface.bbs_nodes, sync_config['peer_failure_threshold'],
+                                sync_config['peer_stale_after'])
+
+    transmit_config = system_config['transmit']
+    interface.tx_scheduler = TransmitScheduler(
+        interface,
+        max_queue=transmit_config['queue_size'],
+        max_sync_queue=transmit_config['sync_queue_size'],
+        radio_interval=transmit_config['radio_interval'],
+        destination_interval=transmit_config['destination_interval'],
+        max_payload_bytes=transmit_config['max_payload_bytes'],
+        radio_parameters=get_radio_parameters(interface, transmit_config['modem_preset']),
+        budget=AirtimeBudget(transmit_config['airtime_window'], transmit_config['max_duty_cycle']),
+        max_defer=transmit_config['max_defer'],
+        aging_interval=transmit_config['aging_interval'],
+        ack_timeout=transmit_config['ack_timeout'],
+        max_retries=transmit_config['max_retries'],
+        retry_backoff=transmit_config['retry_backoff'],
+        peers=interface.peers
+    )
+    interface.tx_scheduler.start()
+
+    if sync_config['batch_window'] > 0:
+        interface.sync_batcher = SyncBatcher(interface, sync_config['batch_window'], sync_config['batch_max_records'])
+        interface.sync_batcher.start()
 
     logging.info(f"TC²-BBS is running on {system_config['interface_type']} interface...")
 
     initialize_database()
+    db_writer = start_writer(max_batch=database_config['write_batch_size'], max_delay=database_config['write_delay'],
+                             journal=memory_database)
+    if memory_database:
+        memory_database.start()
+
+    if sync_config['outbox']:
+        interface.sync_outbox = SyncOutbox(interface, sync_config['outbox_retry_interval'],
+                                           sync_config['outbox_max_attempts'])
+        interface.sync_outbox.start()
 
     def receive_packet(packet, interface):
         on_receive(packet, interface)
@@ -76,18 +142,70 @@ def main():
     js8call_client = JS8CallClient(interface)
     js8call_client.logger = js8call_logger
 
-    if js8call_client.db_conn:
+    if js8call_client.db_file:
         js8call_client.connect()
 
+    stats_interval = transmit_config['stats_interval']
+    last_stats = time.monotonic()
+
+    reconcile_interval = sync_config['reconcile_interval']
+    if interface.sync_wire_format == 'legacy':
+        logging.info("Sync reconciliation needs the compact wire format and is disabled")
+        reconcile_interval = 0
+    last_reconcile = time.monotonic()
+    last_compaction = time.monotonic()
+    retention_config = system_config['retention']
+    last_retention = time.monotonic() - retention_config['interval']
+
     try:
         while True:
             time.sleep(1)
 
+            if stats_interval and time.monotonic() - last_stats >= stats_interval:
+                last_stats = time.monotonic()
+                interface.tx_scheduler.log_stats()
+                if getattr(interface, 'sync_batcher', None):
+                    interface.sync_batcher.log_stats()
+                if getattr(interface, 'sync_outbox', None):
+                    interface.sync_outbox.log_stats()
+                interface.peers.log_stats()
+                db_writer.log_stats()
+                board_cache.log_stats()
+                if memory_database:
+                    memory_database.log_stats()
+
+            if reconcile_interval and time.monotonic() - last_reconcile >= reconcile_interval:
+                last_reconcile = time.monotonic()
+                send_digests(interface.bbs_nodes, interface)
+
+            if time.monotonic() - last_compaction >= TOMBSTONE_COMPACTION_INTERVAL:
+                last_compaction = time.monotonic()
+                removed = compact_tombstones(interface.bbs_nodes, sync_config['tombstone_min_age']).result()
+                if removed:
+                    logging.info(f"Compacted {removed} tombstone(s) confirmed by every BBS node")
+                forgotten = compact_expired(retention_config, sync_config['tombstone_min_age']).result()
+                if forgotten:
+                    logging.info(f"Forgot {forgotten} post(s) expired longer ago than every retention limit")
+
+            if retention_config['interval'] and time.monotonic() - last_retention >= retention_config['interval']:
+                last_retention = time.monotonic()
+                run_retention(retention_config)
+
     except KeyboardInterrupt:
         logging.info("Shutting down the server...")
+        if getattr(interface, 'sync_outbox', None):
+            interface.sync_outbox.stop()
+        if getattr(interface, 'sync_batcher', None):
+            interface.sync_batcher.stop()
+        interface.tx_scheduler.stop()
         interface.close()
         if js8call_client.connected:
             js8call_client.close()
+        close_storage()
+        stop_writer()
+        if memory_database:
+            memory_database.stop()
+        close_database()
 
 if __name__ == "__main__":
     main()
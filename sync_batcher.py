@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+
+from sync_protocol import encode_batch, encode_sync_frames
+from utils import send_sync_message, get_transmit_scheduler
+
+
+class SyncBatcher:
+    """
+    Coalesces sync records for peer BBS nodes into one combined frame per peer.
+
+    The first record added opens a window of window seconds. When it closes, or once max_records
+    records are waiting, every peer is sent all of its waiting records at once: a single record
+    goes out on its own and several go out as one BATCH record, so pacing and framing overhead is
+    paid once per burst rather than once per post and peer. Records keep their order.
+
+    Parameters:
+    -----------
+    interface : meshtastic.stream_interface.StreamInterface
+        Interface used to transmit.
+    window : float
+        Seconds to wait for further records after the first one of a batch arrives.
+    max_records : int
+        Number of waiting records that flushes the batch straight away.
+    """
+
+    def __init__(self, interface, window=5.0, max_records=10):
+        self.interface = interface
+        self.window = window
+        self.max_records = max_records
+
+        self._pending = []
+        self._deadline = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self._stats = {
+            'records': 0,
+            'batches': 0,
+            'frames': 0,
+            'max_batch': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+        }
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='sync-batcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the batcher thread, sending whatever is still waiting."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._flush(self._take_pending())
+
+    def add(self, record_type, fields, bbs_nodes, on_complete=None):
+        """
+        Queues one sync record for every node in bbs_nodes.
+
+        on_complete, if given, is called with the node id and True or False once the frames
+        carrying the record to that node were delivered or lost.
+        """
+        with self._condition:
+            self._pending.append((record_type, list(fields), list(bbs_nodes), time.monotonic(), on_complete))
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self.window
+            self._condition.notify_all()
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['avg_batch'] = stats['records'] / stats['batches'] if stats['batches'] else 0.0
+        stats['avg_latency'] = stats['total_latency'] / stats['records'] if stats['records'] else 0.0
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logging.info(f"SYNC BATCHES: {stats['records']} record(s) in {stats['batches']} batch(es), "
+                     f"avg {stats['avg_batch']:.1f} max {stats['max_batch']} per batch, {stats['frames']} frame(s) sent, "
+                     f"flush latency avg {stats['avg_latency']:.1f}s max {stats['max_latency']:.1f}s, "
+                     f"{stats['pending']} waiting")
+
+    def _take_pending(self):
+        with self._condition:
+            pending, self._pending = self._pending, []
+            self._deadline = None
+        return pending
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running:
+                    if len(self._pending) >= self.max_records:
+                        break
+                    if self._deadline is not None and time.monotonic() >= self._deadline:
+                        break
+                    wait = None if self._deadline is None else self._deadline - time.monotonic()
+                    self._condition.wait(timeout=wait)
+                if not self._running:
+                    return
+            self._flush(self._take_pending())
+
+    def _flush(self, pending):
+        if not pending:
+            return
+        now = time.monotonic()
+        max_bytes = get_transmit_scheduler(self.interface).max_payload_bytes
+
+        destinations = []
+        for _, _, bbs_nodes, _, _ in pending:
+            destinations.extend(node_id for node_id in bbs_nodes if node_id not in destinations)
+
+        # Peers that are owed the same records share one encoding
+        encoded = {}
+        frame_count = 0
+        for node_id in destinations:
+            indexes = tuple(i for i, (_, _, bbs_nodes, _, _) in enumerate(pending) if node_id in bbs_nodes)
+            parts = encoded.get(indexes)
+            if parts is None:
+                parts = encoded[indexes] = self._encode([pending[i] for i in indexes], max_bytes)
+            for frames, records in parts:
+                callbacks = [record[4] for record in records if record[4]]
+                send_sync_message(frames, node_id, self.interface,
+                                  on_complete=self._completion(node_id, callbacks) if callbacks else None)
+                frame_count += len(frames)
+            # Records too large to send at all
+            sent = {id(record) for _, records in parts for record in records}
+            for i in indexes:
+                if id(pending[i]) not in sent and pending[i][4]:
+                    pending[i][4](node_id, False)
+
+        with self._condition:
+            self._stats['records'] += len(pending)
+            self._stats['batches'] += 1
+            self._stats['frames'] += frame_count
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(pending))
+            for _, _, _, added_at, _ in pending:
+                self._stats['total_latency'] += now - added_at
+                self._stats['max_latency'] = max(self._stats['max_latency'], now - added_at)
+        logging.info(f"SERVER SYNC: Sent {len(pending)} sync record(s) to {len(destinations)} BBS node(s) "
+                     f"in {frame_count} frame(s)")
+
+    @staticmethod
+    def _completion(node_id, callbacks):
+        def on_complete(delivered):
+            for callback in callbacks:
+                callback(node_id, delivered)
+        return on_complete
+
+    def _encode(self, records, max_bytes):
+        """
+        Returns (frames, records) pairs that together carry records, in order. A BATCH too large
+        to send is split in two until every part fits; a record too large on its own is left out.
+        """
+        try:
+            if len(records) == 1:
+                record_type, fields = records[0][:2]
+                return [(encode_sync_frames(record_type, fields, max_bytes), records)]
+            return [(encode_sync_frames('BATCH', [encode_batch(record[:2] for record in records)], max_bytes), records)]
+        except ValueError as e:
+            if len(records) == 1:
+                logging.error(f"SERVER SYNC: Unable to encode {records[0][0]} sync record: {e}")
+                return []
+        half = len(records) // 2
+        return self._encode(records[:half], max_bytes) + self._encode(records[half:], max_bytes)
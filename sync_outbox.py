@@ -0,0 +1,218 @@
+import json
+import logging
+import threading
+import time
+
+from db_operations import get_db_connection
+from db_writer import after_commit, submit_write
+from utils import encode_sync, send_sync_message, SYNC_MULTICAST
+
+# Acknowledgements arriving this close together are written to the outbox in one commit
+OUTCOME_BATCH_DELAY = 1.0
+
+
+class SyncOutbox:
+    """
+    Durable per-peer journal of outbound sync records.
+
+    Every record is written to the sync_outbox table, one row per peer, before anything is sent,
+    and a row is only removed once the transmit scheduler reports that the frames carrying it
+    were acknowledged by that peer. Rows whose delivery failed are sent again after
+    retry_interval seconds, up to max_attempts times. When the BBS starts, every row still in
+    the table is replayed, so a restart or a radio outage never loses a post.
+
+    Journal rows are added with the cursor of the write that caused them, so they become durable
+    in the same commit as the post, and are only sent once that commit has happened.
+    Confirmations and failures are written back in batches on the outbox thread.
+
+    Parameters:
+    -----------
+    interface : meshtastic.stream_interface.StreamInterface
+        Interface used to transmit.
+    retry_interval : float
+        Seconds to wait before resending a record whose delivery failed.
+    max_attempts : int
+        Number of failed deliveries after which a record is dropped from the outbox.
+        0 keeps trying forever.
+    """
+
+    def __init__(self, interface, retry_interval=600, max_attempts=10):
+        self.interface = interface
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+
+        self._delivered = []
+        self._failed = []
+        self._retry_at = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self._stats = {
+            'journaled': 0,
+            'delivered': 0,
+            'failed': 0,
+            'replayed': 0,
+            'abandoned': 0,
+        }
+
+    def start(self):
+        """Replays the records left in the outbox and starts the outbox thread."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='sync-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._write_outcomes()
+
+    def add(self, c, record_type, fields, bbs_nodes):
+        """
+        Journals one sync record for every node in bbs_nodes with the cursor c of the calling write
+        function, and hands it on for delivery once that write is committed.
+        """
+        payload = json.dumps(list(fields))
+        now = time.time()
+        entries = {}
+        for node_id in bbs_nodes:
+            c.execute("INSERT INTO sync_outbox (peer, record_type, fields, created_at) VALUES (?, ?, ?, ?)",
+                      (node_id, record_type, payload, now))
+            entries[node_id] = c.lastrowid
+
+        def committed():
+            with self._condition:
+                self._stats['journaled'] += len(entries)
+            self._send(record_type, fields, entries)
+        after_commit(committed)
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats['awaiting_retry'] = len(self._retry_at)
+        c = get_db_connection().cursor()
+        c.execute("SELECT COUNT(*) FROM sync_outbox")
+        stats['pending'] = c.fetchone()[0]
+        return stats
+
+    def get_peer_backlog(self):
+        """Returns the number of undelivered records per peer."""
+        c = get_db_connection().cursor()
+        c.execute("SELECT peer, COUNT(*) FROM sync_outbox GROUP BY peer")
+        return dict(c.fetchall())
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logging.info(f"SYNC OUTBOX: {stats['pending']} pending ({stats['awaiting_retry']} awaiting retry), "
+                     f"{stats['journaled']} journaled, {stats['delivered']} delivered, {stats['failed']} failed, "
+                     f"{stats['replayed']} replayed, {stats['abandoned']} abandoned")
+
+    def _send(self, record_type, fields, entries):
+        """Sends a record to each peer in entries, a dict of node id to outbox row id."""
+        def on_complete(node_id, delivered):
+            self._resolve(entries[node_id], delivered)
+
+        batcher = getattr(self.interface, 'sync_batcher', None)
+        if batcher is not None and getattr(self.interface, 'sync_wire_format', 'compact') != 'legacy':
+            batcher.add(record_type, fields, list(entries), on_complete=on_complete)
+            return
+        frames = encode_sync(self.interface, record_type, *fields)
+        for node_id, entry_id in entries.items():
+            send_sync_message(frames, node_id, self.interface,
+                              on_complete=lambda delivered, entry_id=entry_id: self._resolve(entry_id, delivered))
+
+    def _resolve(self, entry_id, delivered):
+        with self._condition:
+            (self._delivered if delivered else self._failed).append(entry_id)
+            self._condition.notify_all()
+
+    def _write_outcomes(self):
+        """Removes delivered rows and records failed attempts, in one write."""
+        with self._condition:
+            delivered, self._delivered = self._delivered, []
+            failed, self._failed = self._failed, []
+        if not delivered and not failed:
+            return
+
+        def write(c):
+            if delivered:
+                # A delete acknowledged by a peer means it holds the tombstone
+                c.execute(f"SELECT peer, fields FROM sync_outbox WHERE record_type IN ('DELETE_BULLETIN', 'DELETE_MAIL') "
+                          f"AND peer != ? AND id IN ({','.join('?' * len(delivered))})", [SYNC_MULTICAST] + delivered)
+                c.executemany("INSERT OR IGNORE INTO tombstone_confirmations (unique_id, peer) "
+                              "SELECT unique_id, ? FROM tombstones WHERE unique_id = ?",
+                              [(peer, json.loads(fields)[0]) for peer, fields in c.fetchall()])
+            c.executemany("DELETE FROM sync_outbox WHERE id = ?", [(entry_id,) for entry_id in delivered])
+            c.executemany("UPDATE sync_outbox SET attempts = attempts + 1 WHERE id = ?", [(entry_id,) for entry_id in failed])
+            if self.max_attempts and failed:
+                c.execute(f"DELETE FROM sync_outbox WHERE attempts >= ? AND id IN ({','.join('?' * len(failed))})",
+                          [self.max_attempts] + failed)
+                return c.rowcount
+            return 0
+
+        abandoned = submit_write(write).result()
+        if abandoned:
+            logging.warning(f"SERVER SYNC: Dropped {abandoned} sync record(s) from the outbox after "
+                            f"{self.max_attempts} failed attempts")
+
+        retry_at = time.monotonic() + self.retry_interval
+        with self._condition:
+            self._stats['delivered'] += len(delivered)
+            self._stats['failed'] += len(failed)
+            self._stats['abandoned'] += abandoned
+            for entry_id in failed:
+                self._retry_at[entry_id] = retry_at
+
+    def _resend(self, entry_ids=None):
+        """Sends outbox rows again, all of them when entry_ids is None. Returns how many were sent."""
+        c = get_db_connection().cursor()
+        if entry_ids is None:
+            c.execute("SELECT id, peer, record_type, fields FROM sync_outbox ORDER BY id")
+        else:
+            c.execute(f"SELECT id, peer, record_type, fields FROM sync_outbox WHERE id IN ({','.join('?' * len(entry_ids))}) "
+                      f"ORDER BY id", list(entry_ids))
+        rows = c.fetchall()
+
+        # Rows journaled together for several peers go out as one record again
+        records = {}
+        for entry_id, peer, record_type, fields in rows:
+            records.setdefault((record_type, fields), {})[peer] = entry_id
+        for (record_type, fields), entries in records.items():
+            self._send(record_type, json.loads(fields), entries)
+        return len(rows)
+
+    def _run(self):
+        replayed = self._resend()
+        if replayed:
+            logging.info(f"SERVER SYNC: Replaying {replayed} unsent sync record(s) from the outbox")
+            with self._condition:
+                self._stats['replayed'] += replayed
+
+        while True:
+            with self._condition:
+                while self._running and not self._delivered and not self._failed:
+                    now = time.monotonic()
+                    due = [entry_id for entry_id, retry_at in self._retry_at.items() if retry_at <= now]
+                    if due:
+                        break
+                    wait = min(self._retry_at.values()) - now if self._retry_at else None
+                    self._condition.wait(timeout=wait)
+                if not self._running:
+                    return
+                if self._delivered or self._failed:
+                    self._condition.wait(timeout=OUTCOME_BATCH_DELAY)
+                now = time.monotonic()
+                due = [entry_id for entry_id, retry_at in self._retry_at.items() if retry_at <= now]
+                for entry_id in due:
+                    del self._retry_at[entry_id]
+
+            self._write_outcomes()
+            if due:
+                logging.info(f"SERVER SYNC: Retrying {len(due)} sync record(s) from the outbox")
+                self._resend(due)
@@ -0,0 +1,396 @@
+import base64
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+# Compact sync frames are the prefix, a version digit and a base85 armoured record
+SYNC_PREFIX = '~S'
+WIRE_VERSION = '1'
+
+# Records too large for one packet are split into numbered frames, each the prefix, a version
+# digit and a base85 armoured frame header plus a slice of the record
+FRAME_PREFIX = '~F'
+FRAME_HEADER_SIZE = 6  # 4 byte message id, sequence number, total frame count
+MAX_FRAMES = 255
+
+LEGACY_PREFIXES = ("BULLETIN|", "MAIL|", "DELETE_BULLETIN|", "DELETE_MAIL|", "CHANNEL|")
+LEGACY_RECORD_TYPES = tuple(prefix[:-1] for prefix in LEGACY_PREFIXES)
+# Fields added to these record types after the legacy format are left out of legacy messages and
+# decoded as None
+LEGACY_FIELD_COUNTS = {'BULLETIN': 5, 'MAIL': 6}
+
+# Record types: type code, field kinds, and the index of the free-text field that may contain '|'
+# in the legacy format. 'uuid' and 'node' fields are packed to 16 and 4 bytes when they are well formed,
+# 'int' fields are varints and 'bytes' fields are length-prefixed binary. Posts end with the time
+# they were created on their origin BBS, in epoch milliseconds.
+RECORD_TYPES = {
+    'BULLETIN': (1, ('str', 'str', 'str', 'str', 'uuid', 'int'), 3),
+    'MAIL': (2, ('node', 'str', 'node', 'str', 'str', 'uuid', 'int'), 4),
+    'DELETE_BULLETIN': (3, ('uuid',), None),
+    'DELETE_MAIL': (4, ('uuid',), None),
+    'CHANNEL': (5, ('str', 'str'), 1),
+    # Reconciliation between peers, compact format only
+    'DIGEST': (6, ('bytes',), None),
+    'HAVE': (7, ('int', 'bytes'), None),
+    'WANT': (8, ('bytes',), None),
+    # Several of the records above sent together, see encode_batch
+    'BATCH': (9, ('bytes',), None),
+    # Reconciliation of one bucket's children, see sync_reconcile
+    'SUBDIGEST': (10, ('int', 'bytes'), None),
+}
+RECORD_NAMES = {code: name for name, (code, _, _) in RECORD_TYPES.items()}
+
+# Header byte: low nibble is the record type, then flag bits
+FLAG_COMPRESSED = 0x10
+FLAG_FALLBACK = 0x20  # a fallback mask byte follows, marking compact fields sent as plain strings
+
+# Preset deflate dictionary shared by every BBS speaking this wire version. Deflate favours
+# matches close to the data, so the most common strings are at the end. Changing it requires a
+# new WIRE_VERSION.
+_SYNC_DICTIONARY = (
+    b"Check in with your callsign and location. All stations welcome. Thanks for the update. "
+    b"Please reply if you can hear this message. Net control, repeater, frequency, simplex, "
+    b"antenna, battery, solar, weather forecast, power outage, road closed, emergency, "
+    b"meeting at the community center, tomorrow morning, this weekend, tonight at, "
+    b"https://meshtastic.org/e/#, Re: , would like to, does anyone have, looking for, "
+    b"there will be, about the, there is a, if you have, let me know, the mesh, "
+    b"node, nodes, channel, message, messages, bulletin, test, hello, General, Info, News, Urgent, "
+    b" with the for the and the in the of the to the on the at the from the that is this is it is "
+    b" you are we are I am will be have been has been "
+    b" the and that have for not with you this but his from they say her she will one all would "
+    b"there their what about which when make can like time just him know take people into year "
+    b"your good some could them see other than then now look only come its over think also back "
+    b"after use two how our work first well way even new want because any these give day most us "
+)
+
+_UUID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+_NODE_RE = re.compile(r'^![0-9a-f]{8}$')
+
+
+class SyncDecodeError(ValueError):
+    pass
+
+
+def is_sync_message(text):
+    return text.startswith((SYNC_PREFIX, FRAME_PREFIX)) or text.startswith(LEGACY_PREFIXES)
+
+
+def is_sync_frame(text):
+    return text.startswith(FRAME_PREFIX)
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise SyncDecodeError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _pack_compact(kind, value):
+    """Returns the packed bytes of a uuid or node field, or None if the value isn't in canonical form."""
+    value = str(value)
+    if kind == 'uuid' and _UUID_RE.match(value):
+        return uuid.UUID(value).bytes
+    if kind == 'node' and _NODE_RE.match(value):
+        return bytes.fromhex(value[1:])
+    return None
+
+
+def _unpack_compact(kind, data):
+    if kind == 'uuid':
+        return str(uuid.UUID(bytes=bytes(data)))
+    return '!' + bytes(data).hex()
+
+
+def encode_record(record_type, fields):
+    """Packs a sync record into its binary form, without compression or armour."""
+    code, kinds, _ = RECORD_TYPES[record_type]
+    if len(fields) != len(kinds):
+        raise ValueError(f"{record_type} records have {len(kinds)} fields, got {len(fields)}")
+
+    body = bytearray()
+    fallback_mask = 0
+    for i, (kind, value) in enumerate(zip(kinds, fields)):
+        if kind == 'int':
+            _write_varint(body, int(value))
+            continue
+        if kind == 'bytes':
+            _write_varint(body, len(value))
+            body += value
+            continue
+        packed = _pack_compact(kind, value) if kind != 'str' else None
+        if packed is not None:
+            body += packed
+            continue
+        if kind != 'str':
+            fallback_mask |= 1 << i
+        encoded = str(value).encode('utf-8')
+        _write_varint(body, len(encoded))
+        body += encoded
+
+    header = bytearray([code | (FLAG_FALLBACK if fallback_mask else 0)])
+    if fallback_mask:
+        header.append(fallback_mask)
+    return bytes(header + body)
+
+
+def decode_record(data):
+    """Unpacks a binary sync record, returning (record_type, fields)."""
+    if not data:
+        raise SyncDecodeError("Empty record")
+    header = data[0]
+    record_type = RECORD_NAMES.get(header & 0x0f)
+    if record_type is None:
+        raise SyncDecodeError(f"Unknown record type {header & 0x0f}")
+    _, kinds, _ = RECORD_TYPES[record_type]
+
+    pos = 1
+    fallback_mask = 0
+    if header & FLAG_FALLBACK:
+        if pos >= len(data):
+            raise SyncDecodeError(f"Truncated {record_type} record")
+        fallback_mask = data[pos]
+        pos += 1
+
+    fields = []
+    for i, kind in enumerate(kinds):
+        if kind == 'int':
+            value, pos = _read_varint(data, pos)
+            fields.append(value)
+            continue
+        if kind == 'bytes':
+            length, pos = _read_varint(data, pos)
+            if pos + length > len(data):
+                raise SyncDecodeError(f"Truncated {record_type} record")
+            fields.append(bytes(data[pos:pos + length]))
+            pos += length
+            continue
+        if kind in ('uuid', 'node') and not fallback_mask & (1 << i):
+            size = 16 if kind == 'uuid' else 4
+            if pos + size > len(data):
+                raise SyncDecodeError(f"Truncated {record_type} record")
+            fields.append(_unpack_compact(kind, data[pos:pos + size]))
+            pos += size
+            continue
+        length, pos = _read_varint(data, pos)
+        if pos + length > len(data):
+            raise SyncDecodeError(f"Truncated {record_type} record")
+        try:
+            fields.append(bytes(data[pos:pos + length]).decode('utf-8'))
+        except UnicodeDecodeError as e:
+            raise SyncDecodeError(f"Bad text in {record_type} record: {e}")
+        pos += length
+    return record_type, fields
+
+
+def encode_batch(records):
+    """Packs (record_type, fields) pairs into the payload of a BATCH record."""
+    payload = bytearray()
+    for record_type, fields in records:
+        if record_type == 'BATCH':
+            raise ValueError("BATCH records cannot be nested")
+        record = encode_record(record_type, fields)
+        _write_varint(payload, len(record))
+        payload += record
+    return bytes(payload)
+
+
+def decode_batch(payload):
+    """Unpacks the payload of a BATCH record into a list of (record_type, fields)."""
+    records = []
+    pos = 0
+    while pos < len(payload):
+        length, pos = _read_varint(payload, pos)
+        if pos + length > len(payload):
+            raise SyncDecodeError("Truncated BATCH record")
+        record_type, fields = decode_record(payload[pos:pos + length])
+        if record_type == 'BATCH':
+            raise SyncDecodeError("Nested BATCH record")
+        records.append((record_type, fields))
+        pos += length
+    return records
+
+
+def _compress(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, _SYNC_DICTIONARY)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(data):
+    decompressor = zlib.decompressobj(-15, _SYNC_DICTIONARY)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def _pack_record(record_type, fields):
+    """Builds the binary record, deflated with a shared preset dictionary when that makes it smaller."""
+    record = encode_record(record_type, fields)
+    compressed = _compress(record[1:])
+    if len(compressed) < len(record) - 1:
+        record = bytes([record[0] | FLAG_COMPRESSED]) + compressed
+    return record
+
+
+def encode_sync_message(record_type, *fields):
+    """
+    Encodes a sync record as a single compact text frame.
+
+    The record body is deflated with a shared preset dictionary when that makes it smaller,
+    then armoured with base85 so the frame is plain printable ASCII.
+    """
+    return SYNC_PREFIX + WIRE_VERSION + base64.b85encode(_pack_record(record_type, fields)).decode('ascii')
+
+
+def encode_sync_frames(record_type, fields, max_bytes=200):
+    """
+    Encodes a sync record as a list of text frames that each fit in max_bytes.
+
+    A record that fits is sent as one compact message. A larger one is split into frames
+    carrying a random message id, a sequence number and the frame count, which the receiving
+    BBS puts back together with a ReassemblyBuffer.
+    """
+    message = encode_sync_message(record_type, *fields)
+    if len(message) <= max_bytes:
+        return [message]
+
+    record = _pack_record(record_type, fields)
+    # base85 turns every 4 bytes into 5 characters
+    slice_size = (max_bytes - len(FRAME_PREFIX) - len(WIRE_VERSION)) * 4 // 5 - FRAME_HEADER_SIZE
+    total = -(-len(record) // slice_size)
+    if total > MAX_FRAMES:
+        raise ValueError(f"{record_type} record of {len(record)} bytes needs {total} frames, the limit is {MAX_FRAMES}")
+
+    message_id = os.urandom(4)
+    frames = []
+    for seq in range(total):
+        frame = message_id + bytes([seq, total]) + record[seq * slice_size:(seq + 1) * slice_size]
+        frames.append(FRAME_PREFIX + WIRE_VERSION + base64.b85encode(frame).decode('ascii'))
+    return frames
+
+
+def encode_legacy_sync_message(record_type, *fields):
+    fields = fields[:LEGACY_FIELD_COUNTS.get(record_type, len(fields))]
+    return "|".join([record_type] + [str(field) for field in fields])
+
+
+def _decode_legacy(text):
+    record_type, _, rest = text.partition("|")
+    if record_type not in LEGACY_RECORD_TYPES:
+        raise SyncDecodeError(f"Unknown legacy sync message {record_type}")
+    _, kinds, text_field = RECORD_TYPES[record_type]
+    count = LEGACY_FIELD_COUNTS.get(record_type, len(kinds))
+    parts = rest.split("|")
+    if len(parts) < count:
+        raise SyncDecodeError(f"{record_type} sync message has {len(parts)} fields, expected {count}")
+    if len(parts) > count:
+        if text_field is None:
+            raise SyncDecodeError(f"{record_type} sync message has {len(parts)} fields, expected {count}")
+        # The free-text field contained '|', put it back together
+        extra = len(parts) - count
+        parts[text_field:text_field + extra + 1] = ["|".join(parts[text_field:text_field + extra + 1])]
+    return record_type, parts + [None] * (len(kinds) - count)
+
+
+def decode_sync_record(record):
+    """Decodes a binary record, as reassembled from frames, returning (record_type, fields)."""
+    if record and record[0] & FLAG_COMPRESSED:
+        try:
+            record = bytes([record[0] & ~FLAG_COMPRESSED]) + _decompress(record[1:])
+        except zlib.error as e:
+            raise SyncDecodeError(f"Bad compressed sync record: {e}")
+    return decode_record(record)
+
+
+def _unarmour(text, prefix):
+    version = text[len(prefix):len(prefix) + 1]
+    if version != WIRE_VERSION:
+        raise SyncDecodeError(f"Unsupported sync wire version {version!r}")
+    try:
+        return base64.b85decode(text[len(prefix) + 1:])
+    except ValueError as e:
+        raise SyncDecodeError(f"Bad sync frame armour: {e}")
+
+
+def decode_sync_message(text):
+    """
+    Decodes a single sync message in either the compact or the legacy pipe-delimited format.
+
+    Returns (record_type, fields). Raises SyncDecodeError for malformed messages.
+    """
+    if not text.startswith(SYNC_PREFIX):
+        return _decode_legacy(text)
+    return decode_sync_record(_unarmour(text, SYNC_PREFIX))
+
+
+class ReassemblyBuffer:
+    """
+    Collects the frames of multi-packet sync records until every frame has arrived.
+
+    Partial records are keyed by sender and message id. The buffer holds at most max_pending
+    partial records, evicting the oldest when full, and drops any that are still incomplete
+    timeout seconds after their first frame arrived.
+    """
+
+    def __init__(self, max_pending=32, timeout=600):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._pending:
+            key, entry = next(iter(self._pending.items()))
+            if now - entry['started'] < self.timeout:
+                break
+            del self._pending[key]
+            logging.warning(f"Dropping incomplete sync message from {key[0]}: "
+                            f"{len(entry['frames'])} of {entry['total']} frames received")
+
+    def add_frame(self, sender, text):
+        """
+        Stores one frame. Returns the complete binary record once its last frame arrives,
+        otherwise None. Raises SyncDecodeError for malformed frames.
+        """
+        frame = _unarmour(text, FRAME_PREFIX)
+        if len(frame) < FRAME_HEADER_SIZE:
+            raise SyncDecodeError("Truncated sync frame")
+        message_id, seq, total = frame[:4], frame[4], frame[5]
+        if seq >= total:
+            raise SyncDecodeError(f"Sync frame {seq} of {total} is out of range")
+
+        now = time.monotonic()
+        key = (sender, message_id)
+        with self._lock:
+            self._expire(now)
+            entry = self._pending.get(key)
+            if entry is None:
+                while len(self._pending) >= self.max_pending:
+                    evicted, _ = self._pending.popitem(last=False)
+                    logging.warning(f"Sync reassembly buffer full, dropping incomplete message from {evicted[0]}")
+                entry = self._pending[key] = {'total': total, 'frames': {}, 'started': now}
+            elif entry['total'] != total:
+                raise SyncDecodeError(f"Sync frame count changed from {entry['total']} to {total}")
+
+            entry['frames'][seq] = frame[FRAME_HEADER_SIZE:]
+            if len(entry['frames']) < total:
+                return None
+            del self._pending[key]
+        return b''.join(entry['frames'][i] for i in range(total))
@@ -0,0 +1,220 @@
+import hashlib
+import logging
+
+from db_operations import get_sync_unique_ids, get_bulletin_by_unique_id, get_mail_by_unique_id, confirm_tombstones
+from peers import node_key
+from sync_protocol import SYNC_PREFIX, WIRE_VERSION, encode_sync_frames
+from transmit import PRIORITY_BACKGROUND
+from utils import encode_sync, send_sync_message, get_transmit_scheduler, sync_destinations
+
+# Anti-entropy reconciliation between BBS peers.
+#
+# Every post is identified by the first KEY_SIZE bytes of the SHA-1 of its unique_id. A deleted post
+# is kept as a tombstone with a different key, so the deletion spreads like a post would and the
+# deleted post itself is never asked for or offered again. Tombstones every peer has confirmed are
+# settled: they are left out of the digests, so BBS nodes that compact them at slightly different
+# times still agree, but still listed in HAVEs.
+#
+# Posts are placed in a tree of buckets by the SHA-1 of their unique_id: each level splits a bucket
+# into FANOUT by the next four bits, so a post and its tombstone always share a bucket. A bucket is
+# named by a node number holding a 1 bit followed by those hash bits, so ROOT is 1, its children
+# are 16 to 31, theirs 256 to 511 and so on. One BBS periodically sends each peer a DIGEST holding
+# a short hash of each of the root's children. For every bucket that differs, the peer answers with
+# a HAVE listing its keys in that bucket if they fit in one frame, or else with a SUBDIGEST of the
+# bucket's children, which the other side compares in the same way one level further down. The
+# side receiving a HAVE pushes the posts the peer lacks and sends a WANT for the ones it lacks
+# itself. A pair of BBS nodes that already agree exchange a single packet, and a few differing
+# posts cost a few frames per level however many posts both hold.
+
+FANOUT = 16
+NODE_BITS = 4
+ROOT = 1
+MAX_DEPTH = 8
+BUCKET_HASH_SIZE = 4
+KEY_SIZE = 8
+
+# Header byte, then the node and the length of the key list as varints
+HAVE_OVERHEAD = 1 + 5 + 2
+
+
+def _key(unique_id, deleted=False):
+    return hashlib.sha1(unique_id.encode('utf-8') + (b'\0deleted' if deleted else b'')).digest()[:KEY_SIZE]
+
+
+def _position(unique_id):
+    return int.from_bytes(hashlib.sha1(unique_id.encode('utf-8')).digest()[:8], 'big')
+
+
+def _depth(node):
+    return (node.bit_length() - 1) // NODE_BITS
+
+
+def _node_at(position, depth):
+    """Returns the node of the bucket at depth holding the post at position."""
+    return (1 << NODE_BITS * depth) | (position >> (64 - NODE_BITS * depth))
+
+
+def _load_entries(interface):
+    """Returns (position, key, (record_type, unique_id, deleted, settled)) for every post and tombstone."""
+    return [(_position(unique_id), _key(unique_id, deleted), (record_type, unique_id, deleted, settled))
+            for record_type, unique_id, deleted, settled in get_sync_unique_ids(interface.bbs_nodes)]
+
+
+def _bucket(entries, node):
+    """Returns a dict mapping key to item for the entries in the bucket named by node."""
+    depth = _depth(node)
+    return {key: item for position, key, item in entries if _node_at(position, depth) == node}
+
+
+def _children(entries, node):
+    """Returns the FANOUT child buckets of node, in order."""
+    depth = _depth(node) + 1
+    children = [{} for _ in range(FANOUT)]
+    for position, key, item in entries:
+        child = _node_at(position, depth)
+        if child >> NODE_BITS == node:
+            children[child & (FANOUT - 1)][key] = item
+    return children
+
+
+def _tombstones(items):
+    return [unique_id for _, unique_id, deleted, _ in items if deleted]
+
+
+def _bucket_hash(bucket):
+    keys = sorted(key for key, (_, _, _, settled) in bucket.items() if not settled)
+    if not keys:
+        return bytes(BUCKET_HASH_SIZE)
+    return hashlib.sha1(b''.join(keys)).digest()[:BUCKET_HASH_SIZE]
+
+
+def _digest(buckets):
+    return b''.join(_bucket_hash(bucket) for bucket in buckets)
+
+
+def compute_digest(interface, entries=None):
+    """Returns the DIGEST of this BBS: the hashes of the root's children."""
+    if entries is None:
+        entries = _load_entries(interface)
+    return _digest(_children(entries, ROOT))
+
+
+def _split_keys(blob):
+    return [blob[i:i + KEY_SIZE] for i in range(0, len(blob) - KEY_SIZE + 1, KEY_SIZE)]
+
+
+def _keys_per_frame(interface):
+    """Returns how many keys a HAVE can list and still be sent as a single frame."""
+    # base85 turns every 4 bytes into 5 characters
+    size = (get_transmit_scheduler(interface).max_payload_bytes - len(SYNC_PREFIX) - len(WIRE_VERSION)) * 4 // 5
+    return max(1, (size - HAVE_OVERHEAD) // KEY_SIZE)
+
+
+def _send_record(record_type, fields, destination, interface):
+    try:
+        frames = encode_sync_frames(record_type, fields, get_transmit_scheduler(interface).max_payload_bytes)
+    except ValueError as e:
+        logging.error(f"SERVER SYNC: Unable to send {record_type} to {destination}: {e}")
+        return
+    send_sync_message(frames, destination, interface, priority=PRIORITY_BACKGROUND)
+
+
+def _push_items(items, destination, interface):
+    for record_type, unique_id, deleted, _ in items:
+        if deleted:
+            record_type, fields = f"DELETE_{record_type}", [unique_id]
+        else:
+            if record_type == 'BULLETIN':
+                fields = get_bulletin_by_unique_id(unique_id)
+            else:
+                fields = get_mail_by_unique_id(unique_id)
+            if fields is None:
+                continue
+        try:
+            frames = encode_sync(interface, record_type, *fields)
+        except ValueError as e:
+            # One post too large to send must not hold up the rest of the reply
+            logging.error(f"SERVER SYNC: Unable to send {record_type} {unique_id} to {destination}: {e}")
+            continue
+        send_sync_message(frames, destination, interface, priority=PRIORITY_BACKGROUND)
+
+
+def send_digests(bbs_nodes, interface):
+    """Sends this BBS's digest to every reachable peer, starting a reconciliation round with each."""
+    peers = getattr(interface, 'peers', None)
+    if peers is not None:
+        bbs_nodes = [node_id for node_id in bbs_nodes if not peers.is_held(node_id)]
+    bbs_nodes = sync_destinations(interface, bbs_nodes)
+    if not bbs_nodes:
+        return
+    digest = compute_digest(interface)
+    logging.info(f"SERVER SYNC: Sending reconciliation digest to {', '.join(bbs_nodes)}")
+    for node_id in bbs_nodes:
+        _send_record('DIGEST', [digest], node_id, interface)
+
+
+def handle_digest(sender_id, digest, interface, node=ROOT):
+    """
+    Compares a peer's hashes of the children of node, from a DIGEST or SUBDIGEST, with this BBS's,
+    and answers each child bucket that differs with a HAVE, or with a SUBDIGEST if its keys do not
+    fit in one frame.
+    """
+    if len(digest) != FANOUT * BUCKET_HASH_SIZE or node < ROOT or _depth(node) >= MAX_DEPTH:
+        logging.error(f"SERVER SYNC: Ignoring digest of {len(digest)} bytes for node {node} from {sender_id}")
+        return
+    entries = _load_entries(interface)
+    children = _children(entries, node)
+    local_digest = _digest(children)
+    differing = [i for i in range(FANOUT)
+                 if digest[i * BUCKET_HASH_SIZE:(i + 1) * BUCKET_HASH_SIZE]
+                 != local_digest[i * BUCKET_HASH_SIZE:(i + 1) * BUCKET_HASH_SIZE]]
+    # Matching buckets mean the peer holds the same tombstones
+    agreed = _tombstones(item for i in range(FANOUT) if i not in differing for item in children[i].values())
+    if agreed:
+        confirm_tombstones(agreed, node_key(sender_id))
+    if not differing:
+        if node == ROOT:
+            logging.info(f"SERVER SYNC: In sync with {sender_id}")
+        return
+    logging.info(f"SERVER SYNC: {len(differing)} of {FANOUT} buckets under node {node} differ from {sender_id}")
+    limit = _keys_per_frame(interface)
+    for i in differing:
+        child = (node << NODE_BITS) | i
+        bucket = children[i]
+        if len(bucket) > limit and _depth(child) < MAX_DEPTH:
+            _send_record('SUBDIGEST', [child, _digest(_children(entries, child))], sender_id, interface)
+        else:
+            _send_record('HAVE', [child, b''.join(sorted(bucket))], sender_id, interface)
+
+
+def handle_have(sender_id, node, keys, interface):
+    """Pushes the posts a peer is missing from one bucket and asks for the ones missing here."""
+    if node <= ROOT or _depth(node) > MAX_DEPTH:
+        logging.error(f"SERVER SYNC: Ignoring HAVE for node {node} from {sender_id}")
+        return
+    local = _bucket(_load_entries(interface), node)
+    remote = set(_split_keys(keys))
+
+    # Posts deleted here are not asked for; the peer is sent the tombstone instead. Posts the
+    # peer has deleted are not offered; it sends its tombstone when it handles our HAVE.
+    shadowed = {_key(unique_id) for unique_id in _tombstones(local.values())}
+    missing_here = [key for key in remote if key not in local and key not in shadowed]
+    missing_there = [item for key, item in local.items()
+                     if key not in remote and not item[3] and (item[2] or _key(item[1], True) not in remote)]
+    agreed = _tombstones(item for key, item in local.items() if key in remote)
+    if agreed:
+        confirm_tombstones(agreed, node_key(sender_id))
+    logging.info(f"SERVER SYNC: Node {node} with {sender_id}: sending {len(missing_there)}, "
+                 f"requesting {len(missing_here)}")
+
+    if missing_here:
+        _send_record('WANT', [b''.join(sorted(missing_here))], sender_id, interface)
+    _push_items(missing_there, sender_id, interface)
+
+
+def handle_want(sender_id, keys, interface):
+    """Sends the posts a peer asked for."""
+    wanted = set(_split_keys(keys))
+    items = [item for _, key, item in _load_entries(interface) if key in wanted]
+    logging.info(f"SERVER SYNC: Sending {len(items)} of {len(wanted)} requested post(s) to {sender_id}")
+    _push_items(items, sender_id, interface)
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The BBS is a set of top-level modules run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_connection import configure_database, close_database  # noqa: E402
+from db_schema import migrate  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A migrated database in a temporary directory, used by get_db_connection for the test."""
+    pool = configure_database(str(tmp_path / 'bulletins.db'))
+    migrate(pool.connection())
+    yield pool
+    close_database()
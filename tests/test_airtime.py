@@ -0,0 +1,30 @@
+import pytest
+
+from airtime import AirtimeBudget, LORA_PRESETS, lora_airtime
+
+
+def test_matches_semtech_calculator():
+    # SF7, 125 kHz, 4/5, 8 symbol preamble, 20 byte payload: 56.58 ms
+    assert lora_airtime(20, 7, 125000, 5, preamble_symbols=8) == pytest.approx(0.056576)
+
+
+def test_low_data_rate_optimisation():
+    # SF12 at 125 kHz has 32.8 ms symbols, so low data rate optimisation is on: 1.32 s
+    assert lora_airtime(20, 12, 125000, 5, preamble_symbols=8) == pytest.approx(1.318912)
+
+
+def test_grows_with_payload_and_preset():
+    assert lora_airtime(200, *LORA_PRESETS['LONG_FAST']) > lora_airtime(20, *LORA_PRESETS['LONG_FAST'])
+    assert lora_airtime(50, *LORA_PRESETS['LONG_SLOW']) > lora_airtime(50, *LORA_PRESETS['LONG_FAST'])
+    assert lora_airtime(50, *LORA_PRESETS['SHORT_TURBO']) < lora_airtime(50, *LORA_PRESETS['SHORT_FAST'])
+
+
+def test_budget_rolls_over_window():
+    budget = AirtimeBudget(window=100, max_duty_cycle=10)
+    budget.record(6, now=0)
+    budget.record(6, now=50)
+    assert budget.utilisation(now=60) == pytest.approx(12)
+    assert not budget.has_room(now=60)
+    assert budget.seconds_until_room(now=60) == pytest.approx(40)
+    assert budget.has_room(now=100)
+    assert budget.utilisation(now=151) == 0
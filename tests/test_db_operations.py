@@ -0,0 +1,120 @@
+import sqlite3
+import time
+
+import pytest
+
+import db_compression
+import db_operations
+from db_compression import BodyCodec, register_functions
+from db_operations import (
+    BoardCache, SeenSet, add_bulletin, add_mail, count_bulletins, delete_bulletin, get_bulletin_by_unique_id,
+    get_bulletin_content, get_bulletins, get_bulletins_page, get_mail_by_unique_id, get_mail_page, get_mailbox_summary,
+    ingest_bulletin, ingest_mail, mark_mail_read, search_bulletins,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(database, monkeypatch):
+    monkeypatch.setattr(db_operations, 'board_cache', BoardCache())
+    monkeypatch.setattr(db_operations, 'seen_unique_ids', SeenSet())
+
+
+def post_bulletins(board, count):
+    return [add_bulletin(board, 'ABCD', f"Subject {i}", f"Body {i}", [], None).result() for i in range(count)]
+
+
+def all_pages(get_page, key, limit):
+    pages = []
+    cursor = None
+    while True:
+        rows, cursor = get_page(key, cursor, limit)
+        pages.append([row[1] if get_page is get_bulletins_page else row[2] for row in rows])
+        if cursor is None:
+            return pages
+
+
+def test_bulletin_pages_are_newest_first_without_gaps():
+    post_bulletins('General', 25)
+    post_bulletins('News', 3)
+    pages = all_pages(get_bulletins_page, 'general', 10)
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sum(pages, []) == [f"Subject {i}" for i in reversed(range(25))]
+
+
+def test_mail_pages_and_summary():
+    for i in range(7):
+        add_mail('!00000001', 'ABCD', '!00000002', f"Mail {i}", 'Hello', [], None).result()
+    pages = all_pages(get_mail_page, '!00000002', 3)
+    assert sum(pages, []) == [f"Mail {i}" for i in reversed(range(7))]
+    assert get_mailbox_summary('!00000002') == (7, 7)
+
+    mail_id = get_mail_page('!00000002', None, 1)[0][0][0]
+    mark_mail_read(mail_id, '!00000002').result()
+    mark_mail_read(mail_id, '!00000002').result()
+    assert get_mailbox_summary('!00000002') == (7, 6)
+    assert get_mailbox_summary('!00000009') == (0, 0)
+
+
+def test_last_full_page_has_no_cursor():
+    post_bulletins('General', 10)
+    rows, cursor = get_bulletins_page('General', None, 10)
+    assert len(rows) == 10 and cursor is None
+
+
+def test_board_cache_sees_writes_from_other_connections(database, tmp_path):
+    post_bulletins('General', 3)
+    assert count_bulletins('General') == 3
+    assert count_bulletins('general') == 3
+    assert db_operations.board_cache.get_stats()['hits'] == 1
+
+    # As db_admin would, from another process
+    path = str(tmp_path / 'bulletins.db')
+    other = sqlite3.connect(path)
+    register_functions(other, path)
+    other.execute("DELETE FROM bulletins WHERE id = 1")
+    other.commit()
+    other.close()
+    assert count_bulletins('General') == 2
+
+    unique_id = get_bulletins('General')[0][4]
+    delete_bulletin(unique_id, [], None).result()
+    assert count_bulletins('General') == 1
+
+
+def test_board_cache_is_bounded():
+    cache = BoardCache(max_entries=3)
+    for i in range(5):
+        cache.get('General', ('page', i), lambda: i)
+    stats = cache.get_stats()
+    assert (stats['entries'], stats['evictions']) == (3, 2)
+    assert cache.get('General', ('page', 4), lambda: 'reloaded') == 4
+    assert cache.get('General', ('page', 0), lambda: 'reloaded') == 'reloaded'
+
+
+def test_compressed_bodies_read_back_and_are_searchable(database, monkeypatch):
+    codec = BodyCodec(threshold=32)
+    monkeypatch.setattr(db_compression, 'body_codec', codec)
+    monkeypatch.setattr(db_operations, 'body_codec', codec)
+    body = "The repeater on the hill is back on the air after the storm. " * 4
+    add_bulletin('General', 'ABCD', 'Repeater', body, [], None).result()
+    add_bulletin('General', 'ABCD', 'Short', 'Tiny', [], None).result()
+
+    stored = database.connection().execute("SELECT content FROM bulletins ORDER BY id").fetchall()
+    assert isinstance(stored[0][0], bytes) and len(stored[0][0]) < len(body)
+    assert stored[1][0] == 'Tiny'
+    assert get_bulletin_content(1)[3] == body
+    assert [row[1] for row in search_bulletins('storm')] == ['Repeater']
+
+
+def test_received_posts_keep_their_origin_created_at():
+    now = int(time.time() * 1000)
+    posted = now - 3 * 86400 * 1000
+    assert ingest_bulletin('General', 'ABCD', 'Old', 'Body', 'posted', None, posted).result()
+    assert ingest_bulletin('General', 'ABCD', 'Future', 'Body', 'future', None, now + 86400 * 1000).result()
+    assert ingest_bulletin('General', 'ABCD', 'Legacy', 'Body', 'legacy', None).result()
+    assert ingest_mail('!00000001', 'ABCD', '!00000002', 'Old', 'Body', 'mail', posted).result()
+
+    assert get_bulletin_by_unique_id('posted')[5] == posted
+    assert now <= get_bulletin_by_unique_id('future')[5] < now + 60000
+    assert now <= get_bulletin_by_unique_id('legacy')[5] < now + 60000
+    assert get_mail_by_unique_id('mail')[6] == posted
@@ -0,0 +1,112 @@
+import sqlite3
+import time
+
+import pytest
+
+from db_connection import configure_database, close_database
+from db_schema import MIGRATIONS, SCHEMA_VERSION, get_schema_version, migrate
+
+
+@pytest.fixture
+def pool(tmp_path):
+    yield configure_database(str(tmp_path / 'bulletins.db'))
+    close_database()
+
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+
+
+def test_migrates_new_database_from_version_0(pool):
+    conn = pool.connection()
+    assert get_schema_version(conn) == 0
+    assert migrate(conn) == len(MIGRATIONS)
+    assert get_schema_version(conn) == SCHEMA_VERSION
+    assert {'bulletins', 'mail', 'channels', 'sync_outbox', 'tombstones', 'expired', 'bulletins_fts', 'mail_fts',
+            'mailbox_summary', 'compression_dictionaries', 'memory_checkpoint', 'board_generations'} <= tables(conn)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert migrate(conn) == 0
+
+
+def test_migrates_database_from_before_versioning(tmp_path):
+    # Tables as the first releases created them, with no user_version and local time date text
+    path = str(tmp_path / 'bulletins.db')
+    old = sqlite3.connect(path)
+    old.executescript('''
+        CREATE TABLE bulletins (id INTEGER PRIMARY KEY AUTOINCREMENT, board TEXT NOT NULL,
+            sender_short_name TEXT NOT NULL, date TEXT NOT NULL, subject TEXT NOT NULL,
+            content TEXT NOT NULL, unique_id TEXT NOT NULL);
+        CREATE TABLE mail (id INTEGER PRIMARY KEY AUTOINCREMENT, sender TEXT NOT NULL,
+            sender_short_name TEXT NOT NULL, recipient TEXT NOT NULL, date TEXT NOT NULL,
+            subject TEXT NOT NULL, content TEXT NOT NULL, unique_id TEXT NOT NULL);
+        CREATE TABLE channels (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, url TEXT NOT NULL);
+        INSERT INTO bulletins (board, sender_short_name, date, subject, content, unique_id)
+            VALUES ('General', 'ABCD', '2024-05-01 12:30', 'Repeater', 'The repeater is back on the air', 'b1');
+        INSERT INTO mail (sender, sender_short_name, recipient, date, subject, content, unique_id)
+            VALUES ('!00000001', 'ABCD', '!00000002', '2024-05-02 08:00', 'Hello', 'Are you there?', 'm1'),
+                   ('!00000001', 'ABCD', '!00000002', '2024-05-02 09:00', 'Again', 'Ping', 'm2');
+    ''')
+    old.commit()
+    old.close()
+
+    pool = configure_database(path)
+    try:
+        conn = pool.connection()
+        assert migrate(conn) == len(MIGRATIONS)
+        created_at, = conn.execute("SELECT created_at FROM bulletins WHERE unique_id = 'b1'").fetchone()
+        assert created_at == int(time.mktime(time.strptime('2024-05-01 12:30', '%Y-%m-%d %H:%M'))) * 1000
+        assert conn.execute("SELECT rowid FROM bulletins_fts WHERE bulletins_fts MATCH 'repeater'").fetchall() == [(1,)]
+        assert conn.execute("SELECT total, unread FROM mailbox_summary WHERE recipient = '!00000002'").fetchone() == (2, 2)
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO mail (sender, sender_short_name, recipient, created_at, subject, content, unique_id) "
+                         "VALUES ('!1', 'A', '!2', 0, 's', 'c', 'm1')")
+    finally:
+        close_database()
+
+
+def test_refuses_newer_schema(pool):
+    conn = pool.connection()
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    with pytest.raises(RuntimeError):
+        migrate(conn)
+
+
+def test_mailbox_summary_follows_every_write(pool):
+    conn = pool.connection()
+    migrate(conn)
+    insert = ("INSERT INTO mail (sender, sender_short_name, recipient, created_at, subject, content, unique_id) "
+              "VALUES ('!00000001', 'ABCD', ?, 0, 's', 'c', ?)")
+    for i in range(5):
+        conn.execute(insert, ('!00000002' if i < 3 else '!00000003', f"m{i}"))
+    conn.execute("UPDATE mail SET read = 1 WHERE unique_id IN ('m0', 'm3')")
+    conn.execute("UPDATE mail SET recipient = '!00000003' WHERE unique_id = 'm1'")
+    conn.execute("DELETE FROM mail WHERE unique_id = 'm4'")
+    conn.execute("DELETE FROM mail WHERE unique_id = 'm0'")
+    conn.commit()
+
+    summary = conn.execute("SELECT recipient, total, unread FROM mailbox_summary ORDER BY recipient").fetchall()
+    expected = conn.execute("SELECT recipient, COUNT(*), SUM(read = 0) FROM mail GROUP BY recipient ORDER BY recipient").fetchall()
+    assert summary == expected == [('!00000002', 1, 1), ('!00000003', 2, 1)]
+
+    conn.execute("DELETE FROM mail")
+    conn.commit()
+    assert conn.execute("SELECT COUNT(*) FROM mailbox_summary").fetchone()[0] == 0
+
+
+def test_board_generations_move_on_with_listing_changes(pool):
+    conn = pool.connection()
+    migrate(conn)
+
+    def generation(board):
+        row = conn.execute("SELECT generation FROM board_generations WHERE board = lower(?)", (board,)).fetchone()
+        return row[0] if row else 0
+
+    conn.execute("INSERT INTO bulletins (board, sender_short_name, created_at, subject, content, unique_id) "
+                 "VALUES ('General', 'ABCD', 0, 's', 'c', 'b1')")
+    assert generation('GENERAL') == 1
+    conn.execute("UPDATE bulletins SET content = 'recompressed'")
+    assert generation('general') == 1
+    conn.execute("UPDATE bulletins SET board = 'News'")
+    assert (generation('general'), generation('news')) == (2, 1)
+    conn.execute("DELETE FROM bulletins")
+    assert generation('news') == 2
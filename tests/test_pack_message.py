@@ -0,0 +1,56 @@
+from utils import pack_message
+
+
+def utf8_len(text):
+    return len(text.encode('utf-8'))
+
+
+def test_short_message_is_one_packet():
+    assert pack_message("Hello mesh", 200) == ["Hello mesh"]
+
+
+def test_empty_message_has_no_packets():
+    assert pack_message("", 200) == []
+
+
+def test_packets_fit_byte_limit():
+    message = " ".join(f"word{i}" for i in range(200))
+    packets = pack_message(message, 50)
+    assert len(packets) > 1
+    assert all(utf8_len(packet) <= 50 for packet in packets)
+    assert " ".join(packets) == message
+
+
+def test_breaks_at_line_ends_first():
+    lines = [f"Line {i}: " + "x" * 20 for i in range(10)]
+    packets = pack_message("\n".join(lines), 70)
+    for packet in packets:
+        assert all(line in lines for line in packet.split("\n"))
+
+
+def test_long_word_is_split_inside():
+    word = "a" * 120
+    packets = pack_message(word, 50)
+    assert [len(packet) for packet in packets] == [50, 50, 20]
+    assert "".join(packets) == word
+
+
+def test_multibyte_characters_are_never_cut():
+    message = "é" * 101
+    packets = pack_message(message, 51)
+    assert all(utf8_len(packet) <= 51 for packet in packets)
+    assert "".join(packets) == message
+
+
+def test_emoji_sequences_stay_together():
+    family = "\U0001F468\u200d\U0001F469\u200d\U0001F467"
+    thumbs_up = "\U0001F44D\U0001F3FD"
+    envelope = "\u2709\ufe0f"
+    accented = "e\u0301"
+    message = (family + thumbs_up + envelope + accented) * 20
+    packets = pack_message(message, 40)
+    assert all(utf8_len(packet) <= 40 for packet in packets)
+    assert "".join(packets) == message
+    for packet in packets:
+        assert not packet.startswith(("\u200d", "\U0001F3FD", "\ufe0f", "\u0301"))
+        assert not packet.endswith("\u200d")
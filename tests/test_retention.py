@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+import db_operations
+from db_operations import BoardCache, SeenSet, count_bulletins, ingest_bulletin
+from retention import DAY_MS, compact_expired, expire_bulletins
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(database, monkeypatch):
+    monkeypatch.setattr(db_operations, 'board_cache', BoardCache())
+    monkeypatch.setattr(db_operations, 'seen_unique_ids', SeenSet())
+
+
+def limits(max_age, max_count):
+    return {'bulletin_max_age': max_age, 'bulletin_max_count': max_count, 'mail_max_age': 0, 'mail_max_count': 0,
+            'boards': {}, 'batch_size': 100}
+
+
+def ingest(unique_id, age_days):
+    created_at = int(time.time() * 1000 - age_days * DAY_MS)
+    return ingest_bulletin('General', 'ABCD', unique_id, 'Body', unique_id, None, created_at).result()
+
+
+def offered_again(unique_id, age_days):
+    # As reconciliation with a peer that still holds the post would deliver it
+    db_operations.seen_unique_ids = SeenSet()
+    return ingest(unique_id, age_days)
+
+
+def test_posts_expired_by_count_are_remembered():
+    for i in range(3):
+        ingest(f"post-{i}", 30 - i)
+    assert expire_bulletins(limits(0, 2)) == 1
+    assert compact_expired(limits(0, 2), 0).result() == 0
+    assert not offered_again('post-0', 30)
+    assert count_bulletins('General') == 2
+
+
+def test_expired_posts_are_forgotten_by_their_age():
+    ingest('old', 40)
+    ingest('recent', 10)
+    ingest('kept', 1)
+    assert expire_bulletins(limits(7, 2)) == 2
+    # Forgotten once older than the age limit plus min_age, whenever they expired
+    assert compact_expired(limits(7, 2), 30 * 86400).result() == 1
+    assert offered_again('old', 40)
+    assert not offered_again('recent', 10)
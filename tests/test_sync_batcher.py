@@ -0,0 +1,59 @@
+import os
+import types
+import uuid
+
+import sync_batcher
+from sync_batcher import SyncBatcher
+from sync_protocol import ReassemblyBuffer, decode_batch, decode_sync_message, decode_sync_record
+
+
+def bulletin(size):
+    return ['General', 'ABCD', 'Subject', os.urandom(size // 2).hex(), str(uuid.uuid4()), 1760000000000]
+
+
+def flush(monkeypatch, records):
+    """Flushes records for one peer through a batcher. Returns what was sent and the outcomes reported."""
+    sent = []
+    outcomes = []
+    monkeypatch.setattr(sync_batcher, 'send_sync_message',
+                        lambda frames, node_id, interface, on_complete=None: sent.append((frames, on_complete)))
+    interface = types.SimpleNamespace(tx_scheduler=types.SimpleNamespace(max_payload_bytes=200))
+    batcher = SyncBatcher(interface)
+    for i, fields in enumerate(records):
+        batcher.add('BULLETIN', fields, ['!00000001'], on_complete=lambda node_id, delivered, i=i: outcomes.append((i, delivered)))
+    batcher._flush(batcher._take_pending())
+    return sent, outcomes
+
+
+def decode(frames):
+    if len(frames) == 1:
+        record_type, fields = decode_sync_message(frames[0])
+    else:
+        buffer = ReassemblyBuffer()
+        record = [buffer.add_frame('!00000002', frame) for frame in frames][-1]
+        record_type, fields = decode_sync_record(record)
+    return decode_batch(fields[0]) if record_type == 'BATCH' else [(record_type, fields)]
+
+
+def test_small_records_share_one_batch(monkeypatch):
+    records = [bulletin(40) for _ in range(3)]
+    sent, _ = flush(monkeypatch, records)
+    assert len(sent) == 1
+    assert decode(sent[0][0]) == [('BULLETIN', fields) for fields in records]
+
+
+def test_batch_too_large_for_one_message_is_split(monkeypatch):
+    records = [bulletin(7000) for _ in range(10)]
+    sent, outcomes = flush(monkeypatch, records)
+    assert len(sent) > 1
+    assert [record for frames, _ in sent for record in decode(frames)] == [('BULLETIN', fields) for fields in records]
+    for _, on_complete in sent:
+        on_complete(True)
+    assert sorted(outcomes) == [(i, True) for i in range(10)]
+
+
+def test_record_too_large_on_its_own_is_reported_lost(monkeypatch):
+    records = [bulletin(40), bulletin(200000), bulletin(40)]
+    sent, outcomes = flush(monkeypatch, records)
+    assert outcomes == [(1, False)]
+    assert [record for frames, _ in sent for record in decode(frames)] == [('BULLETIN', records[0]), ('BULLETIN', records[2])]
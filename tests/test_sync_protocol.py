@@ -0,0 +1,133 @@
+import base64
+import os
+import uuid
+
+import pytest
+
+from sync_protocol import (
+    FRAME_PREFIX, MAX_FRAMES, ReassemblyBuffer, SYNC_PREFIX, WIRE_VERSION, SyncDecodeError, decode_batch,
+    decode_sync_message, decode_sync_record, encode_batch, encode_legacy_sync_message, encode_sync_frames,
+    encode_sync_message,
+)
+
+UNIQUE_ID = str(uuid.UUID(int=0x1234))
+CREATED_AT = 1760000000000
+
+
+@pytest.mark.parametrize('record_type, fields', [
+    ('BULLETIN', ['General', 'ABCD', 'Net tonight', 'Check in at 8pm | bring radios', UNIQUE_ID, CREATED_AT]),
+    ('MAIL', ['!a1b2c3d4', 'ABCD', '!00000001', 'Hi', 'See you there', UNIQUE_ID, CREATED_AT]),
+    ('DELETE_BULLETIN', [UNIQUE_ID]),
+    ('DELETE_MAIL', [UNIQUE_ID]),
+    ('CHANNEL', ['Local', 'https://meshtastic.org/e/#abc']),
+    ('DIGEST', [bytes(range(64))]),
+    ('HAVE', [300, b'\x01' * 16]),
+    ('WANT', [b'\x02' * 8]),
+    ('SUBDIGEST', [17, bytes(64)]),
+])
+def test_compact_round_trip(record_type, fields):
+    message = encode_sync_message(record_type, *fields)
+    assert message.startswith(SYNC_PREFIX)
+    assert message.isascii()
+    assert decode_sync_message(message) == (record_type, fields)
+
+
+def test_fields_not_in_canonical_form_fall_back_to_text():
+    fields = ['not-a-node', 'ABCD', '!00000001', 'Hi', 'Body', 'not-a-uuid', CREATED_AT]
+    assert decode_sync_message(encode_sync_message('MAIL', *fields)) == ('MAIL', fields)
+
+
+def test_deletes_carry_packed_unique_ids():
+    assert len(encode_sync_message('DELETE_BULLETIN', UNIQUE_ID)) == len(encode_sync_message('DELETE_MAIL', UNIQUE_ID))
+    assert decode_sync_message(encode_sync_message('DELETE_BULLETIN', '17')) == ('DELETE_BULLETIN', ['17'])
+
+
+def test_compact_is_smaller_than_legacy():
+    fields = ['General', 'ABCD', 'Weather', 'Check in with your callsign and location. ' * 3, UNIQUE_ID, CREATED_AT]
+    assert len(encode_sync_message('BULLETIN', *fields)) < len(encode_legacy_sync_message('BULLETIN', *fields))
+
+
+def test_legacy_free_text_keeps_pipes():
+    message = encode_legacy_sync_message('BULLETIN', 'General', 'ABCD', 'Subject', 'a|b|c', UNIQUE_ID, CREATED_AT)
+    assert message == f"BULLETIN|General|ABCD|Subject|a|b|c|{UNIQUE_ID}"
+    # Legacy messages predate created_at
+    assert decode_sync_message(message) == ('BULLETIN', ['General', 'ABCD', 'Subject', 'a|b|c', UNIQUE_ID, None])
+
+
+def test_legacy_rejects_wrong_field_count():
+    with pytest.raises(SyncDecodeError):
+        decode_sync_message('DELETE_MAIL|one|two')
+
+
+def test_batch_round_trip():
+    records = [('DELETE_BULLETIN', [UNIQUE_ID]), ('CHANNEL', ['Local', 'url'])]
+    assert decode_batch(encode_batch(records)) == records
+    with pytest.raises(ValueError):
+        encode_batch([('BATCH', [b''])])
+
+
+def random_body(size):
+    # Hex text, which deflate can only halve
+    return os.urandom(size // 2 + 1).hex()[:size]
+
+
+def test_small_record_is_one_frame():
+    frames = encode_sync_frames('DELETE_MAIL', [UNIQUE_ID], 200)
+    assert len(frames) == 1 and frames[0].startswith(SYNC_PREFIX)
+
+
+def test_large_record_is_split_and_reassembled_in_any_order():
+    fields = ['General', 'ABCD', 'Long', random_body(2000), UNIQUE_ID, CREATED_AT]
+    frames = encode_sync_frames('BULLETIN', fields, 200)
+    assert len(frames) > 1
+    assert all(frame.startswith(FRAME_PREFIX) and len(frame) <= 200 for frame in frames)
+
+    buffer = ReassemblyBuffer()
+    shuffled = frames[1:] + frames[:1]
+    results = [buffer.add_frame('!a1b2c3d4', frame) for frame in shuffled]
+    assert results[:-1] == [None] * (len(frames) - 1)
+    assert decode_sync_record(results[-1]) == ('BULLETIN', fields)
+
+
+def test_frames_from_different_senders_are_kept_apart():
+    frames = encode_sync_frames('BULLETIN', ['General', 'ABCD', 'Long', random_body(600), UNIQUE_ID, CREATED_AT], 200)
+    buffer = ReassemblyBuffer()
+    for frame in frames[:-1]:
+        assert buffer.add_frame('!00000001', frame) is None
+    assert buffer.add_frame('!00000002', frames[-1]) is None
+    assert buffer.add_frame('!00000001', frames[-1]) is not None
+
+
+def test_too_many_frames_is_refused():
+    with pytest.raises(ValueError):
+        encode_sync_frames('BULLETIN', ['General', 'ABCD', 'Huge', random_body(MAX_FRAMES * 400), UNIQUE_ID, CREATED_AT],
+                           200)
+
+
+def test_incomplete_records_expire_and_are_evicted():
+    frames = [encode_sync_frames('BULLETIN', ['General', 'ABCD', 'Long', random_body(600), UNIQUE_ID, CREATED_AT], 200)
+              for _ in range(3)]
+    buffer = ReassemblyBuffer(max_pending=2)
+    for message in frames:
+        buffer.add_frame('!00000001', message[0])
+    # The first message was evicted to make room for the third
+    for frame in frames[0][1:]:
+        assert buffer.add_frame('!00000001', frame) is None
+    for frame in frames[2][1:-1]:
+        buffer.add_frame('!00000001', frame)
+    assert buffer.add_frame('!00000001', frames[2][-1]) is not None
+
+    buffer = ReassemblyBuffer(timeout=0)
+    buffer.add_frame('!00000001', frames[1][0])
+    for frame in frames[1][1:]:
+        assert buffer.add_frame('!00000001', frame) is None
+
+
+def test_malformed_frames_raise():
+    with pytest.raises(SyncDecodeError):
+        decode_sync_message(SYNC_PREFIX + '9abc')
+    # A header promising a fallback mask byte, with nothing after it
+    with pytest.raises(SyncDecodeError):
+        decode_sync_message(SYNC_PREFIX + WIRE_VERSION + base64.b85encode(bytes([0x21])).decode('ascii'))
+    with pytest.raises(SyncDecodeError):
+        ReassemblyBuffer().add_frame('!00000001', FRAME_PREFIX + '1' + 'abc')
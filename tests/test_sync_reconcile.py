@@ -0,0 +1,120 @@
+import os
+import types
+
+import sync_reconcile
+from sync_protocol import MAX_FRAMES, encode_sync_frames
+from sync_reconcile import FANOUT, KEY_SIZE, MAX_DEPTH, NODE_BITS, ROOT
+
+
+class Peer:
+    """A BBS holding a set of bulletin unique_ids, with the database and radio replaced by the test."""
+
+    def __init__(self, name, unique_ids):
+        self.name = name
+        self.unique_ids = set(unique_ids)
+        self.bbs_nodes = []
+        self.tx_scheduler = types.SimpleNamespace(max_payload_bytes=200)
+
+
+def reconcile(monkeypatch, first, second):
+    """Runs one reconciliation round between two peers. Returns the frames sent per record type."""
+    peers = {first.name: first, second.name: second}
+    current = [first]
+    queue = []
+    frames = {}
+
+    def send_record(record_type, fields, destination, interface):
+        sent = encode_sync_frames(record_type, fields, interface.tx_scheduler.max_payload_bytes)
+        frames[record_type] = frames.get(record_type, 0) + len(sent)
+        queue.append((interface.name, destination, record_type, fields))
+
+    def push_items(items, destination, interface):
+        peers[destination].unique_ids.update(unique_id for _, unique_id, _, _ in items)
+        frames['pushed'] = frames.get('pushed', 0) + len(items)
+
+    monkeypatch.setattr(sync_reconcile, 'get_sync_unique_ids',
+                        lambda bbs_nodes: [('BULLETIN', unique_id, 0, 0) for unique_id in current[0].unique_ids])
+    monkeypatch.setattr(sync_reconcile, 'confirm_tombstones', lambda unique_ids, peer: None)
+    monkeypatch.setattr(sync_reconcile, 'get_transmit_scheduler', lambda interface: interface.tx_scheduler)
+    monkeypatch.setattr(sync_reconcile, '_send_record', send_record)
+    monkeypatch.setattr(sync_reconcile, '_push_items', push_items)
+
+    send_record('DIGEST', [sync_reconcile.compute_digest(first)], second.name, first)
+    while queue:
+        sender, destination, record_type, fields = queue.pop(0)
+        current[0] = peers[destination]
+        if record_type == 'DIGEST':
+            sync_reconcile.handle_digest(sender, fields[0], peers[destination])
+        elif record_type == 'SUBDIGEST':
+            sync_reconcile.handle_digest(sender, fields[1], peers[destination], fields[0])
+        elif record_type == 'HAVE':
+            sync_reconcile.handle_have(sender, fields[0], fields[1], peers[destination])
+        elif record_type == 'WANT':
+            sync_reconcile.handle_want(sender, fields[0], peers[destination])
+    return frames
+
+
+def test_node_numbers():
+    position = 0xABCDEF0123456789
+    assert sync_reconcile._node_at(position, 0) == ROOT
+    assert sync_reconcile._node_at(position, 1) == 0x1A
+    assert sync_reconcile._node_at(position, 2) == 0x1AB
+    assert sync_reconcile._depth(0x1AB) == 2
+    assert sync_reconcile._node_at(position, 3) >> NODE_BITS == 0x1AB
+
+
+def test_have_of_one_frame_budget_fits_one_frame():
+    peer = Peer('!00000001', [])
+    limit = sync_reconcile._keys_per_frame(peer)
+    deepest = (1 << NODE_BITS * MAX_DEPTH) | ((1 << NODE_BITS * MAX_DEPTH) - 1)
+    assert len(encode_sync_frames('HAVE', [deepest, b'\xff' * KEY_SIZE * limit], 200)) == 1
+
+
+def test_agreeing_peers_exchange_one_frame(monkeypatch):
+    unique_ids = [f"post-{i}" for i in range(500)]
+    frames = reconcile(monkeypatch, Peer('!00000001', unique_ids), Peer('!00000002', unique_ids))
+    assert frames == {'DIGEST': 1}
+
+
+def test_few_differences_cost_few_frames_on_a_large_board(monkeypatch):
+    common = [f"post-{i}" for i in range(20000)]
+    first = Peer('!00000001', common + ['only-first-1', 'only-first-2'])
+    second = Peer('!00000002', common + ['only-second'])
+    frames = reconcile(monkeypatch, first, second)
+    assert first.unique_ids == second.unique_ids
+    assert frames['pushed'] == 3
+    assert sum(count for record_type, count in frames.items() if record_type != 'pushed') < 10 * FANOUT
+
+
+def test_empty_peer_is_filled(monkeypatch):
+    first = Peer('!00000001', [f"post-{i}" for i in range(2000)])
+    second = Peer('!00000002', [])
+    reconcile(monkeypatch, first, second)
+    assert second.unique_ids == first.unique_ids
+
+
+def test_post_too_large_to_send_is_skipped(monkeypatch):
+    bulletins = {
+        'huge': ['General', 'ABCD', 'Huge', os.urandom(MAX_FRAMES * 200).hex(), 'huge', 1760000000000],
+        'small': ['General', 'ABCD', 'Small', 'Hello', 'small', 1760000000000],
+    }
+    sent = []
+    monkeypatch.setattr(sync_reconcile, 'get_bulletin_by_unique_id', bulletins.get)
+    monkeypatch.setattr(sync_reconcile, 'get_transmit_scheduler', lambda interface: interface.tx_scheduler)
+    monkeypatch.setattr(sync_reconcile, 'send_sync_message',
+                        lambda frames, destination, interface, priority: sent.append(frames))
+    items = [('BULLETIN', 'huge', 0, 0), ('BULLETIN', 'small', 0, 0), ('BULLETIN', 'gone', 1, 0)]
+    sync_reconcile._push_items(items, '!00000002', Peer('!00000001', []))
+    assert len(sent) == 2
+
+
+def test_replies_go_out_on_the_sync_channel():
+    enqueued = []
+    peer = Peer('!00000001', [])
+    peer.nodes = {}
+    peer.sync_channel = 2
+    peer.tx_scheduler.enqueue = lambda frames, destination, label, channel_index, **kwargs: enqueued.append(
+        (destination, channel_index))
+    sync_reconcile._send_record('WANT', [b'\x02' * KEY_SIZE], '!00000002', peer)
+    sync_reconcile._push_items([('BULLETIN', 'gone', 1, 0)], '!00000002', peer)
+    assert enqueued == [('!00000002', 2), ('!00000002', 2)]
@@ -0,0 +1,156 @@
+import itertools
+import threading
+import time
+import types
+
+from meshtastic import BROADCAST_NUM
+
+from airtime import LORA_PRESETS
+from transmit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_SYNC, PRIORITY_URGENT, TransmitScheduler
+
+
+class RadioInterface:
+    """Records what is sent instead of transmitting it."""
+
+    def __init__(self):
+        self.sent = []
+        self.myInfo = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def sendText(self, text, destinationId, wantAck, wantResponse, channelIndex):
+        with self._lock:
+            packet = types.SimpleNamespace(id=next(self._ids), text=text, destination=destinationId)
+            self.sent.append(packet)
+        return packet
+
+
+def make_scheduler(**settings):
+    settings.setdefault('radio_interval', 0)
+    settings.setdefault('destination_interval', 0)
+    settings.setdefault('radio_parameters', LORA_PRESETS['SHORT_TURBO'])
+    return TransmitScheduler(RadioInterface(), **settings)
+
+
+def take(scheduler, now):
+    chunk, _ = scheduler._next_ready(now)
+    return chunk
+
+
+def test_higher_class_goes_first():
+    scheduler = make_scheduler()
+    scheduler.enqueue(['sync'], '!00000001', priority=PRIORITY_SYNC)
+    scheduler.enqueue(['reply'], '!00000002', priority=PRIORITY_INTERACTIVE)
+    scheduler.enqueue(['alert'], '!00000003', priority=PRIORITY_URGENT)
+    now = time.monotonic()
+    assert [take(scheduler, now).text for _ in range(3)] == ['alert', 'reply', 'sync']
+    assert take(scheduler, now) is None
+
+
+def test_destinations_in_a_class_take_turns():
+    scheduler = make_scheduler()
+    scheduler.enqueue(['a1', 'a2'], '!00000001')
+    scheduler.enqueue(['b1', 'b2'], '!00000002')
+    now = time.monotonic()
+    assert [take(scheduler, now).text for _ in range(4)] == ['a1', 'b1', 'a2', 'b2']
+
+
+def test_waiting_chunks_are_promoted():
+    scheduler = make_scheduler(aging_interval=60)
+    scheduler.enqueue(['new'], '!00000002', priority=PRIORITY_SYNC)
+    scheduler.enqueue(['old'], '!00000001', priority=PRIORITY_BACKGROUND)
+    # Queued before the sync chunk and promoted past it after two intervals
+    now = time.monotonic() + 2 * 60
+    scheduler._queues[(PRIORITY_SYNC, '!00000002')][0].enqueued_at = now
+    assert take(scheduler, now).text == 'old'
+
+
+def test_aged_sync_never_overtakes_urgent():
+    scheduler = make_scheduler(aging_interval=60)
+    scheduler.enqueue(['sync0', 'sync1'], '!00000001', priority=PRIORITY_SYNC)
+    now = time.monotonic() + 10 * 60
+    scheduler.enqueue(['URGENT'], BROADCAST_NUM, priority=PRIORITY_URGENT)
+    scheduler.enqueue(['reply'], '!00000002')
+    for key, queue in scheduler._queues.items():
+        if key[0] != PRIORITY_SYNC:
+            queue[0].enqueued_at = now
+    # Aged sync is promoted as far as interactive, where it takes turns with replies
+    assert [take(scheduler, now).text for _ in range(4)] == ['URGENT', 'sync0', 'reply', 'sync1']
+
+
+def test_time_held_back_does_not_count_as_waiting():
+    held = {'!00000001'}
+    peers = types.SimpleNamespace(is_held=lambda node_id: node_id in held, rank=lambda node_id: 0)
+    scheduler = make_scheduler(aging_interval=60, peers=peers)
+    scheduler.enqueue(['sync'], '!00000001', priority=PRIORITY_SYNC)
+    now = time.monotonic() + 10 * 60
+    assert take(scheduler, now) is None
+    held.clear()
+    scheduler.enqueue(['reply'], '!00000002')
+    assert take(scheduler, now + 1).text == 'reply'
+    assert take(scheduler, now + 1).text == 'sync'
+
+
+def test_sync_queue_is_bounded_per_destination():
+    scheduler = make_scheduler(max_queue=2, max_sync_queue=3)
+    assert scheduler.enqueue(['1', '2', '3'], '!00000001', priority=PRIORITY_SYNC)
+    assert not scheduler.enqueue(['4'], '!00000001', priority=PRIORITY_BACKGROUND)
+    assert scheduler.enqueue(['1', '2'], '!00000002', priority=PRIORITY_SYNC)
+    # Sync traffic never takes room from replies to users
+    assert scheduler.enqueue(['reply', 'more'], '!00000003')
+    assert not scheduler.enqueue(['too many'], '!00000003')
+    assert scheduler.get_stats()['dropped'] == 2
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def nak(scheduler, packet):
+    scheduler.handle_routing_packet({'decoded': {'requestId': packet.id, 'routing': {'errorReason': 'NO_RESPONSE'}}})
+
+
+def ack(scheduler, packet):
+    scheduler.handle_routing_packet({'from': 0x1234, 'decoded': {'requestId': packet.id, 'routing': {}}})
+
+
+def test_failed_chunk_is_retried_in_order_then_delivered():
+    scheduler = make_scheduler(retry_backoff=0.05, max_retries=2)
+    outcomes = []
+    scheduler.start()
+    try:
+        scheduler.enqueue(['first', 'second'], '!00000001', on_complete=outcomes.append)
+        radio = scheduler.interface
+        wait_for(lambda: len(radio.sent) == 2)
+        nak(scheduler, radio.sent[0])
+        ack(scheduler, radio.sent[1])
+        wait_for(lambda: len(radio.sent) == 3)
+        assert radio.sent[2].text == 'first'
+        ack(scheduler, radio.sent[2])
+        wait_for(lambda: outcomes)
+    finally:
+        scheduler.stop(drain_timeout=0)
+    assert outcomes == [True]
+    stats = scheduler.get_stats()
+    assert (stats['retries'], stats['naks'], stats['acked'], stats['lost']) == (1, 1, 2, 0)
+
+
+def test_chunk_is_given_up_after_max_retries():
+    scheduler = make_scheduler(retry_backoff=0.01, max_retries=2)
+    outcomes = []
+    scheduler.start()
+    try:
+        scheduler.enqueue(['lost'], '!00000001', on_complete=outcomes.append)
+        radio = scheduler.interface
+        for attempt in range(1, 4):
+            wait_for(lambda: len(radio.sent) == attempt)
+            nak(scheduler, radio.sent[-1])
+        wait_for(lambda: outcomes)
+    finally:
+        scheduler.stop(drain_timeout=0)
+    assert outcomes == [False]
+    assert len(scheduler.interface.sent) == 3
+    assert scheduler.get_stats()['lost'] == 1
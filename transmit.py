@@ -0,0 +1,592 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from meshtastic import BROADCAST_NUM
+
+from airtime import PACKET_OVERHEAD_BYTES, LORA_PRESETS, DEFAULT_PRESET, lora_airtime
+
+# Outbound traffic classes, highest priority first
+PRIORITY_URGENT = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_SYNC = 2
+PRIORITY_BACKGROUND = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_URGENT: 'urgent',
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_SYNC: 'sync',
+    PRIORITY_BACKGROUND: 'background',
+}
+
+
+class MessageCompletion:
+    """
+    Reports the outcome of a queued message to its on_complete callback, exactly once.
+
+    The callback gets True once every chunk has been acknowledged, or False as soon as one chunk
+    is lost. It is called with the scheduler lock held, so it must be quick and must not call
+    back into the scheduler.
+    """
+
+    __slots__ = ('remaining', 'on_complete')
+
+    def __init__(self, chunk_count, on_complete):
+        self.remaining = chunk_count
+        self.on_complete = on_complete
+
+    def chunk_delivered(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self._finish(True)
+
+    def chunk_failed(self):
+        self._finish(False)
+
+    def _finish(self, delivered):
+        on_complete, self.on_complete = self.on_complete, None
+        if on_complete is not None:
+            try:
+                on_complete(delivered)
+            except Exception as e:
+                logging.error(f"Error in message completion callback: {e}")
+
+
+class OutboundChunk:
+    """A single radio packet waiting in the transmit queue."""
+
+    __slots__ = ('text', 'destination', 'label', 'priority', 'airtime', 'enqueued_at', 'held',
+                 'attempts', 'not_before', 'first_sent_at', 'sent_at', 'relayed', 'completion', 'channel_index')
+
+    def __init__(self, text, destination, label, priority, airtime, completion=None, channel_index=0):
+        self.text = text
+        self.destination = destination
+        self.label = label
+        self.priority = priority
+        self.airtime = airtime
+        self.enqueued_at = time.monotonic()
+        self.held = False
+        self.attempts = 0
+        self.not_before = 0.0
+        self.first_sent_at = None
+        self.sent_at = None
+        self.relayed = False
+        self.completion = completion
+        self.channel_index = channel_index
+
+    @property
+    def deferrable(self):
+        return self.priority >= PRIORITY_SYNC
+
+
+class TransmitScheduler:
+    """
+    Owns the radio transmitter and paces outbound packets on a dedicated thread.
+
+    Callers enqueue chunks and return immediately, so the meshtastic receive thread is never
+    blocked by transmit pacing. Two intervals are enforced: one between any two packets on the
+    radio and one between two packets to the same destination.
+
+    Every message is queued with a priority class. There is a FIFO queue per class and
+    destination; the highest class with a chunk ready goes next, and destinations within a
+    class are served round-robin. A chunk is promoted one class for every aging_interval
+    seconds it has waited, up to interactive, so bulk traffic is delayed but never starved and
+    never overtakes urgent traffic. Only time it could have been sent counts: a queue held back
+    by the airtime budget or for an unreachable peer starts aging afresh once it is released.
+
+    The time on air of every packet is estimated from the LoRa settings and recorded in an
+    optional AirtimeBudget. While the budget is used up, sync and background chunks are held
+    back, and are dropped once they have waited longer than max_defer.
+
+    Every packet is sent with wantAck and tracked by the id sendText returns until a routing
+    ACK or NAK for it is passed to handle_routing_packet. A chunk that is NAKed, or that hears
+    nothing within ack_timeout, is put back at the head of its queue after an exponential
+    backoff, up to max_retries times. Only the failed chunk is resent, and later chunks to the
+    same destination wait behind it so the message arrives in order. A message can be given an
+    on_complete callback to learn whether all of its chunks were delivered.
+
+    With a peers.PeerTable, delivery outcomes are reported to it, traffic for peers it considers
+    unreachable stays queued until they are heard again, and within a class healthier peers are
+    served first.
+
+    Parameters:
+    -----------
+    interface : meshtastic.stream_interface.StreamInterface
+        Interface used to transmit.
+    max_queue : int
+        Maximum number of urgent and interactive chunks waiting across all destinations. New
+        messages are dropped when the queue is full.
+    max_sync_queue : int
+        Maximum number of sync and background chunks waiting for any one destination. They are
+        bounded per destination so that a peer that is down for long can only fill its own
+        queue, never crowd out replies to users; the sync outbox resends what is dropped.
+    radio_interval : float
+        Minimum seconds between any two transmissions.
+    destination_interval : float
+        Minimum seconds between two transmissions to the same destination.
+    max_payload_bytes : int
+        Largest text payload, in UTF-8 bytes, that fits in a single packet.
+    radio_parameters : tuple
+        (spreading factor, bandwidth, coding rate) used to estimate time on air.
+    budget : airtime.AirtimeBudget
+        Airtime budget to enforce, or None to only record airtime in the stats.
+    max_defer : float
+        Seconds a sync or background chunk may be held back by the budget before it is dropped.
+        0 holds it for as long as it takes.
+    aging_interval : float
+        Seconds of waiting after which a chunk is treated as one class more urgent, up to interactive.
+    ack_timeout : float
+        Seconds to wait for a routing ACK or NAK before a chunk is considered lost.
+    max_retries : int
+        How many times a failed chunk is resent before giving up on it.
+    retry_backoff : float
+        Delay before the first retry. It doubles with every further attempt.
+    peers : peers.PeerTable
+        Health of the peer BBS nodes, or None to treat every destination alike.
+    """
+
+    def __init__(self, interface, max_queue=500, max_sync_queue=200, radio_interval=1.0, destination_interval=2.0, max_payload_bytes=200,
+                 radio_parameters=None, budget=None, max_defer=0, aging_interval=60, ack_timeout=60, max_retries=2,
+                 retry_backoff=10, peers=None):
+        self.interface = interface
+        self.max_queue = max_queue
+        self.max_sync_queue = max_sync_queue
+        self.radio_interval = radio_interval
+        self.destination_interval = destination_interval
+        self.max_payload_bytes = max_payload_bytes
+        self.radio_parameters = radio_parameters or LORA_PRESETS[DEFAULT_PRESET]
+        self.budget = budget
+        self.max_defer = max_defer
+        self.aging_interval = aging_interval
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.peers = peers
+        if peers is not None:
+            peers.scheduler = self
+
+        self._queues = {}
+        self._blocked_at = {}
+        self._rotation = deque()
+        self._last_sent = {}
+        self._last_radio_send = 0.0
+        self._last_airtime = 0.0
+        self._depth = 0
+        self._interactive_depth = 0
+        self._in_flight = {}
+        self._delivery = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self._stats = {
+            'enqueued': 0,
+            'sent': 0,
+            'dropped': 0,
+            'shed': 0,
+            'deferred': 0,
+            'errors': 0,
+            'acked': 0,
+            'naks': 0,
+            'timeouts': 0,
+            'retries': 0,
+            'lost': 0,
+            'airtime': 0.0,
+            'max_depth': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+        }
+        self._class_stats = {priority: {'sent': 0, 'total_wait': 0.0} for priority in PRIORITY_NAMES}
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='tx-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, drain_timeout=10.0):
+        """Stops the transmit thread, giving queued chunks up to drain_timeout seconds to go out."""
+        deadline = time.monotonic() + drain_timeout
+        with self._condition:
+            while self._depth and time.monotonic() < deadline:
+                self._condition.wait(timeout=0.5)
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._depth:
+            logging.warning(f"Transmit scheduler stopped with {self._depth} chunk(s) still queued.")
+
+    def wake(self):
+        """Makes the transmit thread look at the queues again, e.g. after a held peer was heard."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def estimate_airtime(self, text):
+        return lora_airtime(len(text.encode('utf-8')) + PACKET_OVERHEAD_BYTES, *self.radio_parameters)
+
+    def enqueue(self, chunks, destination, label=None, priority=PRIORITY_INTERACTIVE, on_complete=None,
+                channel_index=0):
+        """
+        Queues the chunks of one message for a destination at the given priority class.
+
+        on_complete, if given, is called with True once every chunk has been acknowledged or with
+        False if any chunk is lost; see MessageCompletion. channel_index selects the channel the
+        chunks are sent on.
+
+        Returns True if the message was queued, False if the queue did not have room for it.
+        """
+        completion = MessageCompletion(len(chunks), on_complete) if on_complete else None
+        with self._condition:
+            if priority >= PRIORITY_SYNC:
+                depth = self._sync_depth(destination)
+                full = depth + len(chunks) > self.max_sync_queue
+                limit = self.max_sync_queue
+            else:
+                depth = self._interactive_depth
+                full = depth + len(chunks) > self.max_queue
+                limit = self.max_queue
+            if full:
+                self._stats['dropped'] += len(chunks)
+                logging.warning(f"Transmit queue full ({depth}/{limit} {PRIORITY_NAMES[priority]}), "
+                                f"dropping message to {label or destination}")
+                if completion:
+                    completion.chunk_failed()
+                return False
+
+            key = (priority, destination)
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+                self._rotation.append(key)
+            for text in chunks:
+                queue.append(OutboundChunk(text, destination, label, priority, self.estimate_airtime(text), completion,
+                                           channel_index))
+
+            self._depth += len(chunks)
+            if priority < PRIORITY_SYNC:
+                self._interactive_depth += len(chunks)
+            self._stats['enqueued'] += len(chunks)
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._depth)
+            self._condition.notify_all()
+        return True
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats['depth'] = self._depth
+            stats['destinations'] = len({destination for _, destination in self._queues})
+            stats['oldest_wait'] = max(
+                (time.monotonic() - queue[0].enqueued_at for queue in self._queues.values()), default=0.0)
+            stats['classes'] = {}
+            for priority, name in PRIORITY_NAMES.items():
+                class_stats = self._class_stats[priority]
+                stats['classes'][name] = {
+                    'depth': sum(len(queue) for key, queue in self._queues.items() if key[0] == priority),
+                    'sent': class_stats['sent'],
+                    'avg_wait': class_stats['total_wait'] / class_stats['sent'] if class_stats['sent'] else 0.0,
+                }
+            stats['in_flight'] = len(self._in_flight)
+        stats['avg_wait'] = stats['total_wait'] / stats['sent'] if stats['sent'] else 0.0
+        stats['utilisation'] = self.budget.utilisation() if self.budget else None
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logging.info(f"TX QUEUE: depth {stats['depth']} (max {stats['max_depth']}) across {stats['destinations']} destination(s), "
+                     f"sent {stats['sent']}, dropped {stats['dropped']}, errors {stats['errors']}, "
+                     f"wait avg {stats['avg_wait']:.1f}s max {stats['max_wait']:.1f}s, oldest queued {stats['oldest_wait']:.1f}s")
+        logging.info("TX CLASSES: " + ", ".join(
+            f"{name} {class_stats['depth']} queued/{class_stats['sent']} sent/{class_stats['avg_wait']:.1f}s avg wait"
+            for name, class_stats in stats['classes'].items()))
+        logging.info(f"TX DELIVERY: {stats['in_flight']} awaiting ack, {stats['acked']} acked, {stats['naks']} nak(s), "
+                     f"{stats['timeouts']} timeout(s), {stats['retries']} retried, {stats['lost']} lost")
+        busiest = sorted(self.get_delivery_stats().items(), key=lambda item: item[1]['sent'], reverse=True)
+        for destination, delivery in busiest[:10]:
+            logging.info(f"TX DELIVERY {delivery['label'] or destination}: {delivery['sent']} sent, "
+                         f"loss {delivery['loss_rate']:.0%}, latency avg {delivery['avg_latency']:.1f}s "
+                         f"max {delivery['max_latency']:.1f}s")
+        if self.budget:
+            logging.info(f"TX AIRTIME: {stats['utilisation']:.1f}% of the last {self.budget.window}s used "
+                         f"(limit {self.budget.max_duty_cycle:.1f}%), {stats['airtime']:.1f}s total, "
+                         f"deferred {stats['deferred']}, shed {stats['shed']}")
+
+    def get_destination_depths(self):
+        """Returns the number of queued chunks per destination."""
+        with self._condition:
+            depths = {}
+            for (_, destination), queue in self._queues.items():
+                depths[destination] = depths.get(destination, 0) + len(queue)
+        return depths
+
+    def get_delivery_stats(self):
+        """
+        Returns delivery statistics per destination.
+
+        loss_rate is the share of transmissions that were NAKed or timed out, including ones
+        that were later delivered by a retry. avg_latency is measured from the first
+        transmission of a chunk to its ACK.
+        """
+        with self._condition:
+            delivery = {destination: dict(entry) for destination, entry in self._delivery.items()}
+        for entry in delivery.values():
+            entry['loss_rate'] = entry['failed'] / entry['sent'] if entry['sent'] else 0.0
+            entry['avg_latency'] = entry['total_latency'] / entry['acked'] if entry['acked'] else 0.0
+        return delivery
+
+    def _delivery_entry(self, chunk):
+        entry = self._delivery.get(chunk.destination)
+        if entry is None:
+            entry = self._delivery[chunk.destination] = {
+                'label': chunk.label, 'sent': 0, 'acked': 0, 'failed': 0, 'lost': 0,
+                'total_latency': 0.0, 'max_latency': 0.0,
+            }
+        return entry
+
+    def handle_routing_packet(self, packet):
+        """
+        Processes a ROUTING_APP packet from the radio, resolving the chunk it acknowledges.
+
+        An ACK sent by the node itself is an implicit ACK: the packet was heard being relayed.
+        For broadcasts that is the only ACK there will be. For direct messages it is noted and
+        the chunk stays in flight until the destination's own ACK arrives or the timeout passes.
+        """
+        decoded = packet.get('decoded', {})
+        request_id = decoded.get('requestId')
+        if request_id is None:
+            return
+        error = decoded.get('routing', {}).get('errorReason', 'NONE')
+        now = time.monotonic()
+
+        with self._condition:
+            chunk = self._in_flight.get(request_id)
+            if chunk is None:
+                return
+
+            if error != 'NONE':
+                del self._in_flight[request_id]
+                self._stats['naks'] += 1
+                logging.info(f"Message {request_id} to {chunk.label or chunk.destination} was not delivered: {error}")
+                self._retry(chunk, now)
+                return
+
+            implicit = packet.get('from') == getattr(getattr(self.interface, 'myInfo', None), 'my_node_num', None)
+            if implicit and chunk.destination != BROADCAST_NUM:
+                chunk.relayed = True
+                return
+
+            del self._in_flight[request_id]
+            latency = now - chunk.first_sent_at
+            entry = self._delivery_entry(chunk)
+            entry['acked'] += 1
+            entry['total_latency'] += latency
+            entry['max_latency'] = max(entry['max_latency'], latency)
+            self._stats['acked'] += 1
+            self._record_outcome(chunk, True)
+
+    def _record_outcome(self, chunk, delivered):
+        if self.peers is not None:
+            self.peers.record_delivery(chunk.destination, delivered)
+        if chunk.completion:
+            if delivered:
+                chunk.completion.chunk_delivered()
+            elif chunk.attempts > self.max_retries:
+                chunk.completion.chunk_failed()
+
+    def _retry(self, chunk, now):
+        """Puts a failed chunk back at the head of its queue after a backoff. Caller holds the lock."""
+        self._delivery_entry(chunk)['failed'] += 1
+        self._record_outcome(chunk, False)
+        if chunk.attempts > self.max_retries:
+            self._delivery_entry(chunk)['lost'] += 1
+            self._stats['lost'] += 1
+            logging.warning(f"Giving up on message to {chunk.label or chunk.destination} after {chunk.attempts} attempt(s)")
+            return
+
+        backoff = self.retry_backoff * 2 ** (chunk.attempts - 1)
+        chunk.not_before = now + backoff + random.uniform(0, backoff / 2)
+        chunk.relayed = False
+        key = (chunk.priority, chunk.destination)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._rotation.append(key)
+        # Ahead of every chunk queued after it, so several retried chunks keep their order
+        position = next((i for i, queued in enumerate(queue) if queued.enqueued_at > chunk.enqueued_at), len(queue))
+        queue.insert(position, chunk)
+        self._depth += 1
+        if not chunk.deferrable:
+            self._interactive_depth += 1
+        self._stats['retries'] += 1
+        self._condition.notify_all()
+
+    def _expire_in_flight(self, now):
+        """Retries chunks that have heard nothing within ack_timeout, returning seconds until the next expiry."""
+        next_expiry = None
+        for request_id, chunk in list(self._in_flight.items()):
+            expires_in = chunk.sent_at + self.ack_timeout - now
+            if expires_in > 0:
+                next_expiry = expires_in if next_expiry is None else min(next_expiry, expires_in)
+                continue
+            del self._in_flight[request_id]
+            if chunk.relayed:
+                # Heard being relayed but never confirmed by the destination. Resending would
+                # most likely duplicate it, so count it as delivered without a latency sample.
+                self._delivery_entry(chunk)['acked'] += 1
+                self._stats['acked'] += 1
+                self._record_outcome(chunk, True)
+                continue
+            self._stats['timeouts'] += 1
+            self._retry(chunk, now)
+        return next_expiry
+
+    def _shed_deferred(self, now):
+        """Drops deferrable chunks that have been held back longer than max_defer."""
+        for key in list(self._rotation):
+            queue = self._queues[key]
+            kept = deque(chunk for chunk in queue if not (chunk.deferrable and now - chunk.enqueued_at > self.max_defer))
+            shed = len(queue) - len(kept)
+            if not shed:
+                continue
+            for chunk in queue:
+                if chunk.completion and chunk not in kept:
+                    chunk.completion.chunk_failed()
+            logging.warning(f"Airtime budget exhausted, shedding {shed} deferred {PRIORITY_NAMES[key[0]]} chunk(s) "
+                            f"to {queue[0].label or key[1]}")
+            self._depth -= shed
+            self._stats['shed'] += shed
+            if kept:
+                self._queues[key] = kept
+            else:
+                del self._queues[key]
+                self._blocked_at.pop(key, None)
+                self._rotation.remove(key)
+
+    def _sync_depth(self, destination):
+        return sum(len(queue) for (priority, queued_destination), queue in self._queues.items()
+                   if queued_destination == destination and priority >= PRIORITY_SYNC)
+
+    def _effective_priority(self, key, chunk, now):
+        if not self.aging_interval or chunk.priority <= PRIORITY_INTERACTIVE:
+            return chunk.priority
+        # Aged from when its queue was last held back, if that came after the chunk was queued
+        waited = now - max(chunk.enqueued_at, self._blocked_at.get(key, 0.0))
+        return max(chunk.priority - int(waited / self.aging_interval), PRIORITY_INTERACTIVE)
+
+    def _next_ready(self, now):
+        """Returns (chunk, 0) for the next chunk allowed on air, or (None, seconds_to_wait)."""
+        radio_wait = self._last_radio_send + max(self.radio_interval, self._last_airtime) - now
+        if radio_wait > 0:
+            return None, radio_wait
+
+        over_budget = self.budget is not None and not self.budget.has_room(now)
+        if over_budget and self.max_defer:
+            self._shed_deferred(now)
+
+        wait = None
+        best_key = None
+        best_rank = None
+        for key in self._rotation:
+            if self.peers is not None and self.peers.is_held(key[1]):
+                self._blocked_at[key] = now
+                continue
+            head = self._queues[key][0]
+            if head.not_before > now:
+                retry_wait = head.not_before - now
+                wait = retry_wait if wait is None else min(wait, retry_wait)
+                continue
+            if over_budget and head.deferrable:
+                self._blocked_at[key] = now
+                if not head.held:
+                    head.held = True
+                    self._stats['deferred'] += 1
+                budget_wait = self.budget.seconds_until_room(now)
+                if self.max_defer:
+                    budget_wait = min(budget_wait, max(head.enqueued_at + self.max_defer - now, 0.1))
+                wait = budget_wait if wait is None else min(wait, budget_wait)
+                continue
+            destination_wait = self._last_sent.get(key[1], 0.0) + self.destination_interval - now
+            if destination_wait > 0:
+                wait = destination_wait if wait is None else min(wait, destination_wait)
+                continue
+            rank = (self._effective_priority(key, head, now), self.peers.rank(key[1]) if self.peers is not None else 0)
+            if best_rank is None or rank < best_rank:
+                best_key, best_rank = key, rank
+
+        if best_key is None:
+            return None, wait
+
+        # Move the chosen queue to the back so queues of the same class take turns
+        self._rotation.remove(best_key)
+        queue = self._queues[best_key]
+        chunk = queue.popleft()
+        if queue:
+            self._rotation.append(best_key)
+        else:
+            del self._queues[best_key]
+            self._blocked_at.pop(best_key, None)
+        return chunk, 0
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._running:
+                        return
+                    now = time.monotonic()
+                    expiry_wait = self._expire_in_flight(now)
+                    chunk, wait = self._next_ready(now)
+                    if chunk:
+                        break
+                    if expiry_wait is not None:
+                        wait = expiry_wait if wait is None else min(wait, expiry_wait)
+                    self._condition.wait(timeout=wait)
+
+                self._depth -= 1
+                if not chunk.deferrable:
+                    self._interactive_depth -= 1
+                self._last_sent[chunk.destination] = now
+                self._last_radio_send = now
+                self._last_airtime = chunk.airtime
+                self._stats['airtime'] += chunk.airtime
+                waited = now - chunk.enqueued_at
+                self._stats['total_wait'] += waited
+                self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+                self._class_stats[chunk.priority]['sent'] += 1
+                self._class_stats[chunk.priority]['total_wait'] += waited
+                chunk.attempts += 1
+                chunk.sent_at = now
+                if chunk.first_sent_at is None:
+                    chunk.first_sent_at = now
+                self._delivery_entry(chunk)['sent'] += 1
+                self._condition.notify_all()
+
+            if self.budget is not None:
+                self.budget.record(chunk.airtime, now)
+            self._transmit(chunk)
+
+    def _transmit(self, chunk):
+        try:
+            d = self.interface.sendText(
+                text=chunk.text,
+                destinationId=chunk.destination,
+                wantAck=True,
+                wantResponse=False,
+                channelIndex=chunk.channel_index
+            )
+            with self._condition:
+                self._stats['sent'] += 1
+                self._in_flight[d.id] = chunk
+            text = chunk.text.replace('\n', '\\n')
+            retry = f" (attempt {chunk.attempts})" if chunk.attempts > 1 else ""
+            logging.info(f"Sending message to {chunk.label or chunk.destination} with sendID {d.id}{retry}: \"{text}\"")
+        except Exception as e:
+            with self._condition:
+                self._stats['errors'] += 1
+                if chunk.completion:
+                    chunk.completion.chunk_failed()
+            logging.info(f"REPLY SEND ERROR {e}")
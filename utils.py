@@ -1,7 +1,19 @@
 import logging
-import time
+import re
+import threading
+import unicodedata
+
+from meshtastic import BROADCAST_NUM
+
+from db_writer import after_commit
+from sync_protocol import encode_sync_frames, encode_legacy_sync_message
+from transmit import TransmitScheduler, PRIORITY_INTERACTIVE, PRIORITY_SYNC
 
 user_states = {}
+_scheduler_lock = threading.Lock()
+
+# Stands for every peer BBS when sync is multicast on the sync channel
+SYNC_MULTICAST = '^all'
 
 
 def update_user_state(user_id, state):
@@ -12,25 +24,109 @@ def get_user_state(user_id):
     return user_states.get(user_id, None)
 
 
-def send_message(message, destination, interface):
-    max_payload_size = 200
-    for i in range(0, len(message), max_payload_size):
-        chunk = message[i:i + max_payload_size]
-        try:
-            d = interface.sendText(
-                text=chunk,
-                destinationId=destination,
-                wantAck=True,
-                wantResponse=False
-            )
-            destid = get_node_id_from_num(destination, interface)
-            chunk = chunk.replace('\n', '\\n')
-            logging.info(f"Sending message to user '{get_node_short_name(destid, interface)}' ({destid}) with sendID {d.id}: \"{chunk}\"")
-        except Exception as e:
-            logging.info(f"REPLY SEND ERROR {e.message}")
-
-        
-        time.sleep(2)
+def get_transmit_scheduler(interface):
+    scheduler = getattr(interface, 'tx_scheduler', None)
+    if scheduler is None:
+        with _scheduler_lock:
+            scheduler = getattr(interface, 'tx_scheduler', None)
+            if scheduler is None:
+                scheduler = TransmitScheduler(interface)
+                scheduler.start()
+                interface.tx_scheduler = scheduler
+    return scheduler
+
+
+def _utf8_len(text):
+    return len(text.encode('utf-8'))
+
+
+def _is_cluster_extender(char):
+    codepoint = ord(char)
+    return (unicodedata.combining(char)
+            or 0xFE00 <= codepoint <= 0xFE0F      # variation selectors, e.g. the one in ✉️
+            or 0x1F3FB <= codepoint <= 0x1F3FF    # emoji skin tone modifiers
+            or 0xE0020 <= codepoint <= 0xE007F    # emoji tag sequences
+            or codepoint == 0x200D)               # zero width joiner
+
+
+def _split_clusters(text):
+    """Splits text into user-perceived characters so emoji sequences are never broken apart."""
+    clusters = []
+    for char in text:
+        if clusters and (_is_cluster_extender(char) or clusters[-1].endswith('\u200d')):
+            clusters[-1] += char
+        else:
+            clusters.append(char)
+    return clusters
+
+
+def pack_message(message, max_bytes=200):
+    """
+    Splits a message into packets of at most max_bytes of UTF-8.
+
+    Packets are filled greedily and broken at line ends where possible, then at word
+    boundaries, and only as a last resort inside a word. A break never falls inside a
+    multi-byte character or an emoji sequence. Whitespace at a break is dropped since each
+    packet is shown as its own message.
+    """
+    if _utf8_len(message) <= max_bytes:
+        return [message] if message else []
+
+    packets = []
+    current = ''
+    current_len = 0
+
+    def flush():
+        nonlocal current, current_len
+        packet = current.rstrip()
+        if packet:
+            packets.append(packet)
+        current = ''
+        current_len = 0
+
+    for line in message.splitlines(keepends=True):
+        line_len = _utf8_len(line)
+        if current_len + line_len <= max_bytes:
+            current += line
+            current_len += line_len
+            continue
+        if line_len <= max_bytes:
+            flush()
+            current, current_len = line, line_len
+            continue
+
+        for word in re.split(r'(\s+)', line):
+            word_len = _utf8_len(word)
+            if current_len + word_len <= max_bytes:
+                current += word
+                current_len += word_len
+                continue
+            if word.isspace():
+                flush()
+                continue
+            if word_len <= max_bytes:
+                flush()
+                current, current_len = word, word_len
+                continue
+            for cluster in _split_clusters(word):
+                cluster_len = _utf8_len(cluster)
+                if current_len + cluster_len > max_bytes:
+                    flush()
+                current += cluster
+                current_len += cluster_len
+    flush()
+    return packets
+
+
+def _destination_label(destination, interface):
+    destid = destination if isinstance(destination, str) else get_node_id_from_num(destination, interface)
+    return f"user '{get_node_short_name(destid, interface)}' ({destid})"
+
+
+def send_message(message, destination, interface, priority=PRIORITY_INTERACTIVE):
+    scheduler = get_transmit_scheduler(interface)
+    chunks = pack_message(message, scheduler.max_payload_bytes)
+    return scheduler.enqueue(chunks, destination, _destination_label(destination, interface), priority=priority)
 
 
 def get_node_info(interface, short_name):
@@ -54,34 +150,90 @@ def get_node_short_name(node_id, interface):
     return None
 
 
-def send_bulletin_to_bbs_nodes(board, sender_short_name, subject, content, unique_id, bbs_nodes, interface):
-    message = f"BULLETIN|{board}|{sender_short_name}|{subject}|{content}|{unique_id}"
-    for node_id in bbs_nodes:
-        send_message(message, node_id, interface)
-
-
-def send_mail_to_bbs_nodes(sender_id, sender_short_name, recipient_id, subject, content, unique_id, bbs_nodes,
-                           interface):
-    message = f"MAIL|{sender_id}|{sender_short_name}|{recipient_id}|{subject}|{content}|{unique_id}"
+def encode_sync(interface, record_type, *fields):
+    """Returns the list of messages that carry one sync record, each fitting in a single packet."""
+    max_payload_bytes = get_transmit_scheduler(interface).max_payload_bytes
+    if getattr(interface, 'sync_wire_format', 'compact') == 'legacy':
+        # Legacy records are plain text, packed into packets the same way as any other message
+        return pack_message(encode_legacy_sync_message(record_type, *fields), max_payload_bytes)
+    return encode_sync_frames(record_type, fields, max_payload_bytes)
+
+
+def sync_destinations(interface, bbs_nodes):
+    """Returns where sync records for bbs_nodes go: the peers themselves, or SYNC_MULTICAST in multicast mode."""
+    if bbs_nodes and getattr(interface, 'sync_channel', None) is not None:
+        return [SYNC_MULTICAST]
+    return list(bbs_nodes)
+
+
+def send_sync_message(frames, destination, interface, priority=PRIORITY_SYNC, on_complete=None):
+    """
+    Queues the frames of one sync record for a peer, or for SYNC_MULTICAST, as a single message.
+
+    on_complete is passed on to the transmit scheduler and learns whether every frame was delivered.
+    A multicast message counts as delivered once another node is heard relaying it; peers that
+    still miss it catch up through reconciliation. In multicast mode records for a single peer,
+    such as reconciliation replies, are sent on the sync channel too.
+    """
+    scheduler = get_transmit_scheduler(interface)
+    sync_channel = getattr(interface, 'sync_channel', None)
+    if destination == SYNC_MULTICAST:
+        return scheduler.enqueue(frames, BROADCAST_NUM, f"sync channel {sync_channel}", priority=priority,
+                                 on_complete=on_complete, channel_index=sync_channel)
+    return scheduler.enqueue(frames, destination, _destination_label(destination, interface), priority=priority,
+                             on_complete=on_complete, channel_index=sync_channel or 0)
+
+
+def queue_sync_record(c, interface, record_type, fields, bbs_nodes):
+    """
+    Sends a sync record to every node in bbs_nodes. Called from the write function that stored
+    the change, with its cursor c; nothing is sent unless that write is committed.
+
+    With a sync outbox the record is journaled first, in the write's own transaction, and
+    delivered from the outbox. Otherwise it goes through the sync batcher when there is one, or
+    straight to the transmit scheduler. In multicast mode it is sent once on the sync channel
+    instead of to each peer.
+    """
+    bbs_nodes = sync_destinations(interface, bbs_nodes)
+    if not bbs_nodes:
+        return
+    outbox = getattr(interface, 'sync_outbox', None)
+    if outbox is not None:
+        outbox.add(c, record_type, fields, bbs_nodes)
+        return
+    batcher = getattr(interface, 'sync_batcher', None)
+    if batcher is not None and getattr(interface, 'sync_wire_format', 'compact') != 'legacy':
+        after_commit(lambda: batcher.add(record_type, fields, bbs_nodes))
+        return
+
+    def send():
+        frames = encode_sync(interface, record_type, *fields)
+        for node_id in bbs_nodes:
+            send_sync_message(frames, node_id, interface)
+    after_commit(send)
+
+
+def send_bulletin_to_bbs_nodes(c, board, sender_short_name, subject, content, unique_id, created_at, bbs_nodes,
+                               interface):
+    queue_sync_record(c, interface, 'BULLETIN', [board, sender_short_name, subject, content, unique_id, created_at],
+                      bbs_nodes)
+
+
+def send_mail_to_bbs_nodes(c, sender_id, sender_short_name, recipient_id, subject, content, unique_id, created_at,
+                           bbs_nodes, interface):
     logging.info(f"SERVER SYNC: Syncing new mail message {subject} sent from {sender_short_name} to other BBS systems.")
-    for node_id in bbs_nodes:
-        send_message(message, node_id, interface)
+    queue_sync_record(c, interface, 'MAIL',
+                      [sender_id, sender_short_name, recipient_id, subject, content, unique_id, created_at], bbs_nodes)
 
 
-def send_delete_bulletin_to_bbs_nodes(bulletin_id, bbs_nodes, interface):
-    message = f"DELETE_BULLETIN|{bulletin_id}"
-    for node_id in bbs_nodes:
-        send_message(message, node_id, interface)
+def send_delete_bulletin_to_bbs_nodes(c, bulletin_id, bbs_nodes, interface):
+    queue_sync_record(c, interface, 'DELETE_BULLETIN', [bulletin_id], bbs_nodes)
 
 
-def send_delete_mail_to_bbs_nodes(unique_id, bbs_nodes, interface):
-    message = f"DELETE_MAIL|{unique_id}"
+def send_delete_mail_to_bbs_nodes(c, unique_id, bbs_nodes, interface):
     logging.info(f"SERVER SYNC: Sending delete mail sync message with unique_id: {unique_id}")
-    for node_id in bbs_nodes:
-        send_message(message, node_id, interface)
+    queue_sync_record(c, interface, 'DELETE_MAIL', [unique_id], bbs_nodes)
 
 
-def send_channel_to_bbs_nodes(name, url, bbs_nodes, interface):
-    message = f"CHANNEL|{name}|{url}"
-    for node_id in bbs_nodes:
-        send_message(message, node_id, interface)
+def send_channel_to_bbs_nodes(c, name, url, bbs_nodes, interface):
+    queue_sync_record(c, interface, 'CHANNEL', [name, url], bbs_nodes)